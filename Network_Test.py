@@ -1,9 +1,50 @@
+import argparse
+import csv
+import json
+import math
 import socket
 import struct
 import time
 import threading
 import tkinter as tk
 from tkinter import ttk, scrolledtext
+import numpy as np
+
+from StreamAudio_Protocol import (PACKET_SYNC, HEADER_SIZE, DEFAULT_MTU, parse_header, parse_sync,
+                                  build_sync_request, build_sync_reply)
+from StreamAudio_Codec import ENCODING_PCM16, payload_size
+from StreamAudio_Receiver import ClockSync, open_multicast_socket
+from StreamAudio_Socket import (SocketTuning, DSCP_CLASSES, DEFAULT_DSCP, SEND_BUFFER_TIME, socket_buffer_size)
+
+# Профили задержки (должны совпадать с сервером)
+LATENCY_PROFILES = {
+    'Минимальная': {'chunk': 128, 'rate': 44100},
+    'Низкая': {'chunk': 256, 'rate': 44100},
+    'Средняя': {'chunk': 512, 'rate': 44100},
+    'Высокая': {'chunk': 1024, 'rate': 44100}
+}
+CHANNELS = 2
+
+# Замер профилей из командной строки: отправитель шагает по чанкам и нагрузке,
+# приёмник меряет потери, джиттер и задержку в одну сторону с поправкой на часы отправителя
+SWEEP_GROUP = '224.1.1.9'
+SWEEP_PORT = 5017  # Отдельно от живого потока, чтобы клиенты не играли пакеты замера
+SWEEP_MAGIC = b'SWP1'
+# magic, шаг, чанк, потоков, поток, фрагмент, фрагментов, номер, пакетов в шаге, время отправки (мкс)
+SWEEP_HEADER = struct.Struct('!4sHHBBBBIIQ')
+SWEEP_END = 0xFFFF  # Шаг "замер окончен"
+SWEEP_RATE = 44100
+SWEEP_SECONDS = 5.0
+SWEEP_STREAMS = '1,2,4'
+SWEEP_PAUSE = 1.0  # Между шагами: очереди опустевают, приёмник успевает синхронизировать часы
+SWEEP_SYNC_INTERVAL = 0.2
+SWEEP_TIMEOUT = 30.0
+SWEEP_RECEIVE_BUFFER = 1 << 20  # Замер меряет сеть, а не переполнение буфера приёма
+SWEEP_PERCENTILE = 99
+SWEEP_LOSS_TARGET = 0.1  # % потерь, при которых профиль считается выдерживаемым
+SWEEP_MIN_PLAYOUT_MS = 20
+SWEEP_CSV = 'network_sweep.csv'
+SWEEP_JSON = 'network_sweep.json'
 
 class MulticastTesterGUI:
     def __init__(self, root):
@@ -391,8 +432,297 @@ def test_multicast():
     sock_send.close()
     sock_recv.close()
 
-if __name__ == "__main__":
+def sweep_steps(chunks, stream_levels):
+    """Шаги замера: каждый профиль при каждой нагрузке (потоков одновременно)"""
+    return [(chunk, streams) for streams in stream_levels for chunk in chunks]
+
+
+def sweep_send(group, port, steps, seconds=SWEEP_SECONDS, mtu=DEFAULT_MTU, rate=SWEEP_RATE, tuning=None):
+    """Отправитель замера: на каждом шаге пакеты размером чанка PCM стерео в темпе профиля,
+    больше MTU - фрагментами, как у сервера. Отвечает на SYNC, чтобы приёмник вычел смещение часов"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', 0))
+    sock.settimeout(0.1)
+    tuning = tuning or SocketTuning()
+    largest = max(chunk for chunk, _ in steps)
+    tuning.apply_sender(sock, socket_buffer_size(largest, rate, SEND_BUFFER_TIME, mtu=mtu) *
+                        max(streams for _, streams in steps))
+    print(f"[DEBUG] Сокет: {tuning.report()}")
+
+    running = True
+
+    def answer_sync():
+        while running:
+            try:
+                data, addr = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            received_us = int(time.time() * 1000000)
+            header = parse_header(data)
+            if header is not None and header[0] == PACKET_SYNC:
+                sock.sendto(build_sync_reply(data, received_us, int(time.time() * 1000000)), addr)
+
+    sync_thread = threading.Thread(target=answer_sync, daemon=True)
+    sync_thread.start()
+    address = (group, port)
+    try:
+        time.sleep(SWEEP_PAUSE)
+        for step, (chunk, streams) in enumerate(steps):
+            interval = chunk / rate
+            packet_size = HEADER_SIZE + payload_size(CHANNELS, ENCODING_PCM16, chunk)
+            fragments = math.ceil(packet_size / mtu)
+            padding = [b'\0' * (min(mtu, packet_size - f * mtu) - SWEEP_HEADER.size) for f in range(fragments)]
+            count = math.ceil(seconds / interval)
+            print(f"[INFO] Шаг {step + 1}/{len(steps)}: chunk {chunk}, потоков {streams}, "
+                  f"{packet_size} байт ({fragments} датаграмм), {1 / interval:.0f} пакетов/с")
+            next_time = time.time()
+            for seq in range(count):
+                send_us = int(time.time() * 1000000)
+                for stream in range(streams):
+                    for fragment in range(fragments):
+                        sock.sendto(SWEEP_HEADER.pack(SWEEP_MAGIC, step, chunk, streams, stream, fragment, fragments,
+                                                      seq, count, send_us) + padding[fragment], address)
+                next_time += interval
+                delay = next_time - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            time.sleep(SWEEP_PAUSE)
+        for _ in range(3):
+            sock.sendto(SWEEP_HEADER.pack(SWEEP_MAGIC, SWEEP_END, 0, 0, 0, 0, 1, 0, 0, 0), address)
+        # Приёмник ещё может синхронизироваться после последнего шага
+        time.sleep(SWEEP_PAUSE)
+    finally:
+        running = False
+        sync_thread.join()
+        sock.close()
+
+
+class SweepStep:
+    """Приём одного шага: собранные пакеты (все фрагменты) и время их пути"""
+
+    def __init__(self, chunk, streams, count):
+        self.chunk = chunk
+        self.streams = streams
+        self.count = count
+        self.fragments = {}  # (поток, номер) -> принято фрагментов
+        self.transits = []  # Приём по часам приёмника минус отправка по часам отправителя, с
+        self.jitter = [0.0] * streams
+        self.last_transit = [None] * streams
+        self.packet_size = 0
+        self.datagrams = 0
+
+    def add(self, stream, seq, fragments, send_us, size, now):
+        key = (stream, seq)
+        received = self.fragments.get(key, 0) + 1
+        self.fragments[key] = received
+        self.packet_size += size
+        self.datagrams += 1
+        if received != fragments:
+            return
+        transit = now - send_us / 1000000
+        self.transits.append(transit)
+        # Джиттер по RFC 3550 на каждом потоке, смещение часов на него не влияет
+        last = self.last_transit[stream]
+        if last is not None:
+            self.jitter[stream] += (abs(transit - last) - self.jitter[stream]) / 16
+        self.last_transit[stream] = transit
+
+    def result(self, step, rate, offset):
+        """Строка результатов; offset - время отправителя минус время приёмника (с)"""
+        expected = self.count * self.streams
+        received = len(self.transits)
+        interval = self.chunk / rate
+        row = {
+            'step': step,
+            'chunk': self.chunk,
+            'streams': self.streams,
+            'packet_bytes': HEADER_SIZE + payload_size(CHANNELS, ENCODING_PCM16, self.chunk),
+            'packets_per_sec': round(self.streams / interval, 1),
+            'mbps': round(self.packet_size * 8 / (self.count * interval) / 1000000, 3),
+            'sent': expected,
+            'received': received,
+            'loss_percent': round((expected - received) / expected * 100, 3) if expected else 100.0,
+            'jitter_ms': round(max(self.jitter) * 1000, 3),
+        }
+        if received:
+            delays = (np.array(self.transits) + offset) * 1000
+            row.update(owd_min_ms=round(float(delays.min()), 3),
+                       owd_p50_ms=round(float(np.percentile(delays, 50)), 3),
+                       owd_p99_ms=round(float(np.percentile(delays, SWEEP_PERCENTILE)), 3))
+            row['spread_ms'] = round(row['owd_p99_ms'] - row['owd_min_ms'], 3)
+        else:
+            row.update(owd_min_ms=None, owd_p50_ms=None, owd_p99_ms=None, spread_ms=None)
+        return row
+
+
+def sweep_receive(group, port, timeout=SWEEP_TIMEOUT, rate=SWEEP_RATE, tuning=None):
+    """Приёмник замера: собирает шаги до пакета окончания (или тишины timeout секунд).
+    Возвращает (строки результатов, ClockSync)"""
+    sock = open_multicast_socket(port, [group], tuning=tuning or SocketTuning(),
+                                 buffer_size=SWEEP_RECEIVE_BUFFER)
+    clock = ClockSync()
+    steps = {}
+    sender = None
+    last_sync = 0.0
+    last_packet = time.time()
+    print(f"[INFO] Ожидание замера на {group}:{port}...")
+    try:
+        while time.time() - last_packet < timeout:
+            now = time.time()
+            if sender is not None and now - last_sync >= SWEEP_SYNC_INTERVAL:
+                last_sync = now
+                sock.sendto(build_sync_request(int(now * 1000000), 0), sender)
+            try:
+                data, addr = sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            now = time.time()
+            if data[:4] == SWEEP_MAGIC and len(data) >= SWEEP_HEADER.size:
+                _, step, chunk, streams, stream, _, fragments, seq, count, send_us = SWEEP_HEADER.unpack_from(data)
+                last_packet = now
+                if step == SWEEP_END:
+                    break
+                if sender is None:
+                    sender = addr
+                    print(f"[INFO] Замер от {addr[0]}")
+                state = steps.get(step)
+                if state is None:
+                    state = steps[step] = SweepStep(chunk, streams, count)
+                    print(f"[INFO] Шаг {step + 1}: chunk {chunk}, потоков {streams}")
+                state.add(stream, seq, fragments, send_us, len(data), now)
+                continue
+            header = parse_header(data)
+            if header is not None and header[0] == PACKET_SYNC:
+                _, request_us, receive_us, send_us = parse_sync(data)
+                clock.update(request_us / 1000000, receive_us / 1000000, send_us / 1000000, now)
+    finally:
+        sock.close()
+    offset = clock.offset if clock.ready() else 0.0
+    return [steps[step].result(step, rate, offset) for step in sorted(steps)], clock
+
+
+def recommend_profile(results, rate=SWEEP_RATE, loss_target=SWEEP_LOSS_TARGET):
+    """Наименьший профиль без потерь сверх цели при одном потоке, глубина буфера клиента под разброс
+    задержки, задержка синхронного воспроизведения и сколько потоков (уровней simulcast) выдерживает канал"""
+    single = sorted((r for r in results if r['streams'] == 1 and r['received']), key=lambda r: r['chunk'])
+    passing = [r for r in single if r['loss_percent'] <= loss_target]
+    if not single:
+        return None
+    chosen = passing[0] if passing else single[-1]
+    chunk = chosen['chunk']
+    interval_ms = chunk / rate * 1000
+    profile = next((name for name, config in LATENCY_PROFILES.items() if config['chunk'] == chunk), str(chunk))
+    depth = 1 + math.ceil(chosen['spread_ms'] / interval_ms)
+    # Синхронно: путь по сети с хвостом плюс пакет в игре, с шагом 10 мс как в спинбоксе клиента
+    playout = max(SWEEP_MIN_PLAYOUT_MS,
+                  math.ceil((max(chosen['owd_p99_ms'], 0) + 2 * interval_ms) / 10) * 10)
+    streams = max((r['streams'] for r in results
+                   if r['chunk'] == chunk and r['received'] and r['loss_percent'] <= loss_target), default=0)
+    return {
+        'profile': profile,
+        'chunk': chunk,
+        'sustained': bool(passing),
+        'loss_percent': chosen['loss_percent'],
+        'jitter_ms': chosen['jitter_ms'],
+        'client_buffer_packets': depth,
+        'client_buffer_ms': round(depth * interval_ms, 1),
+        'playout_delay_ms': playout,
+        'max_streams': streams,
+    }
+
+
+def save_sweep(results, recommendation, clock, csv_path=None, json_path=None):
+    """Результаты в CSV (по строке на шаг) и JSON (шаги, рекомендация, синхронизация часов)"""
+    if csv_path and results:
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"[INFO] CSV: {csv_path}")
+    if json_path:
+        report = {
+            'clock': {'offset_ms': round(clock.offset * 1000, 3) if clock.ready() else None,
+                      'rtt_ms': round(clock.rtt * 1000, 3)},
+            'steps': results,
+            'recommendation': recommendation,
+        }
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[INFO] JSON: {json_path}")
+
+
+def print_sweep(results, recommendation, clock):
+    """Таблица шагов и рекомендуемые настройки"""
+    if clock.ready():
+        print(f"Часы отправителя: {clock.offset * 1000:+.2f} мс (RTT {clock.rtt * 1000:.2f} мс)")
+    else:
+        print("[WARNING] Синхронизации часов нет - задержка в одну сторону без поправки")
+    print(f"{'chunk':>6} {'потоков':>8} {'байт':>6} {'пак/с':>7} {'Мбит/с':>7} {'потери %':>9} "
+          f"{'джиттер':>8} {'мин мс':>7} {'p50 мс':>7} {'p99 мс':>7}")
+    for r in results:
+        delays = (f"{r['owd_min_ms']:>7.2f} {r['owd_p50_ms']:>7.2f} {r['owd_p99_ms']:>7.2f}"
+                  if r['received'] else f"{'-':>7} {'-':>7} {'-':>7}")
+        print(f"{r['chunk']:>6} {r['streams']:>8} {r['packet_bytes']:>6} {r['packets_per_sec']:>7.0f} "
+              f"{r['mbps']:>7.2f} {r['loss_percent']:>9.2f} {r['jitter_ms']:>8.2f} {delays}")
+    if recommendation is None:
+        print("[ERROR] Ни одного пакета не получено - multicast не проходит")
+        return
+    if not recommendation['sustained']:
+        print(f"[WARNING] Потери выше {SWEEP_LOSS_TARGET}% на всех профилях")
+    print(f"\nРекомендация: сервер - профиль \"{recommendation['profile']}\" (chunk {recommendation['chunk']}), "
+          f"до {recommendation['max_streams']} потоков/уровней одновременно")
+    print(f"              клиент - буфер {recommendation['client_buffer_packets']} пакетов "
+          f"({recommendation['client_buffer_ms']} мс), синхронно - {recommendation['playout_delay_ms']} мс")
+
+
+def run_sweep(args):
+    """Замер из командной строки: send - на машине сервера, receive - на машине клиента, local - оба здесь"""
+    chunks = [int(n) for n in args.chunks.split(',')]
+    stream_levels = [int(n) for n in args.streams.split(',')]
+    tuning = SocketTuning(DSCP_CLASSES[args.qos], interface=args.interface)
+    steps = sweep_steps(chunks, stream_levels)
+    if args.sweep == 'send':
+        sweep_send(args.group, args.port, steps, args.seconds, args.mtu, tuning=tuning)
+        return
+    if args.sweep == 'local':
+        sender = threading.Thread(target=sweep_send,
+                                  args=(args.group, args.port, steps, args.seconds, args.mtu, SWEEP_RATE, tuning),
+                                  daemon=True)
+        sender.start()
+    results, clock = sweep_receive(args.group, args.port, args.timeout, tuning=tuning)
+    recommendation = recommend_profile(results)
+    print_sweep(results, recommendation, clock)
+    save_sweep(results, recommendation, clock, args.csv, args.json)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Тестер multicast сети StreamAudio (без аргументов - GUI)")
+    parser.add_argument('--sweep', choices=['local', 'send', 'receive'],
+                        help="Замер профилей: send - на сервере, receive - на клиенте, local - оба на этой машине")
+    parser.add_argument('--group', default=SWEEP_GROUP, help="Multicast группа замера")
+    parser.add_argument('--port', type=int, default=SWEEP_PORT, help="Порт замера (не порт живого потока)")
+    parser.add_argument('--seconds', type=float, default=SWEEP_SECONDS, help="Длительность шага, с")
+    parser.add_argument('--chunks', default=','.join(str(c['chunk']) for c in LATENCY_PROFILES.values()),
+                        help="Чанки шагов через запятую")
+    parser.add_argument('--streams', default=SWEEP_STREAMS, help="Потоков одновременно (нагрузка) через запятую")
+    parser.add_argument('--mtu', type=int, default=DEFAULT_MTU, help="Размер датаграммы, больше - фрагменты")
+    parser.add_argument('--qos', choices=list(DSCP_CLASSES), default=DEFAULT_DSCP, help="Маркировка DSCP")
+    parser.add_argument('--interface', default='', help="IP адрес интерфейса для multicast")
+    parser.add_argument('--timeout', type=float, default=SWEEP_TIMEOUT, help="Ожидание пакетов приёмником, с")
+    parser.add_argument('--csv', default=SWEEP_CSV, help="Файл результатов CSV (пусто - не сохранять)")
+    parser.add_argument('--json', default=SWEEP_JSON, help="Файл результатов JSON (пусто - не сохранять)")
+    args = parser.parse_args()
+
+    if args.sweep:
+        run_sweep(args)
+        return
     # Запуск графического интерфейса
     root = tk.Tk()
-    app = MulticastTesterGUI(root)
-    root.mainloop()
\ No newline at end of file
+    MulticastTesterGUI(root)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,31 @@
+import math
+import select
 import socket
-import struct
+import functools
 import time
 import threading
-import numpy as np
+import random
 import tkinter as tk
-from tkinter import ttk, messagebox
-import queue
+from tkinter import ttk, messagebox, filedialog
 
-try:
-    import sounddevice as sd
-    SOUNDDEVICE_AVAILABLE = True
-except ImportError:
-    SOUNDDEVICE_AVAILABLE = False
+# Первым из модулей проекта: отсчёт времени запуска (numpy и остальные импорты ниже)
+from StreamAudio_Devices import STARTUP, DeviceCatalog, load_sounddevice, sounddevice_available
+from StreamAudio_Recorder import RollingRecorder, export_wav, DEFAULT_RECORD_FILE, DEFAULT_RECORD_SECONDS
+from StreamAudio_Codec import ENCODING_PCM16, ENCODING_NAMES, native_rate
+from StreamAudio_DSP import DSPChain, LoudnessNormalizer, Limiter
+from StreamAudio_Receiver import (StreamSource, Mixer, ResampledOutput, parse_sources, open_multicast_socket,
+                                  stream_id_of, SOURCE_TIMEOUT, PLAYOUT_DELAY_MS)
+from StreamAudio_Trace import TraceWriter, DEFAULT_CLIENT_TRACE, EVENT_CALLBACK, REASON_XRUN
+from StreamAudio_Profiler import CallbackProfiler, PROFILE_PERCENTILE
+from StreamAudio_Feedback import ProfileAdvisor
+from StreamAudio_JitterBuffer import JITTER_TARGET_DEPTH, JITTER_MAX_DEPTH
+from StreamAudio_Socket import (SocketTuning, DSCP_CLASSES, DEFAULT_DSCP, RECEIVE_BUFFER_TIME,
+                                socket_buffer_size)
+from StreamAudio_Latency import MarkerDetector
+from StreamAudio_SharedMemory import PacketRing, CLIENT_TRANSPORTS, TRANSPORT_MULTICAST, TRANSPORT_SHM, ring_name
+
+# Сам sounddevice (и PortAudio) загружается в фоне или при старте потока
+SOUNDDEVICE_AVAILABLE = sounddevice_available()
 
 # КОНСИСТЕНТНЫЕ НАСТРОЙКИ - ДОЛЖНЫ СОВПАДАТЬ С СЕРВЕРОМ
 # Можно настроить через GUI
@@ -22,6 +36,31 @@ FORMAT = 'int16'
 MULTICAST_GROUP = '224.1.1.1'
 PORT = 5007
 
+# Кольцевая запись принятого аудио для разбора жалоб на глитчи
+RECORD_FILE = DEFAULT_RECORD_FILE
+RECORD_SECONDS = DEFAULT_RECORD_SECONDS
+
+# Трасса пакетов для разбора проблем (анализ - StreamAudio_Trace.py)
+TRACE_FILE = DEFAULT_CLIENT_TRACE
+
+# Усиление источника в сведении, дБ
+SOURCE_GAIN_RANGE = (-30, 10)
+
+# Переоткрытие устройства при смене формата: новый поток открывается до закрытия старого
+OUTPUT_SWITCH_POLL_MS = 20
+OUTPUT_SWITCH_TIMEOUT = 1.0
+
+# Размер блока устройства вывода: по чанку потока, на выбор драйвера (0) или фиксированный
+DEVICE_BLOCKSIZES = {
+    'Как поток': None,
+    'Авто': 0,
+    '64': 64,
+    '128': 128,
+    '256': 256,
+    '512': 512,
+    '1024': 1024,
+}
+
 # Профили задержки (должны совпадать с сервером)
 LATENCY_PROFILES = {
     'Минимальная': {'chunk': 128, 'rate': 44100},
@@ -35,12 +74,43 @@ class MulticastAudioReceiverGUI:
         self.root = root
         self.running = False
         self.stream = None
-        self.audio_queue = queue.Queue(maxsize=2)  # Ограничиваем очередь для минимальной задержки
-        self.last_packet_time = 0
+        self.output_generation = 0  # Номер последнего открытого потока вывода
+        self.active_output = 0  # Номер потока, который сейчас играет источники
+        # Устройство на родной частоте (None - на частоте потока); поток переводится полифазным ресемплером
+        self.native_rate = None
+        self.output_rate = DEFAULT_RATE
+        self.output_converter = None
+        # Источники (сервер + id потока) сводятся в один выход; кортеж заменяется целиком
+        self.sources = ()
+        self.source_map = {}
+        self.source_gains = {}  # (ip, id потока) -> усиление, переживает перезапуск сервера
+        self.source_rows = {}
+        self.sockets = []
+        self.mixer = Mixer()
+        # Необязательное выравнивание громкости перед воспроизведением
+        self.dsp = DSPChain(DEFAULT_RATE)
+        self.dsp_stages = (LoudnessNormalizer(), Limiter())
         self.last_audio_level = 0.0
+        # Формат выхода - по первому источнику (до объявления формата - по профилю)
         self.chunk_size = DEFAULT_CHUNK
         self.sample_rate = DEFAULT_RATE
-        self.expected_packet_interval = self.chunk_size / self.sample_rate  # Ожидаемый интервал между пакетами
+        self.stream_channels = CHANNELS
+        self.encoding = ENCODING_PCM16
+        self.format_pending = False
+        self.recorder = None
+        self.trace = None
+        self.profiler = CallbackProfiler(DEFAULT_RATE)
+        self.advisor = ProfileAdvisor()
+        self.detector = None  # MarkerDetector: замер задержки по маркеру сервера
+        self.client_id = random.getrandbits(32)
+        self.nack_enabled = False
+        self.fast_join = True
+        self.ring = None  # PacketRing: приём из общей памяти (сервер на этой же машине)
+        self.ring_addr = None
+        self.playout_delay = None  # Секунды от захвата на сервере до звука; None - без синхронизации
+        self.device_blocksize = None  # None - как чанк потока
+        self.devices = DeviceCatalog()
+        self.device_info = {}
         self.setup_gui()
         self.refresh_devices()
         
@@ -155,12 +225,89 @@ class MulticastAudioReceiverGUI:
         self.latency_combo.pack(side=tk.LEFT, padx=(0, 15))
         self.latency_combo.bind('<<ComboboxSelected>>', self.on_latency_profile_change)
         
+        # Блок устройства не обязан совпадать с чанком сервера - пакеты пересобираются кадр в кадр
+        tk.Label(settings_row, text="Блок:", 
+                font=('Segoe UI', 8), bg=bg_color, fg=fg_color).pack(side=tk.LEFT, padx=(0, 5))
+        self.blocksize_var = tk.StringVar(value='Как поток')
+        self.blocksize_combo = ttk.Combobox(settings_row, textvariable=self.blocksize_var,
+                                            values=list(DEVICE_BLOCKSIZES.keys()), state="readonly", width=9)
+        self.blocksize_combo.pack(side=tk.LEFT, padx=(0, 15))
+        
         self.settings_info_var = tk.StringVar()
         self.update_settings_info()
         settings_label = tk.Label(settings_row, textvariable=self.settings_info_var, 
                                   font=('Consolas', 7), bg=bg_color, fg='#a6e3a1')
         settings_label.pack(side=tk.LEFT)
         
+        # Кольцевая запись последних минут и экспорт в WAV
+        export_btn = ttk.Button(settings_row, text="💾 Экспорт WAV", command=self.export_recording)
+        export_btn.pack(side=tk.RIGHT)
+        self.record_var = tk.BooleanVar(value=True)
+        self.record_check = tk.Checkbutton(settings_row, text=f"⏺ Запись {RECORD_SECONDS // 60} мин",
+                                           variable=self.record_var, font=('Segoe UI', 8),
+                                           bg=bg_color, fg=fg_color, selectcolor='#313244',
+                                           activebackground=bg_color, activeforeground=fg_color)
+        self.record_check.pack(side=tk.RIGHT, padx=(0, 5))
+        self.nack_var = tk.BooleanVar(value=True)
+        self.nack_check = tk.Checkbutton(settings_row, text="🔁 NACK",
+                                         variable=self.nack_var, font=('Segoe UI', 8),
+                                         bg=bg_color, fg=fg_color, selectcolor='#313244',
+                                         activebackground=bg_color, activeforeground=fg_color)
+        self.nack_check.pack(side=tk.RIGHT, padx=(0, 5))
+        self.fast_join_var = tk.BooleanVar(value=True)
+        self.fast_join_check = tk.Checkbutton(settings_row, text="⚡ Быстрый вход",
+                                              variable=self.fast_join_var, font=('Segoe UI', 8),
+                                              bg=bg_color, fg=fg_color, selectcolor='#313244',
+                                              activebackground=bg_color, activeforeground=fg_color)
+        self.fast_join_check.pack(side=tk.RIGHT, padx=(0, 5))
+        # Частота микшера ОС: без неё Windows/PulseAudio пересчитывают 44.1 -> 48 кГц со своим буфером
+        self.native_rate_var = tk.BooleanVar(value=True)
+        self.native_rate_check = tk.Checkbutton(settings_row, text="🎚 Родная частота",
+                                                variable=self.native_rate_var, font=('Segoe UI', 8),
+                                                bg=bg_color, fg=fg_color, selectcolor='#313244',
+                                                activebackground=bg_color, activeforeground=fg_color)
+        self.native_rate_check.pack(side=tk.RIGHT, padx=(0, 5))
+        self.trace_var = tk.BooleanVar(value=False)
+        self.trace_check = tk.Checkbutton(settings_row, text="📝 Трасса",
+                                          variable=self.trace_var, font=('Segoe UI', 8),
+                                          bg=bg_color, fg=fg_color, selectcolor='#313244',
+                                          activebackground=bg_color, activeforeground=fg_color)
+        self.trace_check.pack(side=tk.RIGHT, padx=(0, 5))
+        self.dsp_var = tk.BooleanVar(value=False)
+        dsp_check = tk.Checkbutton(settings_row, text="🎚 Выравнивание",
+                                   variable=self.dsp_var, command=self.on_dsp_change,
+                                   font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                   selectcolor='#313244', activebackground=bg_color,
+                                   activeforeground=fg_color)
+        dsp_check.pack(side=tk.RIGHT, padx=(0, 5))
+        # Автовыбор профиля: буфер по измеренному джиттеру, чанк - рекомендацией серверу
+        self.auto_profile_var = tk.BooleanVar(value=True)
+        auto_profile_check = tk.Checkbutton(settings_row, text="🎯 Авто-профиль",
+                                            variable=self.auto_profile_var, command=self.on_auto_profile_change,
+                                            font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                            selectcolor='#313244', activebackground=bg_color,
+                                            activeforeground=fg_color)
+        auto_profile_check.pack(side=tk.RIGHT, padx=(0, 5))
+        # Замер задержки от захвата на сервере до динамика (сервер должен вставлять маркер)
+        self.measure_var = tk.BooleanVar(value=False)
+        measure_check = tk.Checkbutton(settings_row, text="📏 Замер задержки",
+                                       variable=self.measure_var, command=self.on_measure_change,
+                                       font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                       selectcolor='#313244', activebackground=bg_color,
+                                       activeforeground=fg_color)
+        measure_check.pack(side=tk.RIGHT, padx=(0, 5))
+        # Синхронное воспроизведение: все клиенты играют пакет через одинаковую задержку от захвата
+        self.playout_delay_var = tk.StringVar(value=str(PLAYOUT_DELAY_MS))
+        self.playout_delay_spin = tk.Spinbox(settings_row, from_=20, to=500, increment=10, width=4,
+                                             textvariable=self.playout_delay_var)
+        self.playout_delay_spin.pack(side=tk.RIGHT, padx=(0, 5))
+        self.sync_var = tk.BooleanVar(value=False)
+        self.sync_check = tk.Checkbutton(settings_row, text="⏱ Синхронно, мс",
+                                         variable=self.sync_var, font=('Segoe UI', 8),
+                                         bg=bg_color, fg=fg_color, selectcolor='#313244',
+                                         activebackground=bg_color, activeforeground=fg_color)
+        self.sync_check.pack(side=tk.RIGHT)
+        
         # Компактная панель устройств и сети
         device_network_frame = ttk.LabelFrame(main_frame, text="🔊 Устройство и сеть", padding="8")
         device_network_frame.pack(fill=tk.X, pady=(0, 8))
@@ -180,11 +327,11 @@ class MulticastAudioReceiverGUI:
                                command=self.refresh_devices, width=3)
         refresh_btn.grid(row=0, column=2, padx=5, pady=5)
         
-        # Сеть
-        tk.Label(device_network_inner, text="Группа:", 
+        # Сеть: несколько групп через запятую, "группа:порт#id" - другой порт или только один поток
+        tk.Label(device_network_inner, text="Группы:", 
                 font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=0, column=3, sticky=tk.W, padx=(15, 5), pady=5)
         self.group_var = tk.StringVar(value=MULTICAST_GROUP)
-        group_entry = ttk.Entry(device_network_inner, textvariable=self.group_var, width=12)
+        group_entry = ttk.Entry(device_network_inner, textvariable=self.group_var, width=24)
         group_entry.grid(row=0, column=4, padx=2, pady=5)
         
         tk.Label(device_network_inner, text="Порт:", 
@@ -193,6 +340,33 @@ class MulticastAudioReceiverGUI:
         port_entry = ttk.Entry(device_network_inner, textvariable=self.port_var, width=8)
         port_entry.grid(row=0, column=6, padx=2, pady=5)
         
+        # Маркировка QoS отчётов/NACK и интерфейс подписки на группы (пусто - выбирает система)
+        tk.Label(device_network_inner, text="QoS:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=1, column=0, sticky=tk.W, padx=(5, 5), pady=5)
+        self.qos_var = tk.StringVar(value=DEFAULT_DSCP)
+        self.qos_combo = ttk.Combobox(device_network_inner, textvariable=self.qos_var,
+                                      values=list(DSCP_CLASSES.keys()), state="readonly", width=10)
+        self.qos_combo.grid(row=1, column=1, padx=5, sticky=tk.W, pady=5)
+        
+        tk.Label(device_network_inner, text="Интерфейс:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=1, column=3, sticky=tk.W, padx=(15, 5), pady=5)
+        self.interface_var = tk.StringVar(value="")
+        self.interface_entry = ttk.Entry(device_network_inner, textvariable=self.interface_var, width=24)
+        self.interface_entry.grid(row=1, column=4, padx=2, pady=5)
+        
+        # Сервер на этой же машине: поток из общей памяти вместо loopback multicast (группы не нужны)
+        tk.Label(device_network_inner, text="Транспорт:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=1, column=5, sticky=tk.W, padx=(8, 5), pady=5)
+        self.transport_var = tk.StringVar(value=TRANSPORT_MULTICAST)
+        self.transport_combo = ttk.Combobox(device_network_inner, textvariable=self.transport_var,
+                                            values=list(CLIENT_TRANSPORTS), state="readonly", width=13)
+        self.transport_combo.grid(row=1, column=6, padx=2, sticky=tk.W, pady=5)
+        
+        # Что ядро реально применило (буферы урезаются по rmem_max, приоритет может быть запрещён)
+        self.socket_info_var = tk.StringVar(value="")
+        tk.Label(device_network_inner, textvariable=self.socket_info_var, font=('Consolas', 7),
+                 bg='#313244', fg='#a6e3a1', anchor='w').grid(row=2, column=0, columnspan=7, sticky=tk.W, padx=5)
+        
         device_network_inner.columnconfigure(1, weight=1)
         
         # Компактная панель статуса и статистики в одну строку
@@ -214,6 +388,16 @@ class MulticastAudioReceiverGUI:
                                    anchor='w', padx=5)
         self.stats_label.grid(row=0, column=1, sticky=tk.W, padx=5, pady=3)
         
+        # Источники в сведении: усиление и краткая статистика по каждому
+        sources_frame = ttk.LabelFrame(main_frame, text="🎛 Источники", padding="8")
+        sources_frame.pack(fill=tk.X, pady=(0, 8))
+        
+        self.sources_inner = tk.Frame(sources_frame, bg='#313244')
+        self.sources_inner.pack(fill=tk.X, padx=3, pady=3)
+        self.no_sources_label = tk.Label(self.sources_inner, text="Нет источников",
+                                         font=('Consolas', 8), bg='#313244', fg='#6c7086', anchor='w', padx=5)
+        self.no_sources_label.pack(fill=tk.X)
+        
         # Компактный индикатор уровня звука
         level_frame = ttk.LabelFrame(main_frame, text="🔊 Уровень звука", padding="8")
         level_frame.pack(fill=tk.X, pady=(0, 8))
@@ -244,7 +428,7 @@ class MulticastAudioReceiverGUI:
                                    activebackground='#94e2d5', activeforeground='#1e1e2e',
                                    relief=tk.FLAT, padx=20, pady=10,
                                    cursor='hand2', width=23,
-                                   state=tk.NORMAL if SOUNDDEVICE_AVAILABLE else tk.DISABLED)
+                                   state=tk.DISABLED)  # Включается после свежего опроса PortAudio
         self.start_btn.pack(side=tk.LEFT, padx=(0, 10))
         
         self.stop_btn = tk.Button(button_container, text="⏹️ Остановить", 
@@ -257,15 +441,16 @@ class MulticastAudioReceiverGUI:
         self.stop_btn.pack(side=tk.LEFT)
         
         # Инициализация переменных для статистики
-        self.packet_count = 0
-        self.lost_packets = 0
         self.start_time = 0
-        self.last_packet_time = 0
-        self.estimated_latency = 0.0
         
     def update_settings_info(self):
         """Обновить информацию о настройках"""
-        info_text = f"{self.sample_rate}Hz | {CHANNELS}ch | {FORMAT} | chunk:{self.chunk_size}"
+        info_text = (f"{self.sample_rate}Hz | {self.stream_channels}ch | {ENCODING_NAMES[self.encoding]} | "
+                     f"chunk:{self.chunk_size}")
+        if self.device_blocksize is not None:
+            info_text += f" | блок:{self.device_blocksize or 'авто'}"
+        if self.native_rate and self.native_rate != self.sample_rate:
+            info_text += f" | устройство:{self.native_rate}Hz"
         self.settings_info_var.set(info_text)
     
     def on_latency_profile_change(self, event=None):
@@ -275,89 +460,184 @@ class MulticastAudioReceiverGUI:
             config = LATENCY_PROFILES[profile]
             self.chunk_size = config['chunk']
             self.sample_rate = config['rate']
-            self.expected_packet_interval = self.chunk_size / self.sample_rate
             self.update_settings_info()
     
+    def on_dsp_change(self):
+        """Включение/выключение обработки перед воспроизведением (можно во время приема)"""
+        self.dsp.configure(self.dsp_stages if self.dsp_var.get() else (), rate=self.output_rate)
+    
+    def on_auto_profile_change(self):
+        """Автовыбор выключили - прежняя глубина буфера и без рекомендаций серверу"""
+        if not self.auto_profile_var.get():
+            for source in self.sources:
+                source.set_depth(JITTER_TARGET_DEPTH)
+                source.advised_packet_us = 0
+    
+    def on_measure_change(self):
+        """Включение/выключение замера задержки по маркеру (можно во время приема)"""
+        self.detector = MarkerDetector(self.output_rate) if self.measure_var.get() else None
+        if self.detector is None:
+            for source in self.sources:
+                source.clock_wanted = False
+
+    def update_profile_advice(self, sources):
+        """Измерения для автовыбора профиля; глубина буфера применяется сразу, чанк уходит серверу в отчётах"""
+        if not sources:
+            return
+        primary = sources[0]
+        profiler = self.profiler
+        # Время callback зависит от чанка, только если блок устройства следует за потоком
+        callback_time = 0.0
+        if self.device_blocksize is None:
+            callback_time = profiler.percentile(PROFILE_PERCENTILE) * profiler.budget
+        # Пакет без части фрагментов играет тишину на их месте - тоже сбой от потерь
+        self.advisor.evaluate(primary.sample_rate, primary.chunk_size,
+                              sum(s.packet_count for s in sources),
+                              sum(s.lost_packets + s.reassembler.fragments_lost for s in sources),
+                              sum(s.underruns for s in sources) + profiler.xrun_count(),
+                              max(s.jitter for s in sources), callback_time, frame_bytes=primary.frame_size)
+        if self.advisor.chunk is None or not self.auto_profile_var.get():
+            return
+        # Чанк советника - в кадрах потока; серверу уходит длительность пакета, её он пересчитает в кадры захвата
+        advised_packet_us = round(self.advisor.chunk / primary.sample_rate * 1000000)
+        for source in sources:
+            source.set_depth(self.advisor.depth(source.expected_packet_interval))
+            source.advised_packet_us = advised_packet_us
+    
     def refresh_devices(self):
-        """Обновить список устройств вывода"""
+        """Обновить список устройств вывода: сразу из кэша, опрос PortAudio - в фоне"""
         if not SOUNDDEVICE_AVAILABLE:
             return
+        if not self.device_info:
+            snapshot = self.devices.cached()
+            if snapshot is not None:
+                self.show_devices(snapshot, None, True)
+        self.devices.refresh_async(lambda snapshot, error, changed:
+                                   self.root.after(0, self.show_devices, snapshot, error, changed))
+    
+    def show_devices(self, snapshot, error, changed):
+        """Заполнить список устройств вывода из снимка каталога (из кэша или после опроса)"""
+        if error is not None:
+            messagebox.showerror("Ошибка", f"Не удалось получить список устройств: {error}")
+            return
+        STARTUP.mark("список устройств" if self.devices.fresh else "список устройств из кэша")
+        if self.devices.fresh and not self.running:
+            # Список из кэша сверяется со свежим при старте - до опроса старт недоступен
+            self.start_btn.config(state=tk.NORMAL)
+        if not changed:
+            return
             
         devices = []
         self.device_info = {}
+        hostapi_names = snapshot['hostapis']
         
-        try:
-            hostapi_info = sd.query_hostapis()
-            device_list = sd.query_devices()
-            
-            for i, device in enumerate(device_list):
-                if device['max_output_channels'] > 0:
-                    hostapi_name = hostapi_info[device['hostapi']]['name']
-                    device_name = f"{i}: {device['name']} ({hostapi_name})"
-                    devices.append(device_name)
-                    self.device_info[device_name] = {
-                        'index': i,
-                        'device': device
-                    }
-            
-            self.device_combo['values'] = devices
-            if devices and not self.device_var.get():
-                self.device_combo.set(devices[0])
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось получить список устройств: {e}")
+        for device in snapshot['devices']:
+            if device['max_output_channels'] > 0:
+                device_name = f"{device['index']}: {device['name']} ({hostapi_names[device['hostapi']]})"
+                devices.append(device_name)
+                self.device_info[device_name] = {
+                    'index': device['index'],
+                    'device': device
+                }
+        
+        self.device_combo['values'] = devices
+        if devices and self.device_var.get() not in self.device_info:
+            self.device_combo.set(devices[0])
     
     def setup_network(self):
-        """Настройка multicast приемника"""
+        """Настройка multicast приемника: по сокету на порт, в каждом - все группы этого порта"""
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            port = int(self.port_var.get())
-            self.sock.bind(('', port))
+            subscriptions = parse_sources(self.group_var.get(), int(self.port_var.get()))
+            groups_by_port = {}
+            for group, port, stream_id in subscriptions:
+                groups_by_port.setdefault(port, []).append((group, stream_id))
             
-            multicast_group = self.group_var.get()
-            group = socket.inet_aton(multicast_group)
-            mreq = struct.pack('4sL', group, socket.INADDR_ANY)
-            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-            
-            # Минимизируем буфер и таймаут для низкой задержки
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 32768)  # Уменьшенный буфер
-            self.sock.settimeout(0.1)  # Увеличенный таймаут для отладки
-            # Включаем loopback для multicast (чтобы работало на одном компьютере)
-            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
-            
-            print(f"[DEBUG] Multicast настроен: группа={multicast_group}, порт={port}")
-            print(f"[DEBUG] Сокет привязан к порту {port}")
+            self.sockets = []
+            self.stream_filters = {}
+            if self.transport_var.get() == TRANSPORT_SHM:
+                self.setup_shared_memory(int(self.port_var.get()))
+                return
+            # Буфер приёма под темп пакетов профиля и глубину буфера (в синхронном режиме - всю задержку)
+            tuning = SocketTuning(DSCP_CLASSES[self.qos_var.get()], interface=self.interface_var.get().strip())
+            depth = JITTER_MAX_DEPTH
+            if self.playout_delay is not None:
+                depth = math.ceil(self.playout_delay * self.sample_rate / self.chunk_size)
+            buffer_size = socket_buffer_size(self.chunk_size, self.sample_rate, RECEIVE_BUFFER_TIME, depth)
+            for port, groups in groups_by_port.items():
+                sock = open_multicast_socket(port, sorted({group for group, _ in groups}), tuning=tuning,
+                                             buffer_size=buffer_size)
+                self.sockets.append(sock)
+                # Фильтр по id потока (None - любой); группу назначения без IP_PKTINFO не видно
+                stream_ids = {stream_id for _, stream_id in groups}
+                self.stream_filters[sock] = None if None in stream_ids else stream_ids
+                print(f"[DEBUG] Сокет привязан к порту {port}")
+            self.socket_info_var.set(tuning.report())
+            print(f"[DEBUG] Сокеты: {tuning.report()}")
         except Exception as e:
             print(f"[ERROR] Ошибка настройки сети: {e}")
+            for sock in self.sockets:
+                sock.close()
+            self.sockets = []
+            if self.ring:
+                self.ring.close()
+                self.ring = None
             raise
     
-    def audio_output_callback(self, outdata, frames, time, status):
-        """Callback для вывода аудио - оптимизирован"""
+    def setup_shared_memory(self, port):
+        """Поток сервера этой машины из кольца в общей памяти. Отчёты, NACK, SYNC и JOIN - unicast с отдельного
+        сокета на сокет сервера, на него же приходят повторы и ответы"""
+        try:
+            self.ring = PacketRing.attach(ring_name(port))
+        except FileNotFoundError:
+            raise RuntimeError(f"сервер не публикует поток порта {port} в общую память") from None
+        self.ring_addr = ('127.0.0.1', self.ring.control_port)
+        tuning = SocketTuning(DSCP_CLASSES[self.qos_var.get()])
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        tuning.apply_common(sock)
+        self.sockets = [sock]
+        self.stream_filters[sock] = None
+        info = f"общая память {ring_name(port)}: {self.ring.slots} слотов, отчёты на порт {self.ring.control_port}"
+        self.socket_info_var.set(info)
+        print(f"[DEBUG] {info}")
+    
+    def audio_output_callback(self, outdata, frames, time_info, status, generation=0, converter=None):
+        """Callback для вывода аудио - оптимизирован.
+        generation - номер потока вывода (при смене формата старый и новый потоки работают одновременно),
+        converter - ResampledOutput этого потока, если устройство открыто не на частоте потока"""
         if self.running:
+            if generation != self.active_output:
+                if generation < self.active_output:
+                    outdata.fill(0)  # Старый поток: новый уже играет, ждём закрытия
+                    return
+                # Первый блок нового потока - дальше пакеты забирает только он
+                self.active_output = generation
             try:
-                # Получаем данные из очереди с таймаутом
-                audio_data = self.audio_queue.get_nowait()
-            
-                # Используем memoryview для избежания копирования
-                audio_array = np.frombuffer(audio_data, dtype=np.int16)
-            
-                # Решейпим для стерео вывода
-                if len(audio_array) >= frames * CHANNELS:
-                    audio_array = audio_array[:frames * CHANNELS].reshape(-1, CHANNELS)
-                    outdata[:] = audio_array
-                    
-                    # Вычисляем уровень звука для индикатора
-                    self.last_audio_level = float(np.abs(audio_array).max()) / 32768.0
+                started = time.perf_counter()
+                current_time = time.time()
+                # Когда этот блок прозвучит: задержка устройства по часам PortAudio, перенесённая на time.time()
+                dac_time = current_time
+                if time_info is not None:
+                    output_delay = time_info.outputBufferDacTime - time_info.currentTime
+                    if 0 < output_delay < 1:
+                        dac_time += output_delay
+                # Все источники сводятся в outdata, обработка - уже по сведению
+                if converter:
+                    self.last_audio_level = converter.render(self.mixer, self.sources, outdata, current_time, dac_time)
                 else:
-                    # Если данных недостаточно, заполняем нулями
-                    outdata.fill(0)
-                    self.last_audio_level = 0.0
-                
-            except queue.Empty:
-                outdata.fill(0)
-                self.last_audio_level = 0.0
+                    self.last_audio_level = self.mixer.mix(self.sources, outdata, current_time, dac_time)
+                self.dsp.process(outdata)
+                detector = self.detector
+                if detector:
+                    detector.push(outdata, dac_time)  # Именно то, что уйдёт в динамик
+                duration = time.perf_counter() - started
+                self.profiler.record(duration, frames, status)
+                trace = self.trace
+                if trace:
+                    trace.record(EVENT_CALLBACK, timestamp_us=int(frames / self.output_rate * 1000000), size=frames,
+                                 reason=REASON_XRUN if status else 0,
+                                 depth=sum(s.jitter_buffer.qsize() for s in self.sources),
+                                 value=duration * 1000000, event_time=current_time)
             except Exception as e:
                 print(f"Audio output error: {e}")
                 outdata.fill(0)
@@ -376,37 +656,41 @@ class MulticastAudioReceiverGUI:
                 return
             
             device_info = self.device_info[selected_device]
-            device_index = device_info['index']
+            # Список мог прийти из кэша: номер устройства сверяем со свежим опросом PortAudio
+            device = self.devices.resolve(device_info['index'], device_info['device']['name'])
+            if device is None:
+                messagebox.showerror("Ошибка", "Список устройств изменился - выберите устройство вывода заново")
+                return
+            self.device_index = device['index']
+            self.native_rate = native_rate(device, None) if self.native_rate_var.get() else None
             
             # Настраиваем сеть
+            self.playout_delay = int(self.playout_delay_var.get()) / 1000 if self.sync_var.get() else None
             self.setup_network()
             
             # Запускаем аудио вывод
             self.running = True
-            self.packet_count = 0
-            self.lost_packets = 0
             self.start_time = time.time()
-            self.last_packet_time = time.time()
-            self.estimated_latency = 0.0
+            self.advisor.reset(self.start_time)
             self.last_audio_level = 0.0
+            self.sources = ()
+            self.source_map = {}
+            self.nack_enabled = self.nack_var.get()
+            self.fast_join = self.fast_join_var.get()
+            self.device_blocksize = DEVICE_BLOCKSIZES[self.blocksize_var.get()]
+            self.update_settings_info()
+            
+            # Кольцевой файл создаётся заранее, чтобы в потоке приема не было выделений
+            if self.record_var.get():
+                self.recorder = RollingRecorder(RECORD_FILE, self.sample_rate, self.stream_channels, RECORD_SECONDS)
+            self.trace = TraceWriter(TRACE_FILE) if self.trace_var.get() else None
             
             # Запускаем поток для приема данных
             self.receive_thread = threading.Thread(target=self.receive_loop, daemon=True)
             self.receive_thread.start()
             
-            print(f"Starting output: {self.sample_rate}Hz, {CHANNELS} channels, format: {FORMAT}, chunk: {self.chunk_size}")
-            
             # Запускаем аудио вывод
-            self.stream = sd.OutputStream(
-                device=device_index,
-                channels=CHANNELS,
-                samplerate=self.sample_rate,
-                blocksize=self.chunk_size,  # Настраиваемый размер для баланса задержки/качества
-                callback=self.audio_output_callback,
-                dtype=FORMAT,  # Используем int16 напрямую
-                latency='low'  # Минимальная задержка устройства
-            )
-            self.stream.start()
+            self.open_output_stream()
             
             # Обновляем интерфейс
             self.status_var.set("▶️ Активен")
@@ -415,6 +699,17 @@ class MulticastAudioReceiverGUI:
             self.stop_btn.config(state=tk.NORMAL)
             self.device_combo.config(state=tk.DISABLED)
             self.latency_combo.config(state=tk.DISABLED)  # Блокируем изменение во время работы
+            self.blocksize_combo.config(state=tk.DISABLED)
+            self.record_check.config(state=tk.DISABLED)
+            self.nack_check.config(state=tk.DISABLED)
+            self.fast_join_check.config(state=tk.DISABLED)
+            self.native_rate_check.config(state=tk.DISABLED)
+            self.trace_check.config(state=tk.DISABLED)
+            self.sync_check.config(state=tk.DISABLED)
+            self.playout_delay_spin.config(state=tk.DISABLED)
+            self.qos_combo.config(state=tk.DISABLED)
+            self.interface_entry.config(state=tk.DISABLED)
+            self.transport_combo.config(state=tk.DISABLED)
             
             # Запускаем поток для статистики
             self.stats_thread = threading.Thread(target=self.update_stats, daemon=True)
@@ -425,82 +720,328 @@ class MulticastAudioReceiverGUI:
             messagebox.showerror("Ошибка", error_msg)
             self.stop_receive()
     
+    def open_output_stream(self):
+        """Открыть устройство вывода под текущий формат потока"""
+        self.output_rate = self.native_rate or self.sample_rate
+        print(f"Starting output: {self.output_rate}Hz, {CHANNELS} channels, format: {FORMAT}, chunk: {self.chunk_size}")
+        self.on_dsp_change()
+        self.on_measure_change()  # Отсчёты детектора - в частоте нового выхода
+        self.profiler = CallbackProfiler(self.output_rate)
+        blocksize = self.chunk_size if self.device_blocksize is None else self.device_blocksize
+        converter = None
+        if self.output_rate != self.sample_rate:
+            # Сведение идёт чанками потока, устройству - блоки той же длительности на его частоте
+            converter = ResampledOutput(self.sample_rate, self.output_rate, CHANNELS, self.chunk_size)
+            if self.device_blocksize is None:
+                blocksize = round(blocksize * self.output_rate / self.sample_rate)
+            print(f"[DEBUG] Устройство на родной частоте {self.output_rate}Hz, поток {self.sample_rate}Hz "
+                  f"(задержка фильтра {converter.resampler.delay * 1000:.2f}мс)")
+        self.output_converter = converter
+        self.output_generation += 1
+        sd = load_sounddevice()
+        self.stream = sd.OutputStream(
+            device=self.device_index,
+            channels=CHANNELS,
+            samplerate=self.output_rate,
+            blocksize=blocksize,  # Свой размер блока устройства; пакеты любого размера пересобираются
+            callback=functools.partial(self.audio_output_callback, generation=self.output_generation,
+                                       converter=converter),
+            dtype=FORMAT,  # Используем int16 напрямую
+            latency='low'  # Минимальная задержка устройства
+        )
+        self.stream.start()
+    
+    def switch_output_stream(self):
+        """Переоткрыть устройство под новый формат без паузы: старый поток играет, пока новый не начнёт"""
+        old_stream = self.stream
+        try:
+            self.open_output_stream()
+        except Exception as e:
+            # Драйвер не даёт открыть устройство дважды - короткий разрыв вместо перекрытия
+            print(f"[WARNING] Перекрытие потоков вывода недоступно ({e}), переоткрываем устройство")
+            old_stream.stop()
+            old_stream.close()
+            old_stream = None
+            self.open_output_stream()
+        if old_stream is not None:
+            self.root.after(OUTPUT_SWITCH_POLL_MS, self.finish_output_switch, old_stream,
+                            self.output_generation, time.time() + OUTPUT_SWITCH_TIMEOUT)
+    
+    def finish_output_switch(self, old_stream, generation, deadline):
+        """Закрыть старый поток вывода, когда новый начал играть (в GUI потоке)"""
+        if self.active_output < generation and time.time() < deadline and self.running:
+            self.root.after(OUTPUT_SWITCH_POLL_MS, self.finish_output_switch, old_stream, generation, deadline)
+            return
+        try:
+            old_stream.stop()
+            old_stream.close()
+        except Exception as e:
+            print(f"[WARNING] Ошибка закрытия старого потока вывода: {e}")
+    
+    def add_source(self, key, sock, addr):
+        """Новый источник из потока приема. Первый задаёт формат выхода и пишется в запись"""
+        source = StreamSource(key, sock, addr, self.client_id, self.sample_rate, self.chunk_size, self.nack_enabled,
+                              self.playout_delay)
+        source.gain = self.source_gains.get((addr[0], key[2]), 1.0)
+        source.on_format = self.on_source_format
+        source.trace = self.trace
+        source.fast_join = self.fast_join
+        if not self.sources:
+            source.recorder = self.recorder
+        self.source_map[key] = source
+        self.sources = self.sources + (source,)
+        print(f"[DEBUG] Новый источник: {source.label}")
+        self.root.after(0, self.add_source_row, source)
+        return source
+    
+    def expire_sources(self, current_time):
+        """Убрать источники, от которых давно нет пакетов"""
+        expired = [s for s in self.sources if current_time - s.last_receive_time > SOURCE_TIMEOUT]
+        if not expired:
+            return
+        primary = self.sources[0]
+        self.sources = tuple(s for s in self.sources if s not in expired)
+        for source in expired:
+            del self.source_map[source.key]
+            source.recorder = None
+            print(f"[DEBUG] Источник пропал: {source.label}")
+            self.root.after(0, self.remove_source_row, source.key)
+        # Формат выхода переходит к следующему источнику
+        if self.sources and primary in expired:
+            self.sources[0].recorder = self.recorder
+            self.on_source_format(self.sources[0], True)
+    
+    def on_source_format(self, source, reopen):
+        """Источник объявил формат (вызывается из потока приема)"""
+        if source is not self.sources[0]:
+            # Другая частота в сведение не попадает; размер пакета значения не имеет
+            source.muted = source.sample_rate != self.sample_rate
+            return
+        # Устройство переоткрываем при смене частоты, а размер чанка важен, только если блок следует за ним
+        reopen = (source.sample_rate != self.sample_rate
+                  or (self.device_blocksize is None and source.chunk_size != self.chunk_size))
+        self.sample_rate = source.sample_rate
+        self.chunk_size = source.chunk_size
+        self.stream_channels = source.stream_channels
+        self.encoding = source.encoding
+        if not self.format_pending:
+            self.format_pending = True
+            self.root.after(0, self.reopen_output_stream, reopen)
+    
+    def reopen_output_stream(self, reopen):
+        """Переоткрыть устройство и запись под новый формат (в GUI потоке)"""
+        self.format_pending = False
+        self.update_settings_info()
+        if not self.running:
+            return
+        try:
+            if self.recorder and (self.recorder.sample_rate, self.recorder.channels) != (self.sample_rate,
+                                                                                        self.stream_channels):
+                # Отключаем запись на время пересоздания файла, чтобы поток приема не писал в закрытый
+                old_recorder = self.recorder
+                self.recorder = None
+                if self.sources:
+                    self.sources[0].recorder = None
+                old_recorder.close()
+                self.recorder = RollingRecorder(RECORD_FILE, self.sample_rate, self.stream_channels, RECORD_SECONDS)
+                if self.sources:
+                    self.sources[0].recorder = self.recorder
+            if reopen and self.stream:
+                self.switch_output_stream()
+            for source in self.sources:
+                source.muted = source.sample_rate != self.sample_rate
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось переключить формат потока: {e}")
+            self.stop_receive()
+    
     def receive_loop(self):
-        """Главный цикл приема данных - оптимизирован"""
-        expected_size = self.chunk_size * CHANNELS * 2  # 16-bit = 2 bytes per sample
-        print(f"[DEBUG] Ожидаемый размер пакета: {expected_size} байт (chunk={self.chunk_size}, channels={CHANNELS})")
+        """Главный цикл приема данных: все сокеты в одном потоке, датаграммы разбираются по источникам"""
+        last_expire = time.time()
+        ring = self.ring
         
         while self.running:
             try:
-                data, addr = self.sock.recvfrom(65536)
-                current_time = time.time()
-                
-                # Отладочная информация для первых пакетов
-                if self.packet_count < 5:
-                    print(f"[DEBUG] Получен пакет #{self.packet_count + 1}: размер={len(data)} байт, от {addr}")
-                
-                # Проверяем размер данных (более гибкая проверка - допускаем небольшие отклонения)
-                if len(data) >= expected_size * 0.9:  # Допускаем 10% отклонение
-                    # Обрезаем до нужного размера если больше
-                    if len(data) > expected_size:
-                        data = data[:expected_size]
-                    
-                    # Умная обработка переполнения очереди
-                    try:
-                        self.audio_queue.put_nowait(data)
-                        self.packet_count += 1
-                        
-                        # Оцениваем задержку на основе интервала между пакетами
-                        if self.last_packet_time > 0:
-                            interval = current_time - self.last_packet_time
-                            # Задержка = разница между ожидаемым и реальным интервалом
-                            delay_diff = interval - self.expected_packet_interval
-                            if delay_diff > 0:
-                                self.estimated_latency = delay_diff * 1000  # в миллисекундах
-                        
-                        self.last_packet_time = current_time
-                    except queue.Full:
-                        # Удаляем старый пакет и добавляем новый
-                        try:
-                            self.audio_queue.get_nowait()
-                            self.audio_queue.put_nowait(data)
-                            self.packet_count += 1
-                            self.lost_packets += 1  # Считаем как потерю старого пакета
-                            self.last_packet_time = current_time
-                        except queue.Empty:
-                            pass
+                if ring:
+                    self.receive_ring(ring)
+                    current_time = time.time()
                 else:
-                    if self.lost_packets < 5:  # Выводим только первые несколько ошибок
-                        print(f"[WARNING] Пакет отклонен: размер {len(data)} байт, ожидается ~{expected_size} байт")
-                    self.lost_packets += 1
+                    readable, _, _ = select.select(self.sockets, [], [], 0.1)
+                    current_time = time.time()
+                    for sock in readable:
+                        data, addr = sock.recvfrom(65536)
+                        self.dispatch(sock, data, addr, current_time)
+                
+                if current_time - last_expire >= 1.0:
+                    last_expire = current_time
+                    self.expire_sources(current_time)
                 
-            except socket.timeout:
-                continue
             except Exception as e:
                 if self.running:
                     print(f"[ERROR] Receive error: {e}")
-                    self.lost_packets += 1
+    
+    def receive_ring(self, ring):
+        """Одно ожидание в futex кольца: будит и запись пакета, и сигнал сервера об unicast на наш сокет
+        (повторы, JOIN, ответ SYNC). Без сигнала сокет проверяется только на простое - на случай, если
+        датаграмма легла в очередь позже сигнала"""
+        ring.wait()
+        current_time = time.time()
+        packets = ring.read()
+        for data in packets:
+            self.dispatch(self.sockets[0], data, self.ring_addr, current_time)
+        if ring.signalled() or not packets:
+            sock = self.sockets[0]
+            while select.select(self.sockets, [], [], 0)[0]:
+                data, addr = sock.recvfrom(65536)
+                self.dispatch(sock, data, addr, time.time())
+    
+    def dispatch(self, sock, data, addr, current_time):
+        """Датаграмма (или пакет из общей памяти) - своему источнику"""
+        # Источник - отправитель и id потока в заголовке
+        stream_id = stream_id_of(data)
+        allowed = self.stream_filters[sock]
+        if allowed is not None and stream_id not in allowed:
+            return
+        key = (addr[0], addr[1], stream_id)
+        source = self.source_map.get(key)
+        if source is None:
+            source = self.add_source(key, sock, addr)
+        source.receive(data, current_time)
+    
+    def add_source_row(self, source):
+        """Строка источника: имя, усиление в сведении, краткая статистика"""
+        if self.source_map.get(source.key) is not source:
+            return
+        self.no_sources_label.pack_forget()
+        row = tk.Frame(self.sources_inner, bg='#313244')
+        row.pack(fill=tk.X)
+        tk.Label(row, text=source.label, font=('Consolas', 8), bg='#313244', fg='#cdd6f4',
+                 width=26, anchor='w').pack(side=tk.LEFT, padx=(5, 0))
+        
+        gain_var = tk.DoubleVar(value=round(20 * math.log10(source.gain), 1) if source.gain > 0 else SOURCE_GAIN_RANGE[0])
+        
+        def on_gain_change(value, source=source):
+            # Нижняя граница шкалы - выключение источника
+            db = float(value)
+            gain = 0.0 if db <= SOURCE_GAIN_RANGE[0] else 10 ** (db / 20)
+            source.gain = gain
+            self.source_gains[(source.addr[0], source.key[2])] = gain
+        
+        tk.Scale(row, variable=gain_var, from_=SOURCE_GAIN_RANGE[0], to=SOURCE_GAIN_RANGE[1], resolution=0.5,
+                 orient=tk.HORIZONTAL, length=120, showvalue=True, command=on_gain_change,
+                 font=('Segoe UI', 7), bg='#313244', fg='#cdd6f4', highlightthickness=0,
+                 troughcolor='#45475a').pack(side=tk.LEFT, padx=5)
+        stats_var = tk.StringVar(value="")
+        tk.Label(row, textvariable=stats_var, font=('Consolas', 8), bg='#313244', fg='#a6adc8',
+                 anchor='w').pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.source_rows[source.key] = (row, stats_var)
+    
+    def remove_source_row(self, key):
+        row = self.source_rows.pop(key, None)
+        if row is not None:
+            row[0].destroy()
+        if not self.source_rows:
+            self.no_sources_label.pack(fill=tk.X)
     
     def update_stats(self):
         """Обновление статистики в GUI с задержкой и уровнем"""
         while self.running:
             elapsed = time.time() - self.start_time
+            sources = self.sources
             if elapsed > 0:
-                packets_per_sec = self.packet_count / elapsed
-                total_packets = self.packet_count + self.lost_packets
-                loss_rate = (self.lost_packets / total_packets) * 100 if total_packets > 0 else 0
+                # Сводная статистика по всем источникам
+                packet_count = sum(s.packet_count for s in sources)
+                lost_packets = sum(s.lost_packets for s in sources)
+                packets_per_sec = packet_count / elapsed
+                total_packets = packet_count + lost_packets
+                loss_rate = (lost_packets / total_packets) * 100 if total_packets > 0 else 0
                 
-                # Оценка общей задержки (сетевая + буфер)
-                buffer_delay = (self.audio_queue.qsize() * self.expected_packet_interval * 1000) if not self.audio_queue.empty() else 0
-                total_delay = self.estimated_latency + buffer_delay
+                # Оценка общей задержки (сетевая + буфер) - по худшему источнику
+                total_delay = max((s.estimated_latency + s.buffer_ms() for s in sources), default=0.0)
+                jitter = max((s.jitter for s in sources), default=0.0)
+                underruns = sum(s.underruns for s in sources)
+                nack_requested = sum(s.nack_requested for s in sources)
                 
                 # Форматирование статистики с цветовыми индикаторами (компактное)
                 delay_status = "🟢" if total_delay < 50 else "🟡" if total_delay < 100 else "🔴"
                 loss_status = "🟢" if loss_rate < 5 else "🟡" if loss_rate < 15 else "🔴"
                 
-                stats_text = f"Пакетов: {self.packet_count} | Потери: {loss_status} {loss_rate:.1f}% | Задержка: {delay_status} {total_delay:.0f}мс"
+                stats_text = f"Пакетов: {packet_count} | Потери: {loss_status} {loss_rate:.1f}% | Задержка: {delay_status} {total_delay:.0f}мс"
+                stats_text += f" | Джиттер: {jitter * 1000:.1f}мс"
+                if len(sources) > 1:
+                    stats_text += f" | Источников: {len(sources)}"
+                if underruns > 0:
+                    stats_text += f" | Опустошений: {underruns}"
+                if nack_requested > 0:
+                    # Успешность повторов и сколько задержки они стоили
+                    recovered = sum(s.nack_recovered for s in sources)
+                    recovery_ms = sum(s.nack_recovery_time for s in sources) / recovered * 1000 if recovered else 0
+                    wait_ms = sum(s.nack_wait_time for s in sources) * 1000
+                    stats_text += (f" | NACK: восстановлено {recovered}/{nack_requested} "
+                                   f"({recovered / nack_requested * 100:.0f}%), +{recovery_ms:.0f}мс, "
+                                   f"ожидание {wait_ms:.0f}мс")
+                partial = sum(s.reassembler.partial for s in sources)
+                if partial > 0:
+                    # Потерянные фрагменты заменены тишиной, остальная часть чанка сыграна
+                    completed = sum(s.reassembler.completed for s in sources)
+                    fragments_lost = sum(s.reassembler.fragments_lost for s in sources)
+                    stats_text += (f" | Фрагменты: потеряно {fragments_lost} "
+                                   f"в {partial} из {completed + partial} пакетов")
+                if sources and sources[0].in_dtx:
+                    stats_text += " | 🔇 Тишина (DTX)"
+                ring = self.ring
+                if ring and ring.lost:
+                    # Кольцо перезаписано раньше, чем поток приёма его прочитал
+                    stats_text += f" | Память: пропущено {ring.lost}"
+                join_report = sources[0].join_report() if sources else ""
+                if join_report:
+                    stats_text += f" | {join_report}"
+                if self.playout_delay is not None and sources:
+                    # Отклонение от целевого времени воспроизведения (одинакового у всех клиентов)
+                    primary = sources[0]
+                    if primary.clock.ready():
+                        stats_text += (f" | Синхр: {primary.sync_error * 1000:+.1f}мс "
+                                       f"(RTT {primary.clock.rtt * 1000:.1f}мс)")
+                    else:
+                        stats_text += " | Синхр: ожидание времени сервера"
+                # Запас callback вывода по времени и xrun устройства
+                profiler_report = self.profiler.report()
+                if profiler_report:
+                    stats_text += f" | {profiler_report}"
+                dsp_report = self.dsp.report()
+                if dsp_report:
+                    stats_text += f" | {dsp_report}"
+                converter = self.output_converter
+                if converter and converter.calls:
+                    stats_text += f" | {converter.report()}"
+                self.update_profile_advice(sources)
+                if self.auto_profile_var.get() and sources:
+                    stats_text += f" | {self.advisor.report(sources[0].sample_rate)}"
+                detector = self.detector
+                if detector and sources:
+                    # Время ЦАП переводим в часы сервера - часы сводятся и без синхронного воспроизведения
+                    primary = sources[0]
+                    for source in sources:
+                        source.clock_wanted = True
+                    detector.analyze(primary.clock.offset if primary.clock.ready() else None)
+                    stats_text += f" | {detector.report()}"
                 self.stats_var.set(stats_text)
                 
+                # Строки источников
+                for source in sources:
+                    row = self.source_rows.get(source.key)
+                    if row is None:
+                        continue
+                    if source.muted:
+                        row[1].set(f"⛔ {source.sample_rate}Hz - не совпадает с выходом")
+                        continue
+                    source_text = (f"{int(source.last_audio_level * 100):3d}% | потери {source.loss_rate():.1f}% | "
+                                   f"{source.estimated_latency + source.buffer_ms():.0f}мс")
+                    if source.in_dtx:
+                        source_text += " | DTX"
+                    if self.playout_delay is not None and source.clock.ready():
+                        source_text += f" | синхр {source.sync_error * 1000:+.1f}мс"
+                    row[1].set(source_text)
+                
                 # Обновляем индикатор уровня звука с цветовой индикацией
                 level_percent = int(self.last_audio_level * 100)
                 self.level_var.set(f"{level_percent}%")
@@ -528,18 +1069,33 @@ class MulticastAudioReceiverGUI:
                 pass
             self.stream = None
         
-        if hasattr(self, 'sock'):
+        if self.ring:
+            # Кольцо читает только поток приема - закрываем после его выхода
+            self.receive_thread.join(timeout=0.5)
+            self.ring.close()
+            self.ring = None
+        for sock in self.sockets:
             try:
-                self.sock.close()
+                sock.close()
             except:
                 pass
+        self.sockets = []
         
-        # Очищаем очередь
-        while not self.audio_queue.empty():
-            try:
-                self.audio_queue.get_nowait()
-            except queue.Empty:
-                break
+        for source in self.sources:
+            source.recorder = None
+            source.trace = None
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        if self.trace:
+            trace, self.trace = self.trace, None
+            trace.close()
+        
+        # Очищаем источники
+        self.sources = ()
+        self.source_map = {}
+        for key in list(self.source_rows):
+            self.remove_source_row(key)
         
         # Обновляем интерфейс
         self.status_var.set("⏸ Готов")
@@ -548,8 +1104,36 @@ class MulticastAudioReceiverGUI:
         self.stop_btn.config(state=tk.DISABLED)
         self.device_combo.config(state=tk.NORMAL)
         self.latency_combo.config(state=tk.NORMAL)  # Разблокируем после остановки
+        self.blocksize_combo.config(state=tk.NORMAL)
+        self.record_check.config(state=tk.NORMAL)
+        self.nack_check.config(state=tk.NORMAL)
+        self.fast_join_check.config(state=tk.NORMAL)
+        self.native_rate_check.config(state=tk.NORMAL)
+        self.trace_check.config(state=tk.NORMAL)
+        self.sync_check.config(state=tk.NORMAL)
+        self.playout_delay_spin.config(state=tk.NORMAL)
+        self.qos_combo.config(state=tk.NORMAL)
+        self.interface_entry.config(state=tk.NORMAL)
+        self.transport_combo.config(state=tk.NORMAL)
+    
+    def export_recording(self):
+        """Экспорт всей кольцевой записи в WAV (диапазоны - через StreamAudio_Recorder.py)"""
+        path = filedialog.asksaveasfilename(defaultextension='.wav',
+                                            initialfile=time.strftime("StreamAudio_%Y%m%d_%H%M%S.wav"),
+                                            filetypes=[("WAV", "*.wav")])
+        if not path:
+            return
+        try:
+            duration = export_wav(RECORD_FILE, path)
+            messagebox.showinfo("Экспорт", f"Сохранено {duration:.1f} с в {path}")
+        except FileNotFoundError:
+            messagebox.showerror("Ошибка", "Запись ещё не создана - начните прослушивание")
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось экспортировать запись: {e}")
 
 if __name__ == "__main__":
+    STARTUP.mark("импорт модулей")
     root = tk.Tk()
     app = MulticastAudioReceiverGUI(root)
+    root.after_idle(STARTUP.mark, "окно готово")
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,252 @@
+import math
+import time
+import numpy as np
+
+# Варианты потока с пониженной полосой: даунмикс, понижение частоты и µ-law
+ENCODING_PCM16 = 0
+ENCODING_ULAW = 1
+ENCODING_NAMES = {ENCODING_PCM16: 'int16', ENCODING_ULAW: 'µ-law'}
+BYTES_PER_SAMPLE = {ENCODING_PCM16: 2, ENCODING_ULAW: 1}
+SILENCE_BYTE = {ENCODING_PCM16: 0x00, ENCODING_ULAW: 0xFF}  # Для заполнения потерянных фрагментов
+
+# rate=None - частота захвата без изменений
+STREAM_VARIANTS = {
+    'PCM стерео': {'channels': 2, 'rate': None, 'encoding': ENCODING_PCM16},
+    'PCM моно': {'channels': 1, 'rate': None, 'encoding': ENCODING_PCM16},
+    'Моно 32 кГц': {'channels': 1, 'rate': 32000, 'encoding': ENCODING_PCM16},
+    'Моно 22.05 кГц': {'channels': 1, 'rate': 22050, 'encoding': ENCODING_PCM16},
+    'µ-law моно 22.05 кГц': {'channels': 1, 'rate': 22050, 'encoding': ENCODING_ULAW},
+}
+DEFAULT_VARIANT = 'PCM стерео'
+
+RESAMPLER_TAPS = 31  # Длина антиалиасингового FIR фильтра
+
+# Полифазный ресемплер выхода на родной частоте устройства (44100 -> 48000 = 160/147)
+POLYPHASE_TAPS = 32  # Отводов на фазу: задержка фильтра - половина из них во входных отсчётах
+POLYPHASE_CUTOFF = 0.92  # Срез от частоты Найквиста меньшей из частот (20.3 кГц для 44100)
+POLYPHASE_BETA = 8.0  # Окно Кайзера: подавление вне полосы около 80 дБ
+
+# G.711 µ-law
+ULAW_BIAS = 0x84
+ULAW_CLIP = 32635
+_ULAW_EXPONENT = np.array([0] * 2 + [int(np.log2(i)) for i in range(2, 256)], dtype=np.int32)
+
+
+def _build_ulaw_decode_table():
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + ULAW_BIAS) << exponent) - ULAW_BIAS
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+ULAW_DECODE_TABLE = _build_ulaw_decode_table()
+
+
+def ulaw_encode(samples):
+    """Векторизованное кодирование int16 -> µ-law (uint8)"""
+    x = samples.astype(np.int32)
+    sign = (x < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(x), ULAW_CLIP) + ULAW_BIAS
+    exponent = _ULAW_EXPONENT[magnitude >> 7]
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+def ulaw_decode(codes):
+    """Декодирование µ-law -> int16 через таблицу"""
+    return ULAW_DECODE_TABLE[codes]
+
+
+def variant_format(variant, capture_rate, chunk):
+    """Параметры потока для варианта: (rate, channels, encoding, chunk)"""
+    config = STREAM_VARIANTS[variant]
+    rate = config['rate'] or capture_rate
+    out_chunk = max(1, int(round(chunk * rate / capture_rate)))
+    return rate, config['channels'], config['encoding'], out_chunk
+
+
+def payload_size(channels, encoding, chunk):
+    """Размер полезной нагрузки аудио пакета в байтах"""
+    return chunk * channels * BYTES_PER_SAMPLE[encoding]
+
+
+def bitrate_kbps(rate, channels, encoding):
+    """Битрейт аудио без заголовков"""
+    return rate * channels * BYTES_PER_SAMPLE[encoding] * 8 / 1000
+
+
+def lowpass_taps(cutoff, taps=RESAMPLER_TAPS):
+    """Оконный sinc фильтр, cutoff - доля от частоты Найквиста входа"""
+    n = np.arange(taps) - (taps - 1) / 2
+    h = cutoff * np.sinc(cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+class Resampler:
+    """Понижение частоты: FIR антиалиасинг + дробная линейная интерполяция, состояние между чанками"""
+
+    def __init__(self, in_rate, out_rate, channels, chunk):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.step = in_rate / out_rate
+        self.channels = channels
+        self.taps = lowpass_taps(min(1.0, out_rate / in_rate) * 0.9)
+        history = len(self.taps) - 1
+        # Вход с историей предыдущего чанка и отфильтрованный сигнал с последним отсчётом прошлого чанка
+        self._x = np.zeros((history + chunk, channels), dtype=np.float32)
+        self._y = np.zeros((chunk + 1, channels), dtype=np.float32)
+        self._history = history
+        self._pos = 0.0
+
+    def process(self, chunk):
+        """chunk: float32 (frames, channels). Возвращает отфильтрованные отсчёты на выходной частоте"""
+        frames = len(chunk)
+        if frames + self._history != len(self._x):
+            self.__init__(self.in_rate, self.out_rate, self.channels, frames)
+        h = self._history
+        self._x[h:] = chunk
+        windows = np.lib.stride_tricks.sliding_window_view(self._x, len(self.taps), axis=0)
+        np.matmul(windows, self.taps, out=self._y[1:])
+
+        count = int(np.ceil((frames - self._pos) / self.step))
+        positions = self._pos + np.arange(max(count, 0)) * self.step
+        index = positions.astype(np.int64)
+        frac = (positions - index).astype(np.float32)[:, None]
+        out = self._y[index] * (1.0 - frac) + self._y[np.minimum(index + 1, frames)] * frac
+
+        self._pos = self._pos + count * self.step - frames
+        self._y[0] = self._y[frames]
+        self._x[:h] = self._x[frames:]
+        return out
+
+
+class PolyphaseResampler:
+    """Рациональное преобразование частоты L/M блоками: банк из L фаз FIR фильтра, каждый выходной отсчёт -
+    скалярное произведение окна входа на свою фазу, весь блок - одним einsum. Блок любого размера до
+    chunk кадров; буферы выделяются при создании и заново только при росте блока"""
+
+    def __init__(self, in_rate, out_rate, channels, chunk, taps=POLYPHASE_TAPS):
+        divisor = math.gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.taps = taps
+        # Прототип на частоте in_rate * up; усиление up - интерполяция нулями его съедает
+        length = taps * self.up
+        cutoff = min(1.0, out_rate / in_rate) * POLYPHASE_CUTOFF / self.up
+        n = np.arange(length) - (length - 1) / 2
+        prototype = cutoff * np.sinc(cutoff * n) * np.kaiser(length, POLYPHASE_BETA)
+        prototype *= self.up / prototype.sum()
+        # Фаза p: отводы h[p + k*up] для входа x[i - k]; порядок k обратный, чтобы окно шло от старых к новым
+        self._bank = np.ascontiguousarray(prototype.reshape(taps, self.up).T[:, ::-1], dtype=np.float32)
+        self.delay = (length - 1) / 2 / (self.up * in_rate)  # Групповая задержка фильтра, с
+        self._history = taps - 1
+        self._t0 = 0  # Позиция следующего выходного отсчёта в 1/up входного отсчёта от начала блока
+        self._allocate(chunk)
+        self.calls = 0
+        self.elapsed = 0.0
+
+    def _allocate(self, chunk):
+        """Буферы под блок до chunk кадров (история прошлого блока сохраняется)"""
+        history = self._x[:self._history].copy() if hasattr(self, '_x') else None
+        self.chunk = chunk
+        self._x = np.zeros((self._history + chunk, self.channels), dtype=np.float32)
+        if history is not None:
+            self._x[:self._history] = history
+        # Окно i заканчивается входным отсчётом i блока (история - хвост прошлого блока)
+        self._windows = np.lib.stride_tricks.sliding_window_view(self._x, self.taps, axis=0)
+        capacity = chunk * self.up // self.down + 2
+        self._steps = np.arange(capacity, dtype=np.int64) * self.down
+        self._t = np.empty(capacity, dtype=np.int64)
+        self._index = np.empty(capacity, dtype=np.int64)
+        self._phase = np.empty(capacity, dtype=np.int64)
+        self._gathered = np.empty((capacity, self.channels, self.taps), dtype=np.float32)
+        self._coeffs = np.empty((capacity, self.taps), dtype=np.float32)
+        self._out = np.empty((capacity, self.channels), dtype=np.float32)
+
+    def process(self, block):
+        """block: (frames, channels) на входной частоте. Возвращает вид на внутренний буфер float32 -
+        действителен до следующего вызова"""
+        started = time.perf_counter()
+        frames = len(block)
+        if frames > self.chunk:
+            self._allocate(frames)
+        h = self._history
+        self._x[h:h + frames] = block
+        span = frames * self.up
+        count = max(0, (span - self._t0 + self.down - 1) // self.down)
+        t = np.add(self._steps[:count], self._t0, out=self._t[:count])
+        index = np.floor_divide(t, self.up, out=self._index[:count])
+        phase = np.remainder(t, self.up, out=self._phase[:count])
+        gathered = np.take(self._windows, index, axis=0, out=self._gathered[:count])
+        coeffs = np.take(self._bank, phase, axis=0, out=self._coeffs[:count])
+        out = np.einsum('nck,nk->nc', gathered, coeffs, out=self._out[:count])
+        self._t0 += count * self.down - span
+        self._x[:h] = self._x[frames:frames + h]
+        self.calls += 1
+        self.elapsed += time.perf_counter() - started
+        return out
+
+    def cost_us(self):
+        """Среднее время на блок, мкс"""
+        return self.elapsed / self.calls * 1000000 if self.calls else 0.0
+
+
+def native_rate(device, fallback):
+    """Частота, на которой работает микшер ОС для устройства (default_samplerate из sd.query_devices)"""
+    rate = int(round(device.get('default_samplerate') or 0))
+    return rate if rate > 0 else fallback
+
+
+class StreamEncoder:
+    """Даунмикс/понижение частоты/µ-law для захваченных чанков с выходом пакетами фиксированного размера"""
+
+    def __init__(self, variant, capture_rate, capture_channels, chunk):
+        self.rate, self.channels, self.encoding, self.chunk = variant_format(variant, capture_rate, chunk)
+        self.capture_channels = capture_channels
+        self.passthrough = (self.rate == capture_rate and self.channels == capture_channels
+                            and self.encoding == ENCODING_PCM16)
+        self.resampler = Resampler(capture_rate, self.rate, self.channels, chunk) \
+            if self.rate != capture_rate else None
+        # FIFO выходных кадров: дробное число кадров на чанк собирается в пакеты одного размера
+        self._fifo = np.zeros((self.chunk * 4 + chunk, self.channels), dtype=np.float32)
+        self._fill = 0
+
+    def encode(self, indata):
+        """indata: int16 (frames, capture_channels). Возвращает список полезных нагрузок"""
+        if self.passthrough:
+            return [indata.tobytes()]
+
+        if self.channels == 1 and self.capture_channels > 1:
+            mixed = indata.mean(axis=1, dtype=np.float32)[:, None]
+        else:
+            mixed = indata.astype(np.float32)
+        if self.resampler is not None:
+            mixed = self.resampler.process(mixed)
+
+        count = len(mixed)
+        if self._fill + count > len(self._fifo):
+            self._fill = 0  # Переполнение не должно случаться - сбрасываем вместо роста задержки
+        self._fifo[self._fill:self._fill + count] = mixed
+        self._fill += count
+
+        payloads = []
+        while self._fill >= self.chunk:
+            block = np.clip(np.rint(self._fifo[:self.chunk]), -32768, 32767).astype(np.int16)
+            if self.encoding == ENCODING_ULAW:
+                payloads.append(ulaw_encode(block).tobytes())
+            else:
+                payloads.append(block.tobytes())
+            self._fifo[:self._fill - self.chunk] = self._fifo[self.chunk:self._fill]
+            self._fill -= self.chunk
+        return payloads
+
+
+def decode_payload(data, encoding):
+    """Полезная нагрузка -> int16 PCM байты"""
+    if encoding == ENCODING_ULAW:
+        return ulaw_decode(np.frombuffer(data, dtype=np.uint8)).tobytes()
+    return data
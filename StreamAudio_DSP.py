@@ -0,0 +1,249 @@
+import math
+import time
+import numpy as np
+
+# Цепочка обработки звука: каждый процессор работает на месте над предвыделенным float32 буфером
+# (шкала int16), без выделений памяти в обработке и без scipy. Буферы выделяются под наибольший блок,
+# блок меньшего размера (драйвер с blocksize=0) обрабатывается срезом без перенастройки
+FULL_SCALE = 32768.0
+TIMING_SMOOTHING = 0.05  # Сглаживание времени выполнения стадий
+
+HIGHPASS_CUTOFF = 80.0  # Гц - убираем гул и постоянную составляющую
+HIGHPASS_BLOCK = 128  # Максимальный подблок матричного IIR
+LIMITER_THRESHOLD_DB = -1.0
+LIMITER_RELEASE = 0.1  # с
+LOUDNESS_TARGET_DB = -20.0  # RMS dBFS
+LOUDNESS_MAX_GAIN_DB = 12.0
+LOUDNESS_WINDOW = 3.0  # с - постоянная времени измерения громкости
+LOUDNESS_GATE_DB = -50.0  # Тишину не измеряем, чтобы не поднимать шум
+
+
+def db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+
+class Processor:
+    """Стадия цепочки. prepare() выделяет всё заранее под наибольший блок (frames),
+    process() меняет на месте буфер любой длины до frames - число кадров берётся из len(buffer)"""
+
+    name = ''
+
+    def __init__(self):
+        self.shape = None
+        self.rate = None
+        self.elapsed = 0.0  # Сглаженное время process(), с
+
+    def prepare(self, frames, channels, rate):
+        self.shape = (frames, channels)
+        self.rate = rate
+        self._ramp_index = np.arange(1, frames + 1, dtype=np.float32)[:, None]
+        self._ramp = np.empty((frames, 1), dtype=np.float32)
+        self._scratch = np.empty((frames, channels), dtype=np.float32)
+
+    def process(self, buffer):
+        raise NotImplementedError
+
+    def _apply_gain(self, buffer, start, end):
+        """Плавный переход усиления за блок (без щелчков при смене)"""
+        if start == end:
+            if end != 1.0:
+                np.multiply(buffer, end, out=buffer)
+            return
+        frames = len(buffer)
+        ramp = self._ramp[:frames]
+        np.multiply(self._ramp_index[:frames], (end - start) / frames, out=ramp)
+        ramp += start
+        np.multiply(buffer, ramp, out=buffer)
+
+
+class Gain(Processor):
+    """Усиление в дБ"""
+
+    name = 'Усиление'
+
+    def __init__(self, db=0.0):
+        super().__init__()
+        self.gain = self.target = db_to_gain(db)
+
+    def set_db(self, db):
+        self.target = db_to_gain(db)
+
+    def process(self, buffer):
+        target = self.target
+        self._apply_gain(buffer, self.gain, target)
+        self.gain = target
+
+
+class HighPass(Processor):
+    """ФВЧ Баттерворта 2-го порядка. IIR считается подблоками в матричной форме:
+    y = H @ x + Z @ состояние, где H - импульсная характеристика, Z - отклик на состояние"""
+
+    name = 'ФВЧ'
+
+    def __init__(self, cutoff=HIGHPASS_CUTOFF):
+        super().__init__()
+        self.cutoff = cutoff
+
+    def prepare(self, frames, channels, rate):
+        super().prepare(frames, channels, rate)
+        self.block = min(frames, HIGHPASS_BLOCK)
+        b, a = self._coefficients(rate)
+        impulse = self._response(b, a, self.block, np.zeros(4), impulse=True)
+        self._H = np.zeros((self.block, self.block), dtype=np.float32)
+        for i in range(self.block):
+            self._H[i, :i + 1] = impulse[i::-1]
+        self._Z = np.stack([self._response(b, a, self.block, state) for state in np.eye(4)], axis=1).astype(np.float32)
+        self._state = np.zeros((4, channels), dtype=np.float32)  # x[n-1], x[n-2], y[n-1], y[n-2]
+        self._y = np.empty((self.block, channels), dtype=np.float32)
+        self._t = np.empty((self.block, channels), dtype=np.float32)
+
+    def _coefficients(self, rate):
+        w0 = 2 * np.pi * min(self.cutoff, rate * 0.45) / rate
+        alpha = np.sin(w0) / np.sqrt(2)
+        cos_w0 = np.cos(w0)
+        a0 = 1 + alpha
+        b = np.array([(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]) / a0
+        a = np.array([-2 * cos_w0, 1 - alpha]) / a0
+        return b, a
+
+    @staticmethod
+    def _response(b, a, length, state, impulse=False):
+        """Отклик фильтра длиной length на единичный импульс или начальное состояние (при подготовке)"""
+        x1, x2, y1, y2 = state
+        out = np.zeros(length)
+        for n in range(length):
+            x = 1.0 if impulse and n == 0 else 0.0
+            y = b[0] * x + b[1] * x1 + b[2] * x2 - a[0] * y1 - a[1] * y2
+            x1, x2, y1, y2 = x, x1, y, y1
+            out[n] = y
+        return out
+
+    def process(self, buffer):
+        state = self._state
+        for start in range(0, len(buffer), self.block):
+            x = buffer[start:start + self.block]
+            n = len(x)  # Последний подблок может быть короче - берём угол матриц
+            y, t = self._y[:n], self._t[:n]
+            np.matmul(self._H[:n, :n], x, out=y)
+            np.matmul(self._Z[:n], state, out=t)
+            y += t
+            if n >= 2:
+                state[1] = x[-2]
+                state[3] = y[-2]
+            else:
+                state[1] = state[0]
+                state[3] = state[2]
+            state[0] = x[-1]
+            state[2] = y[-1]
+            x[:] = y
+
+
+class Limiter(Processor):
+    """Пиковый лимитер: мгновенная атака, плавное восстановление, жёсткий порог на выходе"""
+
+    name = 'Лимитер'
+
+    def __init__(self, threshold_db=LIMITER_THRESHOLD_DB, release=LIMITER_RELEASE):
+        super().__init__()
+        self.threshold = db_to_gain(threshold_db) * FULL_SCALE
+        self.release = release
+        self.gain = 1.0
+
+    def process(self, buffer):
+        frames = len(buffer)
+        scratch = self._scratch[:frames]
+        np.abs(buffer, out=scratch)
+        peak = float(scratch.max())
+        target = min(1.0, self.threshold / peak) if peak > 0 else 1.0
+        # Восстановление за блок - по его фактической длине
+        release_coeff = 1.0 - math.exp(-frames / (self.rate * self.release))
+        gain = target if target < self.gain else self.gain + (target - self.gain) * release_coeff
+        self._apply_gain(buffer, self.gain, gain)
+        np.clip(buffer, -self.threshold, self.threshold, out=buffer)
+        self.gain = gain
+
+
+class LoudnessNormalizer(Processor):
+    """Выравнивание громкости к целевому RMS по скользящему измерению с порогом тишины"""
+
+    name = 'Нормализация'
+
+    def __init__(self, target_db=LOUDNESS_TARGET_DB, max_gain_db=LOUDNESS_MAX_GAIN_DB):
+        super().__init__()
+        self.target = (db_to_gain(target_db) * FULL_SCALE) ** 2
+        self.max_gain = db_to_gain(max_gain_db)
+        self.gate = (db_to_gain(LOUDNESS_GATE_DB) * FULL_SCALE) ** 2
+        self.level = 0.0
+        self.gain = 1.0
+
+    def process(self, buffer):
+        frames = len(buffer)
+        scratch = self._scratch[:frames]
+        np.square(buffer, out=scratch)
+        mean_square = float(scratch.mean())
+        coeff = 1.0 - math.exp(-frames / (self.rate * LOUDNESS_WINDOW))
+        if mean_square > self.gate:
+            self.level += (mean_square - self.level) * coeff
+        gain = self.gain
+        if self.level > 0:
+            desired = min(self.max_gain, max(1.0 / self.max_gain, math.sqrt(self.target / self.level)))
+            gain += (desired - gain) * coeff
+        self._apply_gain(buffer, self.gain, gain)
+        self.gain = gain
+
+
+class DSPChain:
+    """Цепочка процессоров над int16 чанком. configure() меняет состав на лету (атомарная замена списка)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.stages = ()
+        self._buffer = None  # Под наибольший блок; обработка идёт срезом
+        self.frames = 0  # Длина последнего блока
+
+    def configure(self, processors, rate=None):
+        """Новый состав цепочки; процессоры сохраняют своё состояние между перенастройками"""
+        if rate is not None:
+            self.rate = rate
+        stages = tuple(processors)
+        if self._buffer is not None:
+            for processor in stages:
+                if processor.shape != self._buffer.shape or processor.rate != self.rate:
+                    processor.prepare(*self._buffer.shape, self.rate)
+        self.stages = stages
+
+    def process(self, samples):
+        """samples: int16 (frames, channels), меняется на месте"""
+        stages = self.stages
+        if not stages:
+            return
+        frames, channels = samples.shape
+        if self._buffer is None or len(self._buffer) < frames or self._buffer.shape[1] != channels:
+            # Выделение только при росте блока или смене числа каналов (как в Mixer)
+            self._buffer = np.empty(samples.shape, dtype=np.float32)
+        buffer = self._buffer[:frames]
+        self.frames = frames
+        np.copyto(buffer, samples, casting='unsafe')
+        for processor in stages:
+            if processor.shape != self._buffer.shape or processor.rate != self.rate:
+                processor.prepare(*self._buffer.shape, self.rate)
+            started = time.perf_counter()
+            processor.process(buffer)
+            processor.elapsed += (time.perf_counter() - started - processor.elapsed) * TIMING_SMOOTHING
+        np.clip(buffer, -FULL_SCALE, FULL_SCALE - 1, out=buffer)
+        np.rint(buffer, out=buffer)
+        np.copyto(samples, buffer, casting='unsafe')
+
+    def deadline(self):
+        """Длительность последнего блока - бюджет времени на обработку"""
+        return self.frames / self.rate
+
+    def report(self):
+        """Время стадий и доля от бюджета чанка для статистики"""
+        stages = self.stages
+        deadline = self.deadline()
+        if not stages or not deadline:
+            return ""
+        total = sum(p.elapsed for p in stages)
+        parts = ", ".join(f"{p.name} {p.elapsed * 1000000:.0f}мкс" for p in stages)
+        return f"DSP: {parts} ({total / deadline * 100:.1f}% от {deadline * 1000:.1f}мс)"
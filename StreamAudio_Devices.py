@@ -0,0 +1,234 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from importlib import metadata, util
+
+# Быстрый запуск: sounddevice импортируется по первому требованию (импорт поднимает PortAudio, а
+# Pa_Initialize опрашивает все host API - на Windows с WDM-KS/ASIO это сотни миллисекунд и больше).
+# Список устройств окно берёт из кэша на диске, ключ кэша - отпечаток аудиоокружения, который
+# считается без PortAudio. Настоящий опрос идёт в фоне и заменяет список, если он изменился
+DEFAULT_DEVICE_CACHE = 'StreamAudio_devices.json'
+CACHE_VERSION = 1
+# Поля устройства из sd.query_devices, которые нужны окнам и открытию потока
+DEVICE_FIELDS = ('name', 'hostapi', 'max_input_channels', 'max_output_channels', 'default_samplerate',
+                 'default_low_input_latency', 'default_low_output_latency',
+                 'default_high_input_latency', 'default_high_output_latency')
+# Реестр Windows: конечные точки звука, время изменения ключа меняется при подключении устройства
+MMDEVICES_KEYS = (r'SOFTWARE\Microsoft\Windows\CurrentVersion\MMDevices\Audio\Render',
+                  r'SOFTWARE\Microsoft\Windows\CurrentVersion\MMDevices\Audio\Capture')
+APP_MODULES = ('StreamAudio_Client', 'StreamAudio_Server')
+MEASURE_RUNS = 3
+
+
+class StartupTimer:
+    """Отметки времени запуска от импорта этого модуля (первый модуль проекта в приложениях)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks = {}
+
+    def mark(self, name):
+        """Отметить этап один раз; повторные отметки (ручное обновление списка) не пишутся"""
+        if name in self.marks:
+            return
+        self.marks[name] = (time.perf_counter() - self.started) * 1000
+        print(f"[INFO] Запуск: {name} - {self.marks[name]:.0f} мс")
+
+
+STARTUP = StartupTimer()
+
+_sounddevice = None
+_sounddevice_lock = threading.Lock()
+
+
+def sounddevice_available():
+    """Установлен ли sounddevice - без импорта и инициализации PortAudio"""
+    if 'sounddevice' in sys.modules:
+        return True
+    try:
+        return util.find_spec('sounddevice') is not None
+    except ValueError:
+        return False
+
+
+def load_sounddevice():
+    """Модуль sounddevice; первый вызов импортирует его (и поднимает PortAudio) под блокировкой"""
+    global _sounddevice
+    with _sounddevice_lock:
+        if _sounddevice is None:
+            started = time.perf_counter()
+            import sounddevice
+            _sounddevice = sounddevice
+            print(f"[DEBUG] sounddevice и PortAudio загружены за {(time.perf_counter() - started) * 1000:.0f} мс")
+    return _sounddevice
+
+
+def _audio_endpoints():
+    """Дешёвые признаки набора устройств ОС без PortAudio (пусто, если ОС их не даёт)"""
+    parts = []
+    if sys.platform == 'win32':
+        try:
+            import winreg
+            for path in MMDEVICES_KEYS:
+                with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, path) as key:
+                    subkeys, _, modified = winreg.QueryInfoKey(key)
+                    parts.append(f"{path}:{subkeys}:{modified}")
+        except OSError:
+            pass
+    elif os.path.isdir('/dev/snd'):
+        parts.append(','.join(sorted(os.listdir('/dev/snd'))))
+    return parts
+
+
+def device_fingerprint():
+    """Отпечаток окружения, в котором снят список: ОС, интерпретатор, версия sounddevice, устройства ОС"""
+    try:
+        version = metadata.version('sounddevice')
+    except metadata.PackageNotFoundError:
+        version = ''
+    parts = [platform.system(), platform.release(), platform.node(), sys.executable, version]
+    parts.extend(_audio_endpoints())
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class DeviceCatalog:
+    """Список устройств: сразу из кэша, затем фоновый опрос PortAudio с обновлением кэша"""
+
+    def __init__(self, path=DEFAULT_DEVICE_CACHE):
+        self.path = path
+        self.snapshot = None  # {'hostapis': [имена], 'devices': [словари DEVICE_FIELDS + index]}
+        self.fresh = False  # snapshot получен от PortAudio в этом запуске
+        self.error = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def cached(self):
+        """Снимок из кэша, если отпечаток совпал (None - кэша нет, он устарел или повреждён)"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != CACHE_VERSION or data.get('fingerprint') != device_fingerprint():
+            return None
+        with self._lock:
+            if self.snapshot is None:
+                self.snapshot = {'hostapis': data['hostapis'], 'devices': data['devices']}
+            return self.snapshot
+
+    def query(self):
+        """Опросить PortAudio (блокирует на время импорта sounddevice и перечисления устройств)"""
+        sd = load_sounddevice()
+        hostapis = [hostapi['name'] for hostapi in sd.query_hostapis()]
+        devices = []
+        for index, device in enumerate(sd.query_devices()):
+            entry = {field: device[field] for field in DEVICE_FIELDS if field in device}
+            entry['index'] = index
+            devices.append(entry)
+        return {'hostapis': hostapis, 'devices': devices}
+
+    def refresh_async(self, callback):
+        """Опрос в фоне; callback(snapshot, error, changed) вызывается из фонового потока"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._refresh, args=(callback,), daemon=True)
+            self._thread.start()
+
+    def _refresh(self, callback):
+        try:
+            snapshot = self.query()
+        except Exception as e:
+            self.error = e
+            callback(None, e, False)
+            return
+        with self._lock:
+            changed = snapshot != self.snapshot
+            self.snapshot = snapshot
+            self.fresh = True
+            self.error = None
+        if changed:
+            self.save(snapshot)
+        callback(snapshot, None, changed)
+
+    def save(self, snapshot):
+        """Записать кэш атомарно: второе приложение может читать его в это же время"""
+        data = {'version': CACHE_VERSION, 'fingerprint': device_fingerprint(), 'saved': time.time()}
+        data.update(snapshot)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"[WARNING] Не удалось сохранить кэш устройств: {e}")
+
+    def resolve(self, index, name):
+        """Устройство из свежего опроса для выбранного в окне (None - за это время список изменился).
+        Не ждёт опроса: окна включают старт только после него, поток GUI не блокируется"""
+        if not self.fresh:
+            raise RuntimeError("список устройств ещё не получен от PortAudio")
+        devices = self.snapshot['devices']
+        if index < len(devices) and devices[index]['name'] == name:
+            return devices[index]
+        return None
+
+
+def measure_import(module):
+    """Время импорта модуля приложения в чистом интерпретаторе и загружен ли при этом sounddevice"""
+    code = (f"import sys, time; started = time.perf_counter(); import {module}; "
+            f"print((time.perf_counter() - started) * 1000, 'sounddevice' in sys.modules, 'numpy' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed, sd_loaded, np_loaded = result.stdout.split()[-3:]
+    return float(elapsed), sd_loaded == 'True', np_loaded == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер запуска: импорт приложений и получение списка устройств")
+    parser.add_argument('--cache', default=DEFAULT_DEVICE_CACHE, help="файл кэша устройств")
+    parser.add_argument('--runs', type=int, default=MEASURE_RUNS, help="запусков на замер импорта")
+    args = parser.parse_args()
+
+    for module in APP_MODULES:
+        runs = [measure_import(module) for _ in range(args.runs)]
+        best = min(elapsed for elapsed, _, _ in runs)
+        _, sd_loaded, np_loaded = runs[-1]
+        print(f"Импорт {module}: {best:.0f} мс (лучший из {args.runs}), "
+              f"sounddevice {'загружен' if sd_loaded else 'отложен'}, numpy {'загружен' if np_loaded else 'отложен'}")
+
+    catalog = DeviceCatalog(args.cache)
+    started = time.perf_counter()
+    snapshot = catalog.cached()
+    cache_ms = (time.perf_counter() - started) * 1000
+    if snapshot is None:
+        print(f"Кэш {args.cache}: нет или устарел ({cache_ms:.1f} мс на проверку)")
+    else:
+        print(f"Кэш {args.cache}: {len(snapshot['devices'])} устройств за {cache_ms:.1f} мс")
+
+    started = time.perf_counter()
+    try:
+        load_sounddevice()
+    except (ImportError, OSError) as e:
+        print(f"[ERROR] sounddevice недоступен: {e}")
+        return 1
+    import_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    fresh = catalog.query()
+    query_ms = (time.perf_counter() - started) * 1000
+    print(f"PortAudio: импорт и инициализация {import_ms:.0f} мс, опрос {len(fresh['devices'])} устройств "
+          f"{query_ms:.1f} мс")
+    if fresh != snapshot:
+        catalog.save(fresh)
+        print(f"Кэш {args.cache} обновлён")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+import math
+import time
+import threading
+
+import numpy as np
+
+from StreamAudio_Protocol import PACKET_FORMAT, HEADER_SIZE, DEFAULT_MTU, datagram_count
+
+# Агрегирование отчётов приёмников и адаптация битрейта на сервере
+CLIENT_TIMEOUT = 5.0  # Клиент без отчётов дольше этого считается ушедшим
+WORST_PERCENTILE = 90  # Цели держим для худших 10% клиентов
+
+# Цели качества для адаптации
+LOSS_TARGET = 2.0  # % потерь за интервал отчёта
+JITTER_TARGET = 20.0  # мс
+ADAPT_INTERVAL = 2.0  # Период принятия решений
+UPGRADE_HOLD = 10.0  # Сколько секунд качество должно быть хорошим перед повышением
+# Опустошения понижают формат, только если их много и по времени, и относительно пакетов
+UNDERRUN_RATE_TARGET = 6.0  # В минуту
+UNDERRUN_SHARE_TARGET = 0.5  # % принятых пакетов
+# После смены формата клиенты переоткрывают вывод - опустошения этого времени не в счёт
+FORMAT_SETTLE = 2 * ADAPT_INTERVAL
+
+# Автовыбор профиля задержки на клиенте
+PROFILE_CHUNKS = (128, 256, 512, 1024)  # Чанки профилей сервера, от меньшей задержки к большей
+GLITCH_TARGET = 1.0  # Допустимо сбоев (потерянный пакет, опустошение, xrun) в минуту
+WARMUP_TIME = 5.0  # Секунд измерений до первой рекомендации
+JITTER_MARGIN = 3.0  # Джиттер по RFC 3550 - среднее отклонение; хвост прихода покрываем с запасом
+CALLBACK_HEADROOM = 0.5  # Доля бюджета блока, которую callback может занимать на p99
+LOSS_SMOOTHING = 0.3  # Вес нового интервала в сглаженной доле потерь
+MAX_EXTRA_BUFFER = 0.2  # Предел добавки к буферу за опустошения, с
+
+
+class ClientHealth:
+    """Последний отчёт клиента и потери за интервал между отчётами"""
+
+    def __init__(self, client_id, addr):
+        self.client_id = client_id
+        self.addr = addr
+        self.received = 0
+        self.lost = 0
+        self.underruns = 0
+        self.interval_loss = 0.0
+        self.interval_underruns = 0
+        self.underrun_rate = 0.0  # Опустошений в минуту за интервал
+        self.underrun_share = 0.0  # % от принятых за интервал пакетов
+        self.jitter_ms = 0.0
+        self.buffer_ms = 0
+        self.latency_ms = 0
+        self.advised_packet_us = 0
+        self.last_report = 0.0
+
+    def update(self, addr, received, lost, underruns, jitter_us, buffer_ms, latency_ms, advised_packet_us, now):
+        # Потери считаем по разнице счётчиков - накопленные за всю сессию не отражают текущее состояние
+        delta_received = (received - self.received) % (1 << 32)
+        delta_lost = (lost - self.lost) % (1 << 32)
+        total = delta_received + delta_lost
+        self.interval_loss = delta_lost / total * 100 if total > 0 else 0.0
+        self.interval_underruns = (underruns - self.underruns) % (1 << 32) if self.last_report else 0
+        elapsed = now - self.last_report
+        self.underrun_rate = self.interval_underruns * 60 / elapsed if self.last_report and elapsed > 0 else 0.0
+        self.underrun_share = self.interval_underruns / delta_received * 100 if delta_received else 0.0
+        self.addr = addr
+        self.received = received
+        self.lost = lost
+        self.underruns = underruns
+        self.jitter_ms = jitter_us / 1000.0
+        self.buffer_ms = buffer_ms
+        self.latency_ms = latency_ms
+        self.advised_packet_us = advised_packet_us
+        self.last_report = now
+
+
+class ClientHealthTable:
+    """Таблица клиентов по отчётам приёмников (заполняется из потока приёма отчётов)"""
+
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def update(self, addr, report, now=None):
+        now = now or time.time()
+        client_id = report[0]
+        with self.lock:
+            client = self.clients.get(client_id)
+            if client is None:
+                client = self.clients[client_id] = ClientHealth(client_id, addr)
+            client.update(addr, *report[1:], now)
+
+    def active(self, now=None):
+        """Клиенты с недавними отчётами (ушедшие удаляются)"""
+        now = now or time.time()
+        with self.lock:
+            for client_id in [c for c, h in self.clients.items() if now - h.last_report > CLIENT_TIMEOUT]:
+                del self.clients[client_id]
+            return list(self.clients.values())
+
+    def summary(self, now=None):
+        """Сводка по худшим клиентам: (клиентов, потери %, джиттер мс, опустошений в минуту,
+        опустошений % пакетов, буфер мс)"""
+        clients = self.active(now)
+        if not clients:
+            return 0, 0.0, 0.0, 0.0, 0.0, 0.0
+        loss = np.percentile([c.interval_loss for c in clients], WORST_PERCENTILE)
+        jitter = np.percentile([c.jitter_ms for c in clients], WORST_PERCENTILE)
+        underrun_rate = np.percentile([c.underrun_rate for c in clients], WORST_PERCENTILE)
+        underrun_share = np.percentile([c.underrun_share for c in clients], WORST_PERCENTILE)
+        buffer_ms = float(np.percentile([c.buffer_ms for c in clients], 100 - WORST_PERCENTILE))
+        return len(clients), float(loss), float(jitter), float(underrun_rate), float(underrun_share), buffer_ms
+
+    def advised_packet_us(self, now=None):
+        """Длительность пакета, устраивающая всех клиентов с рекомендацией (наибольшая), мкс, или 0"""
+        return max((c.advised_packet_us for c in self.active(now)), default=0)
+
+
+class AdaptiveController:
+    """Лестница вариантов потока: понижаем при плохих отчётах, повышаем после устойчивого улучшения"""
+
+    def __init__(self, ladder, ceiling):
+        self.ladder = list(ladder)
+        self.ceiling = self.ladder.index(ceiling)  # Выше выбранного оператором не поднимаемся
+        self.level = self.ceiling
+        self.good_since = None
+        self.last_decision = 0.0
+        self.settle_until = 0.0
+        self.last_reason = ""
+
+    @property
+    def variant(self):
+        return self.ladder[self.level]
+
+    def evaluate(self, summary, now=None):
+        """Решение по сводке клиентов. Возвращает новый вариант или None"""
+        now = now or time.time()
+        if now - self.last_decision < ADAPT_INTERVAL:
+            return None
+        self.last_decision = now
+        clients, loss, jitter, underrun_rate, underrun_share, buffer_ms = summary
+        if clients == 0 or now < self.settle_until:
+            # Интервал сразу после смены формата - переоткрытие вывода у клиентов, а не сеть
+            self.good_since = None
+            return None
+
+        underruns = underrun_rate > UNDERRUN_RATE_TARGET and underrun_share > UNDERRUN_SHARE_TARGET
+        if loss > LOSS_TARGET or jitter > JITTER_TARGET or underruns:
+            self.good_since = None
+            if self.level < len(self.ladder) - 1:
+                self.level += 1
+                self.settle_until = now + FORMAT_SETTLE
+                self.last_reason = (f"потери {loss:.1f}%, джиттер {jitter:.0f}мс, "
+                                    f"опустошений {underrun_rate:.0f}/мин")
+                return self.variant
+            return None
+
+        if loss < LOSS_TARGET / 4 and jitter < JITTER_TARGET / 2:
+            if self.good_since is None:
+                self.good_since = now
+            elif now - self.good_since >= UPGRADE_HOLD and self.level > self.ceiling:
+                self.level -= 1
+                self.good_since = now
+                self.settle_until = now + FORMAT_SETTLE
+                self.last_reason = f"устойчиво: потери {loss:.1f}%, джиттер {jitter:.0f}мс"
+                return self.variant
+        else:
+            self.good_since = None
+        return None
+
+
+class ProfileAdvisor:
+    """Наименьший чанк и глубина буфера, при которых сбоев не больше GLITCH_TARGET в минуту.
+    Модель: теряются датаграммы, пакет больше MTU идёт несколькими фрагментами и теряется чаще;
+    потерянный пакет - один сбой, поэтому сбоев в минуту больше у чанков, которые шлют больше датаграмм
+    в секунду; буфер покрывает джиттер прихода; callback с фиксированной стоимостью
+    на меньшем блоке занимает большую долю бюджета. Опустошения добавляют запас буфера"""
+
+    def __init__(self, chunks=PROFILE_CHUNKS, target=GLITCH_TARGET):
+        self.chunks = tuple(sorted(chunks))
+        self.target = target
+        self.reset()
+
+    def reset(self, now=None):
+        self.started = now or time.time()
+        self.last_decision = self.started
+        self.counters = None  # (получено, потеряно, сбоев) на прошлом решении
+        self.loss = 0.0  # Сглаженная доля потерянных датаграмм
+        self.glitch_rate = 0.0  # Сбоев в минуту за последний интервал
+        self.extra_buffer = 0.0
+        self.clean_since = None
+        self.chunk = None  # Рекомендация (None - ещё разогрев)
+        self.buffer_time = 0.0  # Рекомендуемая глубина буфера, с
+        self.smaller_since = None
+        self.reason = ""
+
+    def evaluate(self, rate, chunk, received, lost, glitches, jitter, callback_time, frame_bytes=4,
+                 mtu=DEFAULT_MTU, now=None):
+        """Решение по накопленным счётчикам источников. glitches - опустошения и xrun,
+        callback_time - p99 времени callback (0 если блок устройства не зависит от чанка),
+        frame_bytes - байт на кадр потока, mtu - для числа фрагментов пакета.
+        True если рекомендация изменилась"""
+        now = now or time.time()
+        if now - self.last_decision < ADAPT_INTERVAL:
+            return False
+        interval = now - self.last_decision
+        self.last_decision = now
+        previous, self.counters = self.counters, (received, lost, glitches)
+        if previous is None or now - self.started < WARMUP_TIME:
+            return False
+
+        delta_received = received - previous[0]
+        delta_lost = lost - previous[1]
+        delta_glitches = glitches - previous[2]
+        if min(delta_received, delta_lost, delta_glitches) < 0:
+            return False  # Счётчики начались заново (новый источник или поток вывода)
+        total = delta_received + delta_lost
+        if total <= 0:
+            return False  # Поток стоит (пауза, DTX) - судить не по чему
+        # Потери пакетов текущего чанка -> потери одной датаграммы
+        datagrams = self.datagrams(chunk, frame_bytes, mtu)
+        datagram_loss = 1.0 - (1.0 - delta_lost / total) ** (1.0 / datagrams)
+        self.loss += (datagram_loss - self.loss) * LOSS_SMOOTHING
+        self.glitch_rate = (delta_lost + delta_glitches) * 60 / interval
+
+        # Опустошения при текущей глубине - буфер меньше реального разброса прихода
+        packet_time = chunk / rate
+        if delta_glitches * 60 / interval > self.target:
+            self.extra_buffer = min(self.extra_buffer + packet_time, MAX_EXTRA_BUFFER)
+            self.clean_since = None
+        elif self.clean_since is None:
+            self.clean_since = now
+        elif now - self.clean_since >= UPGRADE_HOLD and self.extra_buffer > 0:
+            self.extra_buffer = max(self.extra_buffer - packet_time, 0.0)
+            self.clean_since = now
+
+        # Ни один размер не укладывается в цель - остаёмся на текущем, а не уходим на наибольший
+        candidate = chunk
+        for size in self.chunks:
+            if (self.loss_glitches(size, rate, frame_bytes, mtu) <= self.target
+                    and callback_time <= CALLBACK_HEADROOM * size / rate):
+                candidate = size
+                break
+
+        # Вверх - сразу, вниз - только после устойчивого улучшения
+        changed = False
+        if self.chunk is None or candidate > self.chunk:
+            changed = candidate != self.chunk
+            self.chunk = candidate
+            self.smaller_since = None
+        elif candidate < self.chunk:
+            if self.smaller_since is None:
+                self.smaller_since = now
+            elif now - self.smaller_since >= UPGRADE_HOLD:
+                self.chunk = candidate
+                self.smaller_since = None
+                changed = True
+        else:
+            self.smaller_since = None
+
+        self.buffer_time = JITTER_MARGIN * jitter + self.extra_buffer
+        self.reason = (f"потери {self.loss * 100:.2f}% датаграмм -> "
+                       f"{self.loss_glitches(self.chunk, rate, frame_bytes, mtu):.1f} сбоя/мин, "
+                       f"джиттер {jitter * 1000:.1f}мс, сбоев {self.glitch_rate:.1f}/мин")
+        if callback_time:
+            self.reason += f", callback p99 {callback_time / (self.chunk / rate) * 100:.0f}% блока"
+        return changed
+
+    @staticmethod
+    def datagrams(size, frame_bytes, mtu):
+        """Датаграмм на пакет с чанком size"""
+        return datagram_count(HEADER_SIZE + size * frame_bytes, mtu)
+
+    def loss_glitches(self, size, rate, frame_bytes, mtu):
+        """Сбоев в минуту от потерь при чанке size: пакет теряется, если потерян любой его фрагмент"""
+        packet_loss = 1.0 - (1.0 - self.loss) ** self.datagrams(size, frame_bytes, mtu)
+        return packet_loss * rate / size * 60
+
+    def depth(self, packet_interval):
+        """Глубина буфера в пакетах текущего потока: пакет в игре плюс запас на джиттер"""
+        return 1 + math.ceil(self.buffer_time / packet_interval)
+
+    def report(self, rate, now=None):
+        """Строка для статистики: выбранный профиль и на чём он основан"""
+        now = now or time.time()
+        if self.chunk is None:
+            return f"Профиль: 🎯 измерение {max(WARMUP_TIME - (now - self.started), 0):.0f}с"
+        return (f"Профиль: 🎯 chunk {self.chunk} ({self.chunk / rate * 1000:.1f}мс), "
+                f"буфер {self.buffer_time * 1000:.0f}мс ({self.reason})")
+
+
+# Повторная отправка по NACK
+HISTORY_SIZE = 256  # Пакетов в истории (~1.5 с при chunk 256)
+RETRANSMIT_RATE = 100  # Повторов в секунду на клиента
+RETRANSMIT_BURST = 20
+RETRANSMIT_GLOBAL_RATE = 400  # Общий предел, чтобы больной клиент не раздул нагрузку
+RETRANSMIT_MAX_CLIENTS = 8  # При большем числе приёмников повторы отключаются
+# Быстрый вход: пачка последних пакетов новому клиенту, чтобы буфер заполнился сразу
+JOIN_MAX_PACKETS = 64
+JOIN_INTERVAL = 1.0  # Не чаще одной пачки клиенту за это время (повторный JOIN при потере запроса)
+
+
+class PacketHistory:
+    """Кольцо последних отправленных пакетов по номеру"""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self._slots = [None] * size
+        self.newest_seq = None
+        self.format_seq = None  # Последнее объявление формата - первым в пачке входа
+
+    def store(self, seq, packet):
+        self._slots[seq % self.size] = (seq, packet)
+        self.newest_seq = seq
+        if packet[3] == PACKET_FORMAT:
+            self.format_seq = seq
+
+    def holds(self, seq, packet):
+        """Хранится ли под номером seq именно этот пакет (тот же объект, а не копия)"""
+        entry = self._slots[seq % self.size]
+        return entry is not None and entry[0] == seq and entry[1] is packet
+
+    def get(self, seq):
+        entry = self._slots[seq % self.size]
+        if entry is not None and entry[0] == seq:
+            return entry[1]
+        return None
+
+    def recent(self, count):
+        """Последние count пакетов по порядку номеров, перед ними - объявление формата, если оно старше"""
+        newest = self.newest_seq
+        if newest is None:
+            return []
+        first = newest - min(count, self.size) + 1
+        seqs = range(first, newest + 1)
+        if self.format_seq is not None and self.format_seq < first:
+            seqs = [self.format_seq] + list(seqs)
+        packets = (self.get(seq) for seq in seqs)
+        return [packet for packet in packets if packet is not None]
+
+
+class TokenBucket:
+    """Ограничитель частоты повторов"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.time()
+
+    def allow(self, now=None):
+        now = now or time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def refund(self):
+        """Вернуть жетон, взятый под повтор, который не отправлен"""
+        self.tokens = min(self.burst, self.tokens + 1.0)
+
+
+class Retransmitter:
+    """Обработка NACK: история пакетов + ограничение частоты по клиентам и в сумме"""
+
+    def __init__(self):
+        self.history = PacketHistory()
+        self.global_bucket = TokenBucket(RETRANSMIT_GLOBAL_RATE, RETRANSMIT_GLOBAL_RATE // 5)
+        self.client_buckets = {}
+        self.requested = 0
+        self.retransmitted = 0
+        self.rate_limited = 0
+        self.expired = 0  # Пакет уже вытеснен из истории
+        self.join_times = {}  # id клиента -> время последней пачки входа
+        self.joins = 0
+        self.join_packets = 0
+
+    def handle(self, client_id, seqs, active_clients, now=None):
+        """Пакеты для повторной отправки по запросу клиента"""
+        now = now or time.time()
+        self.requested += len(seqs)
+        if active_clients > RETRANSMIT_MAX_CLIENTS:
+            self.rate_limited += len(seqs)
+            return []
+        bucket = self.client_buckets.get(client_id)
+        if bucket is None:
+            bucket = self.client_buckets[client_id] = TokenBucket(RETRANSMIT_RATE, RETRANSMIT_BURST)
+        packets = []
+        for seq in seqs:
+            packet = self.history.get(seq)
+            if packet is None:
+                self.expired += 1
+            elif not bucket.allow(now):
+                self.rate_limited += 1
+            elif self.global_bucket.allow(now):
+                packets.append(packet)
+            else:
+                # Общий лимит исчерпан: жетон клиента возвращаем, иначе его бюджет уходит без повторов
+                bucket.refund()
+                self.rate_limited += 1
+        self.retransmitted += len(packets)
+        return packets
+
+    def join(self, client_id, count, now=None):
+        """Пачка быстрого входа: последние пакеты истории новому клиенту (частота ограничена по клиенту)"""
+        now = now or time.time()
+        if now - self.join_times.get(client_id, 0.0) < JOIN_INTERVAL:
+            return []
+        self.join_times = {c: t for c, t in self.join_times.items() if now - t < JOIN_INTERVAL}
+        self.join_times[client_id] = now
+        packets = self.history.recent(min(count, JOIN_MAX_PACKETS))
+        self.joins += 1
+        self.join_packets += len(packets)
+        return packets
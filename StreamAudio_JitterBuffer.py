@@ -0,0 +1,138 @@
+import threading
+
+from StreamAudio_Protocol import seq_delta, SEQ_MODULO
+
+# Буфер пакетов между потоком приёма и аудио callback, упорядоченный по номерам
+JITTER_CAPACITY = 64  # Слотов в кольце (номер пакета по модулю)
+JITTER_TARGET_DEPTH = 1  # Пакетов до начала воспроизведения
+JITTER_MAX_DEPTH = 2  # Больше - выбрасываем старые (как прежняя очередь maxsize=2)
+
+
+class JitterBuffer:
+    """Кольцо слотов по номеру пакета: переупорядочивание, ожидание повторов и ограничение глубины"""
+
+    def __init__(self, target_depth=JITTER_TARGET_DEPTH, max_depth=JITTER_MAX_DEPTH, capacity=JITTER_CAPACITY):
+        self.target_depth = target_depth
+        self.max_depth = max_depth
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Очистить буфер (остановка или смена формата)"""
+        with self._lock:
+            self._slots = [None] * self.capacity  # (seq, payload); payload None - служебный пакет
+            self.next_seq = None
+            self.newest_seq = None
+            self.count = 0  # Аудио пакетов в буфере
+            self.started = False
+            self.playing = False  # Отдан хотя бы один пакет - раньше next_seq буфер уже не расширяется
+            self.gap_since = None
+            self.waiting = False  # Последний get() ждал повтор пропущенного пакета
+            self.late = 0
+            self.dropped = 0
+            self.concealed = 0
+
+    def qsize(self):
+        return self.count
+
+    def put(self, seq, payload, now):
+        """Положить пакет (payload=None - служебный, только занимает номер). True если принят"""
+        with self._lock:
+            if self.next_seq is None:
+                self.next_seq = seq
+            ahead = seq_delta(seq, self.next_seq)
+            if ahead < 0:
+                # До начала воспроизведения более ранние номера (пачка быстрого входа) расширяют буфер назад
+                span = seq_delta(self.newest_seq, seq) if self.newest_seq is not None else 0
+                if self.playing or span >= self.capacity:
+                    self.late += 1
+                    return False
+                self.next_seq = seq
+                ahead = 0
+            if ahead >= self.capacity:
+                # Разрыв больше кольца (перезапуск сервера, долгая пауза) - начинаем заново
+                self._slots = [None] * self.capacity
+                self.count = 0
+                self.next_seq = seq
+                self.newest_seq = None
+                self.gap_since = None
+
+            index = seq % self.capacity
+            entry = self._slots[index]
+            if entry is not None and entry[0] == seq:
+                return False  # Дубликат
+            self._slots[index] = (seq, payload)
+            if payload is not None:
+                self.count += 1
+            if self.newest_seq is None or seq_delta(seq, self.newest_seq) > 0:
+                self.newest_seq = seq
+
+            # Не копим задержку: выбрасываем старейшие пакеты сверх максимальной глубины
+            while self.count > self.max_depth:
+                dropped = self._advance()
+                if dropped is not None:
+                    self.count -= 1
+                    self.dropped += 1
+            return True
+
+    def get(self, now, max_wait=0.0):
+        """Следующий пакет для воспроизведения или None (нет данных / ждём повтор)"""
+        with self._lock:
+            self.waiting = False
+            while self.next_seq is not None:
+                if not self.started:
+                    if self.count < self.target_depth:
+                        return None
+                    self.started = True
+
+                entry = self._slots[self.next_seq % self.capacity]
+                if entry is not None and entry[0] == self.next_seq:
+                    payload = self._advance()
+                    if payload is None:
+                        continue  # Служебный пакет - номер занят, звука нет
+                    self.count -= 1
+                    self.playing = True
+                    return payload
+
+                # Пакета нет: если дальше ничего не пришло - просто опустошение буфера,
+                # перед продолжением снова копим target_depth пакетов
+                if self.newest_seq is None or seq_delta(self.newest_seq, self.next_seq) <= 0:
+                    self.started = False
+                    return None
+                # Дыра при наличии следующих пакетов: ждём повтор в пределах бюджета
+                if self.gap_since is None:
+                    self.gap_since = now
+                if now - self.gap_since < max_wait:
+                    self.waiting = True
+                    return None
+                self._advance()
+                self.concealed += 1
+            return None
+
+    def peek_seq(self):
+        """Номер аудио пакета, который отдаст следующий get() (None - его ещё нет)"""
+        with self._lock:
+            seq = self.next_seq
+            if seq is None:
+                return None
+            for _ in range(self.capacity):
+                entry = self._slots[seq % self.capacity]
+                if entry is None or entry[0] != seq:
+                    return None
+                if entry[1] is not None:
+                    return seq
+                seq = (seq + 1) % SEQ_MODULO  # Служебные пакеты get() пропустит
+            return None
+
+    def _advance(self):
+        """Снять слот next_seq и перейти к следующему номеру. Возвращает payload (или None)"""
+        index = self.next_seq % self.capacity
+        entry = self._slots[index]
+        payload = None
+        if entry is not None and entry[0] == self.next_seq:
+            payload = entry[1]
+            self._slots[index] = None
+        self.next_seq = (self.next_seq + 1) % SEQ_MODULO
+        self.gap_since = None
+        return payload
@@ -0,0 +1,304 @@
+import argparse
+import math
+import os
+import socket
+import sys
+import threading
+import time
+import wave
+from collections import deque
+import numpy as np
+
+from StreamAudio_Protocol import PACKET_AUDIO, PACKET_SYNC, pack_header, parse_header, build_sync_reply
+
+# Замер настоящей задержки от захвата до воспроизведения: сервер вставляет чирп в моменты,
+# кратные MARKER_INTERVAL по своим часам; клиент ищет его в воспроизводимом звуке корреляцией (FFT)
+# и переводит время ЦАП в часы сервера по обмену SYNC. Задержка = это время минус момент сетки
+MARKER_INTERVAL = 2.0  # Задержка должна быть меньше - иначе маркер отнесётся к следующему моменту
+MARKER_SECONDS = 0.03
+MARKER_LOW = 500.0  # Гц; верх ниже Найквиста самого низкого варианта потока (22.05 кГц)
+MARKER_HIGH = 8000.0
+MARKER_LEVEL = 0.5  # Доля полной шкалы
+DETECT_THRESHOLD = 0.6  # Нормированная корреляция, выше которой маркер считается найденным
+DETECT_FLOOR = 0.05  # Окна тише этой доли уровня маркера не нормируются (тишина дала бы ложные пики)
+DETECT_RING_SECONDS = 4.0  # Кольцо воспроизведённого звука для поиска
+DETECT_BLOCKS = 1024  # Последних блоков с временем ЦАП (для перевода номера отсчёта во время)
+LATENCY_HISTORY = 32  # Замеров в статистике
+
+# Петля на одной машине: отправитель из WAV (или тишины) и стойка с null выходом в этом же процессе
+LOOPBACK_GROUP = '239.255.77.200'
+LOOPBACK_PORT = 5078
+LOOPBACK_SECONDS = 20.0
+LOOPBACK_CHUNK = 256
+LOOPBACK_RATE = 44100
+CHANNELS = 2
+
+
+def make_marker(rate):
+    """Линейный чирп MARKER_LOW..MARKER_HIGH с окном Ханна (float32, единичная амплитуда)"""
+    length = int(rate * MARKER_SECONDS)
+    t = np.arange(length) / rate
+    sweep = (MARKER_HIGH - MARKER_LOW) / MARKER_SECONDS
+    phase = 2 * np.pi * (MARKER_LOW * t + sweep / 2 * t * t)
+    return (np.sin(phase) * np.hanning(length)).astype(np.float32)
+
+
+class MarkerInjector:
+    """Вставка маркера в захваченные блоки сервера (на месте звука, во все каналы)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.marker = (make_marker(rate) * MARKER_LEVEL * 32767).astype(np.int16)
+        self.pos = None  # Сколько отсчётов маркера уже вставлено (None - маркер не идёт)
+        self.last_grid = 0.0
+        self.injected = 0
+
+    def apply(self, block, start_time):
+        """block - кадры x каналы int16, start_time - время захвата первого кадра по часам сервера"""
+        frames = len(block)
+        offset = 0
+        if self.pos is None:
+            grid = math.ceil(start_time / MARKER_INTERVAL) * MARKER_INTERVAL
+            if grid >= start_time + frames / self.rate or grid == self.last_grid:
+                return
+            self.last_grid = grid
+            self.pos = 0
+            self.injected += 1
+            offset = min(int(round((grid - start_time) * self.rate)), frames - 1)
+        count = min(frames - offset, len(self.marker) - self.pos)
+        block[offset:offset + count] = self.marker[self.pos:self.pos + count, None]
+        self.pos += count
+        if self.pos >= len(self.marker):
+            self.pos = None
+
+
+class MarkerDetector:
+    """Поиск маркера в воспроизводимом звуке. push() из аудио callback только копирует блок в кольцо;
+    analyze() из потока статистики ищет маркер корреляцией через FFT по новым отсчётам"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        template = make_marker(rate)
+        self.template = template
+        self.template_norm = float(np.sqrt(np.dot(template, template)))
+        self.window_floor = DETECT_FLOOR * MARKER_LEVEL * 32767 * self.template_norm
+        self.ring = np.zeros(int(rate * DETECT_RING_SECONDS), dtype=np.int16)
+        self.written = 0  # Всего отсчётов записано в кольцо
+        self.analyzed = 0  # До какого отсчёта кольцо уже просмотрено
+        self.blocks = deque(maxlen=DETECT_BLOCKS)  # (номер первого отсчёта, время ЦАП)
+        self.last_found = -len(self.ring)
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+        self.waiting_clock = False
+
+    def push(self, block, dac_time):
+        """Блок, который прозвучит в dac_time (первый канал), из аудио callback"""
+        frames = len(block)
+        ring = self.ring
+        pos = self.written % len(ring)
+        count = min(frames, len(ring) - pos)
+        ring[pos:pos + count] = block[:count, 0]
+        if count < frames:
+            ring[:frames - count] = block[count:, 0]
+        self.blocks.append((self.written, dac_time))
+        self.written += frames
+
+    def analyze(self, offset):
+        """Найти маркеры в новых отсчётах. offset - время сервера минус время клиента (None - часы не сведены).
+        Возвращает список новых замеров задержки, с"""
+        written = self.written
+        length = len(self.template)
+        ring_size = len(self.ring)
+        # Маркер может начаться в конце прошлого окна - захватываем длину маркера назад
+        start = max(self.analyzed - length + 1, written - ring_size + 1, 0)
+        if written - start < length:
+            return []
+        self.analyzed = written
+        index = np.arange(start, written) % ring_size
+        segment = self.ring[index].astype(np.float32)
+        size = 1 << (len(segment) + length - 1).bit_length()
+        correlation = np.fft.irfft(np.fft.rfft(segment, size) * np.conj(np.fft.rfft(self.template, size)),
+                                   size)[:len(segment) - length + 1]
+        energy = np.concatenate(([0.0], np.cumsum(segment.astype(np.float64) ** 2)))
+        window = np.maximum(np.sqrt(np.maximum(energy[length:] - energy[:-length], 0.0)), self.window_floor)
+        score = correlation / (window * self.template_norm)
+
+        found = []
+        candidates = np.flatnonzero(score > DETECT_THRESHOLD)
+        min_spacing = int(MARKER_INTERVAL * self.rate / 2)
+        for lag in candidates:
+            sample = start + int(lag)
+            if sample - self.last_found < min_spacing:
+                continue
+            # Лучший пик в окрестности длины маркера
+            end = min(lag + length, len(score))
+            lag = lag + int(np.argmax(score[lag:end]))
+            sample = start + int(lag)
+            self.last_found = sample
+            dac_time = self.sample_time(sample)
+            if dac_time is None:
+                continue
+            if offset is None:
+                self.waiting_clock = True
+                continue
+            self.waiting_clock = False
+            server_time = dac_time + offset
+            latency = server_time - math.floor(server_time / MARKER_INTERVAL) * MARKER_INTERVAL
+            self.latencies.append(latency)
+            found.append(latency)
+        return found
+
+    def sample_time(self, sample):
+        """Время ЦАП отсчёта с этим номером (по блоку, в котором он прозвучал)"""
+        for first, dac_time in reversed(self.blocks):
+            if first <= sample:
+                return dac_time + (sample - first) / self.rate
+        return None
+
+    def report(self):
+        """Строка для статистики"""
+        if not self.latencies:
+            return "Замер: 📏 ожидание часов сервера" if self.waiting_clock else "Замер: 📏 ищем маркер"
+        values = np.array(self.latencies) * 1000
+        return (f"Замер: 📏 {values[-1]:.1f}мс (мин {values.min():.1f}, медиана {np.median(values):.1f}, "
+                f"макс {values.max():.1f}, замеров {len(values)})")
+
+
+class LoopbackSender:
+    """Отправитель петли: WAV файл (или тишина) в реальном темпе, маркеры по своим часам, ответы на SYNC"""
+
+    def __init__(self, group, port, chunk, rate, path=None):
+        self.address = (group, port)
+        self.chunk = chunk
+        self.rate = rate
+        self.audio = self.load(path, rate) if path else np.zeros((rate, CHANNELS), dtype=np.int16)
+        self.injector = MarkerInjector(rate)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.sock.bind(('', 0))
+        self.sock.settimeout(0.1)
+        self.running = False
+        self.threads = []
+
+    @staticmethod
+    def load(path, rate):
+        """16-битный WAV в кадры x CHANNELS (моно дублируется)"""
+        with wave.open(path, 'rb') as f:
+            if f.getsampwidth() != 2 or f.getframerate() != rate:
+                raise ValueError(f"{path}: нужен 16-битный WAV {rate} Гц")
+            channels = f.getnchannels()
+            audio = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).reshape(-1, channels)
+        if channels == 1:
+            audio = np.repeat(audio, CHANNELS, axis=1)
+        return np.ascontiguousarray(audio[:, :CHANNELS])
+
+    def start(self):
+        self.running = True
+        for target in (self.send_loop, self.sync_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.sock.close()
+
+    def send_loop(self):
+        interval = self.chunk / self.rate
+        block = np.zeros((self.chunk, CHANNELS), dtype=np.int16)
+        pos = 0
+        seq = 0
+        next_time = time.time()
+        while self.running:
+            filled = 0
+            while filled < self.chunk:
+                count = min(self.chunk - filled, len(self.audio) - pos)
+                block[filled:filled + count] = self.audio[pos:pos + count]
+                filled += count
+                pos = (pos + count) % len(self.audio)
+            # Блок "захвачен" к моменту next_time: первый кадр - на интервал раньше
+            self.injector.apply(block, next_time - interval)
+            self.sock.sendto(pack_header(PACKET_AUDIO, seq, int(next_time * 1000000)) + block.tobytes(), self.address)
+            seq += 1
+            next_time += interval
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def sync_loop(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except (socket.timeout, OSError):
+                continue
+            received_us = int(time.time() * 1000000)
+            header = parse_header(data)
+            if header is not None and header[0] == PACKET_SYNC:
+                self.sock.sendto(build_sync_reply(data, received_us, int(time.time() * 1000000)), addr)
+
+
+def run_loopback(seconds, chunk, device, path=None):
+    """Петля в одном процессе: отправитель -> multicast -> стойка с одним выходом -> детектор"""
+    from StreamAudio_Rack import Rack, find_output_device
+
+    config = {
+        'port': LOOPBACK_PORT,
+        'nack': False,
+        'workers': 1,
+        'sinks': [{'name': 'петля', 'device': device, 'sources': LOOPBACK_GROUP,
+                   'rate': LOOPBACK_RATE, 'chunk': chunk}],
+    }
+    find_output_device(device)  # Ошибка до запуска потоков
+    rack = Rack(config)
+    sink = rack.sinks[0]
+    sink.detector = MarkerDetector(LOOPBACK_RATE)
+    sender = LoopbackSender(LOOPBACK_GROUP, LOOPBACK_PORT, chunk, LOOPBACK_RATE, path)
+    print(f"Петля: chunk={chunk}, {LOOPBACK_RATE}Hz, выход {device}, {seconds:.0f} с, маркер каждые "
+          f"{MARKER_INTERVAL:.0f} с")
+    rack.start()
+    sender.start()
+    try:
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            time.sleep(0.5)
+            sources = sink.sources
+            for source in sources:
+                source.clock_wanted = True
+            offset = sources[0].clock.offset if sources and sources[0].clock.ready() else None
+            for latency in sink.detector.analyze(offset):
+                print(f"[INFO] Маркер: {latency * 1000:.2f} мс")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sender.stop()
+        rack.stop()
+    print(sink.detector.report())
+    print(f"Маркеров вставлено {sender.injector.injected}, найдено {len(sink.detector.latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер задержки от захвата до воспроизведения по маркеру")
+    parser.add_argument('--loopback', action='store_true', help="Петля на этой машине (без сервера и клиента)")
+    parser.add_argument('--seconds', type=float, default=LOOPBACK_SECONDS, help="Длительность замера")
+    parser.add_argument('--chunk', type=int, default=LOOPBACK_CHUNK, help="Кадров в пакете и блоке выхода")
+    parser.add_argument('--device', default='null', help="Выход петли: 'null' или часть имени устройства")
+    parser.add_argument('--file', help="16-битный WAV 44100 Гц для отправителя (по умолчанию тишина)")
+    args = parser.parse_args()
+
+    if not args.loopback:
+        parser.print_help()
+        return
+    if args.file and not os.path.exists(args.file):
+        print(f"[ERROR] Файл не найден: {args.file}")
+        sys.exit(1)
+    try:
+        device = int(args.device)
+    except ValueError:
+        device = args.device
+    run_loopback(args.seconds, args.chunk, device, args.file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+
+from StreamAudio_Protocol import HEADER_SIZE
+
+# Пул пакетов сервера: отсчёты копируются один раз - из буфера PortAudio в пакет,
+# заголовок пишется на место перед ними, в сокет уходит тот же буфер
+POOL_MARGIN = 8  # Слотов сверх истории повторов (очередь отправки, пакет в работе, выброшенные из очереди)
+
+
+class PacketSlot:
+    """Предвыделенный пакет: заголовок и отсчёты в одном непрерывном буфере"""
+
+    __slots__ = ('buffer', 'packet', 'samples', 'seq')
+
+    def __init__(self, frames, channels):
+        self.seq = None  # Номер, с которым пакет слота ушёл в сеть и в историю повторов
+        self.buffer = bytearray(HEADER_SIZE + frames * channels * 2)
+        self.packet = memoryview(self.buffer)
+        # Отсчёты - numpy вид на область данных после заголовка (без копии)
+        self.samples = np.frombuffer(self.buffer, dtype=np.int16, offset=HEADER_SIZE).reshape(frames, channels)
+
+
+class PacketPool:
+    """Кольцо слотов. Слот, на пакет которого ещё ссылается история повторов (in_use), пропускается:
+    выброшенные из очереди чанки не попадают в историю, и простой круговой обход отдал бы слот,
+    который NACK или пачка входа ещё отправят. Слотов больше истории - свободный всегда найдётся"""
+
+    def __init__(self, count, frames, channels, in_use=None):
+        self.frames = frames
+        self.channels = channels
+        self.in_use = in_use
+        self._slots = [PacketSlot(frames, channels) for _ in range(count)]
+        self._next = 0
+
+    def acquire(self):
+        """Следующий свободный слот (вызывается только из аудио callback)"""
+        slots = self._slots
+        for _ in range(len(slots)):
+            slot = slots[self._next]
+            self._next = (self._next + 1) % len(slots)
+            if slot.seq is None or self.in_use is None or not self.in_use(slot):
+                return slot
+        return slot
@@ -0,0 +1,80 @@
+# Профиль аудио callback: время выполнения относительно бюджета блока (frames / rate) и флаги xrun PortAudio
+PROFILE_BINS = 200  # Гистограмма загрузки по 1% бюджета; последняя корзина - всё, что дольше двух бюджетов
+PROFILE_PERCENTILE = 99
+OVERRUN_WARNING = 0.5  # Доля бюджета, выше которой p99 считается опасной (мало запаса на планировщик)
+
+# Флаги sounddevice.CallbackFlags, которые означают потерю звука
+XRUN_FLAGS = {
+    'input_overflow': 'переполнение входа',
+    'input_underflow': 'опустошение входа',
+    'output_underflow': 'опустошение выхода',
+    'output_overflow': 'переполнение выхода',
+}
+
+
+class CallbackProfiler:
+    """Всегда включённый профиль callback: гистограмма загрузки, превышения бюджета и счётчики xrun.
+    record() вызывается из аудио потока и не выделяет память; статистика читается из GUI потока"""
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.histogram = [0] * (PROFILE_BINS + 1)
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.max_utilization = 0.0
+        self.budget = 0.0  # Бюджет последнего блока, с
+        self.over_budget = 0
+        self.xruns = dict.fromkeys(XRUN_FLAGS, 0)
+
+    def record(self, duration, frames, status=None):
+        """Один вызов callback: длительность (с), кадров в блоке и status из PortAudio"""
+        if frames:
+            budget = frames / self.sample_rate
+            self.budget = budget
+            utilization = duration / budget
+            self.histogram[min(int(utilization * 100), PROFILE_BINS)] += 1
+            if utilization > self.max_utilization:
+                self.max_utilization = utilization
+            if utilization >= 1.0:
+                self.over_budget += 1
+        self.count += 1
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+        if status:
+            for flag in XRUN_FLAGS:
+                if getattr(status, flag, False):
+                    self.xruns[flag] += 1
+
+    def percentile(self, percent):
+        """Загрузка (доля бюджета), не превышенная в percent% вызовов - по верхней границе корзины"""
+        samples = sum(self.histogram)
+        if not samples:
+            return 0.0
+        threshold = samples * percent / 100
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= threshold:
+                return (index + 1) / 100
+        return (PROFILE_BINS + 1) / 100
+
+    def xrun_count(self):
+        return sum(self.xruns.values())
+
+    def report(self):
+        """Строка для статистики: среднее время, p99 и максимум загрузки, превышения и xrun"""
+        if not self.count:
+            return ""
+        p99 = self.percentile(PROFILE_PERCENTILE)
+        marker = "🟢" if p99 < OVERRUN_WARNING and not self.over_budget else "🔴"
+        text = (f"callback {marker} {self.total_time / self.count * 1000000:.0f}мкс, "
+                f"p{PROFILE_PERCENTILE} {p99 * 100:.0f}% / макс {self.max_utilization * 100:.0f}% "
+                f"от {self.budget * 1000:.1f}мс")
+        if self.over_budget:
+            text += f", дольше бюджета {self.over_budget}"
+        xruns = ", ".join(f"{XRUN_FLAGS[flag]} {count}" for flag, count in self.xruns.items() if count)
+        if xruns:
+            text += f", xrun: {xruns}"
+        return text
@@ -0,0 +1,270 @@
+import struct
+
+# Общий формат пакетов сервера и клиента.
+# Пакет без MAGIC в начале считается "сырым" PCM от старого сервера.
+MAGIC = b'SA'
+VERSION = 1
+
+# Заголовок: magic, версия, тип, id потока, флаги, номер пакета, время захвата (мкс)
+HEADER = struct.Struct('!2sBBBBIQ')
+HEADER_SIZE = HEADER.size
+
+# Типы пакетов
+PACKET_AUDIO = 0
+PACKET_SID = 1  # Описатель тишины (DTX): keepalive + уровень комфортного шума
+PACKET_FORMAT = 2  # Объявление формата потока: клиент настраивается по нему
+PACKET_REPORT = 3  # Отчёт приёмника: клиент -> сервер (unicast на адрес отправителя)
+PACKET_NACK = 4  # Запрос повтора потерянных пакетов: клиент -> сервер
+PACKET_FRAGMENT = 5  # Часть пакета больше MTU (номер и время - как у исходного пакета)
+PACKET_SYNC = 6  # Синхронизация часов: запрос клиента и ответ сервера (unicast)
+PACKET_JOIN = 7  # Быстрый вход: клиент просит последние пакеты потока, сервер шлёт их пачкой (unicast)
+
+# Флаги заголовка
+FLAG_RETRANSMIT = 0x01  # Повторная отправка из истории сервера (unicast)
+FLAG_JOIN = 0x02  # Пакет из пачки быстрого входа (вместе с FLAG_RETRANSMIT)
+FLAGS_OFFSET = 5  # Смещение байта флагов в заголовке
+
+# Полезная нагрузка SID: RMS уровень шума (int16 шкала), длительность чанка в кадрах
+SID_PAYLOAD = struct.Struct('!HH')
+# Полезная нагрузка FORMAT: частота, каналы, кодирование, кадров в пакете
+FORMAT_PAYLOAD = struct.Struct('!IBBH')
+# Полезная нагрузка REPORT: id клиента, получено, потеряно, опустошений буфера,
+# джиттер (мкс), глубина буфера (мс), задержка (мс)
+REPORT_PAYLOAD = struct.Struct('!IIIIIHH')
+# Необязательный хвост REPORT: рекомендуемая клиентом длительность пакета, мкс (0 - без рекомендации).
+# Длительность, а не чанк: кадры потока после понижения частоты не равны кадрам захвата сервера.
+# Старые серверы читают только REPORT_PAYLOAD и хвост не замечают
+REPORT_ADVICE = struct.Struct('!H')
+# Полезная нагрузка NACK: id клиента, количество номеров, затем номера (uint32)
+NACK_PAYLOAD = struct.Struct('!IB')
+MAX_NACK_SEQS = 32
+# Заголовок фрагмента: исходный тип, номер фрагмента, всего фрагментов, смещение, полный размер данных
+FRAGMENT_PAYLOAD = struct.Struct('!BBBHH')
+# Полезная нагрузка SYNC: id клиента, отправка запроса клиентом, приём и ответ сервера (мкс, у каждого свои часы)
+SYNC_PAYLOAD = struct.Struct('!IQQQ')
+# Полезная нагрузка JOIN: id клиента, сколько последних пакетов нужно для заполнения буфера
+JOIN_PAYLOAD = struct.Struct('!IH')
+
+# Фрагментация: пакет больше MTU режется на части, чтобы потеря IP фрагмента не губила весь чанк
+DEFAULT_MTU = 1472  # Ethernet 1500 минус заголовки IP и UDP
+MIN_MTU = 256
+FRAGMENT_ALIGN = 4  # Границы фрагментов по целым кадрам (стерео int16)
+REASSEMBLY_CAPACITY = 8  # Пакетов в сборке одновременно
+REASSEMBLY_TIMEOUT = 0.05  # Секунд ожидания недостающих фрагментов
+
+SEQ_MODULO = 1 << 32
+
+
+def pack_header(packet_type, seq, timestamp_us, stream_id=0, flags=0):
+    """Собрать заголовок пакета"""
+    return HEADER.pack(MAGIC, VERSION, packet_type, stream_id, flags,
+                       seq % SEQ_MODULO, timestamp_us)
+
+
+def pack_header_into(buffer, packet_type, seq, timestamp_us, stream_id=0, flags=0):
+    """Записать заголовок в начало готового буфера пакета (без копирования данных)"""
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, packet_type, stream_id, flags,
+                     seq % SEQ_MODULO, timestamp_us)
+
+
+def parse_header(data):
+    """Разобрать заголовок. Возвращает (type, stream_id, flags, seq, timestamp_us) или None для сырого PCM"""
+    if len(data) < HEADER_SIZE or data[:2] != MAGIC:
+        return None
+    magic, version, packet_type, stream_id, flags, seq, timestamp_us = HEADER.unpack_from(data)
+    if version != VERSION:
+        return None
+    return packet_type, stream_id, flags, seq, timestamp_us
+
+
+def build_sid(seq, timestamp_us, noise_level, chunk_frames, stream_id=0):
+    """Пакет-описатель тишины"""
+    return (pack_header(PACKET_SID, seq, timestamp_us, stream_id) +
+            SID_PAYLOAD.pack(min(int(noise_level), 0xFFFF), chunk_frames))
+
+
+def parse_sid(data):
+    """Уровень шума и размер чанка из SID пакета"""
+    return SID_PAYLOAD.unpack_from(data, HEADER_SIZE)
+
+
+def build_format(seq, timestamp_us, rate, channels, encoding, chunk_frames, stream_id=0):
+    """Пакет объявления формата потока"""
+    return (pack_header(PACKET_FORMAT, seq, timestamp_us, stream_id) +
+            FORMAT_PAYLOAD.pack(rate, channels, encoding, chunk_frames))
+
+
+def parse_format(data):
+    """(rate, channels, encoding, chunk) из пакета объявления формата"""
+    return FORMAT_PAYLOAD.unpack_from(data, HEADER_SIZE)
+
+
+def build_report(seq, timestamp_us, client_id, received, lost, underruns, jitter_us, buffer_ms, latency_ms,
+                 stream_id=0, advised_packet_us=0):
+    """Компактный отчёт приёмника (id потока - какой из потоков сервера принимается)"""
+    return (pack_header(PACKET_REPORT, seq, timestamp_us, stream_id) +
+            REPORT_PAYLOAD.pack(client_id, received % SEQ_MODULO, lost % SEQ_MODULO, underruns % SEQ_MODULO,
+                                min(int(jitter_us), 0xFFFFFFFF), min(int(buffer_ms), 0xFFFF),
+                                min(int(latency_ms), 0xFFFF)) +
+            REPORT_ADVICE.pack(min(int(advised_packet_us), 0xFFFF)))
+
+
+def parse_report(data):
+    """(client_id, received, lost, underruns, jitter_us, buffer_ms, latency_ms, advised_packet_us) из отчёта приёмника.
+    От старых клиентов хвоста нет - рекомендация 0"""
+    report = REPORT_PAYLOAD.unpack_from(data, HEADER_SIZE)
+    offset = HEADER_SIZE + REPORT_PAYLOAD.size
+    if len(data) < offset + REPORT_ADVICE.size:
+        return report + (0,)
+    return report + REPORT_ADVICE.unpack_from(data, offset)
+
+
+def build_nack(timestamp_us, client_id, seqs, stream_id=0):
+    """Запрос повтора (не больше MAX_NACK_SEQS номеров потока stream_id)"""
+    seqs = list(seqs)[:MAX_NACK_SEQS]
+    return (pack_header(PACKET_NACK, 0, timestamp_us, stream_id) + NACK_PAYLOAD.pack(client_id, len(seqs)) +
+            struct.pack(f'!{len(seqs)}I', *(s % SEQ_MODULO for s in seqs)))
+
+
+def parse_nack(data):
+    """(client_id, [номера]) из запроса повтора"""
+    client_id, count = NACK_PAYLOAD.unpack_from(data, HEADER_SIZE)
+    count = min(count, (len(data) - HEADER_SIZE - NACK_PAYLOAD.size) // 4)
+    return client_id, struct.unpack_from(f'!{count}I', data, HEADER_SIZE + NACK_PAYLOAD.size)
+
+
+def build_sync_request(timestamp_us, client_id, stream_id=0):
+    """Запрос времени сервера (поля сервера пустые)"""
+    return pack_header(PACKET_SYNC, 0, timestamp_us, stream_id) + SYNC_PAYLOAD.pack(client_id, timestamp_us, 0, 0)
+
+
+def build_sync_reply(request, receive_us, send_us):
+    """Ответ на запрос времени: тот же id потока и время клиента, плюс время приёма и ответа сервера"""
+    _, stream_id, _, _, _ = parse_header(request)
+    client_id, request_us, _, _ = SYNC_PAYLOAD.unpack_from(request, HEADER_SIZE)
+    return pack_header(PACKET_SYNC, 0, send_us, stream_id) + SYNC_PAYLOAD.pack(client_id, request_us,
+                                                                            receive_us, send_us)
+
+
+def parse_sync(data):
+    """(client_id, request_us, receive_us, send_us) из пакета синхронизации"""
+    return SYNC_PAYLOAD.unpack_from(data, HEADER_SIZE)
+
+
+def build_join(timestamp_us, client_id, packets, stream_id=0):
+    """Запрос быстрого входа: последние packets пакетов потока stream_id"""
+    return pack_header(PACKET_JOIN, 0, timestamp_us, stream_id) + JOIN_PAYLOAD.pack(client_id, min(packets, 0xFFFF))
+
+
+def parse_join(data):
+    """(client_id, packets) из запроса быстрого входа"""
+    return JOIN_PAYLOAD.unpack_from(data, HEADER_SIZE)
+
+
+def mark_retransmit(packet, flags=FLAG_RETRANSMIT):
+    """Копия пакета с флагом повторной отправки (и пачки входа)"""
+    marked = bytearray(packet)
+    marked[FLAGS_OFFSET] |= flags
+    return marked
+
+
+def fragment_packet(packet, mtu=DEFAULT_MTU):
+    """Разрезать пакет на фрагменты не больше mtu байт (пакет в пределах mtu возвращается как есть).
+    Фрагмент - пара (заголовок фрагмента, вид на часть данных исходного пакета) без копирования"""
+    if len(packet) <= mtu or parse_header(packet) is None:
+        return [(packet,)]
+    packet_type, stream_id, flags, seq, timestamp_us = parse_header(packet)
+    payload = memoryview(packet)[HEADER_SIZE:]
+    step = fragment_step(mtu)
+    count = -(-len(payload) // step)
+    header = pack_header(PACKET_FRAGMENT, seq, timestamp_us, stream_id, flags)
+    return [(header + FRAGMENT_PAYLOAD.pack(packet_type, index, count, index * step, len(payload)),
+             payload[index * step:(index + 1) * step])
+            for index in range(count)]
+
+
+def fragment_step(mtu):
+    """Байт данных пакета во фрагменте (по целым кадрам)"""
+    return (mtu - HEADER_SIZE - FRAGMENT_PAYLOAD.size) // FRAGMENT_ALIGN * FRAGMENT_ALIGN
+
+
+def datagram_count(packet_size, mtu=DEFAULT_MTU):
+    """Сколько датаграмм займёт пакет packet_size байт (с заголовком) после fragment_packet"""
+    if packet_size <= mtu:
+        return 1
+    return -(-(packet_size - HEADER_SIZE) // fragment_step(mtu))
+
+
+def is_fragment(data):
+    """Фрагмент ли это (без полного разбора заголовка)"""
+    return len(data) > HEADER_SIZE and data[:2] == MAGIC and data[3] == PACKET_FRAGMENT
+
+
+class Reassembler:
+    """Сборка фрагментов по номеру пакета: ограниченная таблица, таймаут, пропуски заполняются тишиной"""
+
+    def __init__(self, capacity=REASSEMBLY_CAPACITY, timeout=REASSEMBLY_TIMEOUT):
+        self.capacity = capacity
+        self.timeout = timeout
+        self.fill_byte = 0  # Байт тишины для текущего кодирования
+        self._entries = {}  # seq -> [время первого фрагмента, заголовок, данные, полученные номера, всего]
+        self.completed = 0
+        self.partial = 0
+        self.fragments_lost = 0
+
+    def pending(self):
+        return bool(self._entries)
+
+    def add(self, data, now):
+        """Принять фрагмент. Возвращает список готовых пакетов в порядке номеров"""
+        _, stream_id, flags, seq, timestamp_us = parse_header(data)
+        packet_type, index, count, offset, total = FRAGMENT_PAYLOAD.unpack_from(data, HEADER_SIZE)
+        chunk = data[HEADER_SIZE + FRAGMENT_PAYLOAD.size:]
+        if index >= count or offset + len(chunk) > total:
+            return []
+
+        ready = []
+        entry = self._entries.get(seq)
+        if entry is None:
+            if len(self._entries) >= self.capacity:
+                ready.append(self._flush(min(self._entries, key=lambda s: seq_delta(s, seq))))
+            header = pack_header(packet_type, seq, timestamp_us, stream_id, flags)
+            entry = self._entries[seq] = [now, header, bytearray([self.fill_byte]) * total, set(), count]
+        if index in entry[3] or len(entry[2]) != total:
+            return ready
+        entry[2][offset:offset + len(chunk)] = chunk
+        entry[3].add(index)
+
+        if len(entry[3]) == entry[4]:
+            # Пакет собран: более старые неполные уже не дополнятся (на LAN порядок почти не нарушается)
+            for older in sorted((s for s in self._entries if seq_delta(s, seq) < 0),
+                                key=lambda s: seq_delta(s, seq)):
+                ready.append(self._flush(older))
+            ready.append(self._flush(seq))
+        return ready
+
+    def expire(self, now):
+        """Отдать неполные пакеты, которые ждут дольше таймаута"""
+        expired = [s for s, entry in self._entries.items() if now - entry[0] >= self.timeout]
+        if not expired:
+            return []
+        newest = expired[0]
+        return [self._flush(s) for s in sorted(expired, key=lambda s: seq_delta(s, newest))]
+
+    def reset(self):
+        self._entries.clear()
+
+    def _flush(self, seq):
+        _, header, payload, received, count = self._entries.pop(seq)
+        if len(received) == count:
+            self.completed += 1
+        else:
+            self.partial += 1
+            self.fragments_lost += count - len(received)
+        return header + bytes(payload)
+
+
+def seq_delta(seq, last_seq):
+    """Разница номеров пакетов с учётом переполнения счётчика"""
+    delta = (seq - last_seq) % SEQ_MODULO
+    return delta - SEQ_MODULO if delta >= SEQ_MODULO // 2 else delta
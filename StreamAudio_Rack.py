@@ -0,0 +1,526 @@
+import argparse
+import heapq
+import json
+import os
+import queue
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import random
+import numpy as np
+
+from StreamAudio_Protocol import PACKET_AUDIO, pack_header
+from StreamAudio_Receiver import (StreamSource, Mixer, parse_sources, open_multicast_socket, stream_id_of,
+                                  SOURCE_TIMEOUT, CHANNELS)
+from StreamAudio_Profiler import CallbackProfiler
+
+try:
+    import sounddevice as sd
+    SOUNDDEVICE_AVAILABLE = True
+except ImportError:
+    SOUNDDEVICE_AVAILABLE = False
+
+# Стойка прослушивания: много выходов (группа, порт, устройство) в одном процессе вместо копий клиента.
+# Один поток опрашивает все сокеты, датаграммы разбирает общий пул потоков: число потоков не растёт с числом выходов
+DEFAULT_CONFIG = 'StreamAudio_Rack.json'
+DEFAULT_PORT = 5007
+DEFAULT_RATE = 44100
+DEFAULT_CHUNK = 256
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+FORMAT = 'int16'
+NULL_DEVICE = 'null'  # Выход без устройства: callback по таймеру (тесты и замеры)
+POLL_TIMEOUT = 0.1
+NULL_CLOCK_SLACK = 0.001  # Null выходы со сроком в пределах этого окна обслуживаются за одно пробуждение
+RECV_BATCH = 64  # Датаграмм с одного сокета за проход опроса
+# Пауза после пробуждения опроса: пакеты соседних потоков забираются за один проход, а не по пробуждению на пакет
+POLL_COALESCE = 0.001
+EXPIRE_INTERVAL = 1.0
+STATS_INTERVAL = 5.0
+
+# Замер масштабирования: по группе на поток, синтетический отправитель в этом же процессе
+BENCH_GROUP_PREFIX = '239.255.77.'
+BENCH_PORT = 5077
+BENCH_SECONDS = 5.0
+BENCH_WARMUP = 1.0
+BENCH_STREAMS = '1,4,16,32'
+
+
+class NullClock:
+    """Один поток, вызывающий callback всех null выходов в их моменты (вместо потоков PortAudio).
+    Очередь по времени: за пробуждение обходятся только выходы, которым пора (с запасом NULL_CLOCK_SLACK)"""
+
+    def __init__(self):
+        self.heap = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def add(self, output):
+        with self.lock:
+            heapq.heappush(self.heap, (output.next_time, id(output), output))
+        self.wakeup.set()
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def run(self):
+        heap = self.heap
+        while self.running:
+            with self.lock:
+                now = time.time()
+                while heap and heap[0][0] <= now + NULL_CLOCK_SLACK:
+                    _, key, output = heapq.heappop(heap)
+                    if not output.active:
+                        continue  # Остановленный выход просто выпадает из очереди
+                    output.tick(now)
+                    heapq.heappush(heap, (output.next_time, key, output))
+                next_time = heap[0][0] if heap else now + POLL_TIMEOUT
+            self.wakeup.clear()
+            delay = next_time - time.time()
+            if delay > 0:
+                self.wakeup.wait(delay)
+
+
+class NullOutput:
+    """Заменитель sd.OutputStream: тот же callback, звук никуда не идёт"""
+
+    def __init__(self, clock, samplerate, blocksize, channels, callback):
+        self.clock = clock
+        self.interval = blocksize / samplerate
+        self.callback = callback
+        self.buffer = np.zeros((blocksize, channels), dtype=np.int16)
+        self.active = False
+        self.next_time = 0.0
+        self.xruns = 0  # Пропущенные моменты callback (таймер не успел)
+
+    def start(self):
+        self.next_time = time.time()
+        self.active = True
+        self.clock.add(self)
+
+    def stop(self):
+        self.active = False
+
+    def close(self):
+        self.active = False
+
+    def tick(self, now):
+        self.callback(self.buffer, len(self.buffer), None, None)
+        self.next_time += self.interval
+        if now - self.next_time > self.interval:
+            # Отстали больше чем на блок - не догоняем очередью вызовов
+            self.xruns += 1
+            self.next_time = now + self.interval
+
+
+class Sink:
+    """Один выход стойки: устройство, его источники и сведение"""
+
+    def __init__(self, name, device, subscriptions, rate, chunk, client_id, nack_enabled=True, playout_delay=None):
+        self.name = name
+        self.device = device
+        self.subscriptions = subscriptions  # [(группа, порт, id потока или None)]
+        self.rate = rate
+        self.chunk = chunk
+        self.client_id = client_id
+        self.nack_enabled = nack_enabled
+        self.playout_delay = playout_delay
+        self.worker = 0  # Номер потока пула, который разбирает пакеты этого выхода
+        self.fast_join = True  # Новые источники просят у сервера пачку последних пакетов
+        self.control_sock = None  # Отчёты, NACK и SYNC уходят с него, на него же приходят повторы и ответы
+        # Меняются только потоком пула выхода; callback читает кортеж, заменяемый целиком
+        self.sources = ()
+        self.source_map = {}
+        self.mixer = Mixer()
+        self.stream = None
+        self.last_audio_level = 0.0
+        self.profiler = CallbackProfiler(rate)
+        self.detector = None  # MarkerDetector: замер задержки по маркеру сервера
+
+    def open(self, null_clock):
+        if self.device == NULL_DEVICE:
+            self.stream = NullOutput(null_clock, self.rate, self.chunk, CHANNELS, self.callback)
+        else:
+            self.stream = sd.OutputStream(
+                device=self.device,
+                channels=CHANNELS,
+                samplerate=self.rate,
+                blocksize=self.chunk,
+                callback=self.callback,
+                dtype=FORMAT,
+                latency='low'
+            )
+        self.stream.start()
+
+    def close(self):
+        if self.stream:
+            try:
+                self.stream.stop()
+                self.stream.close()
+            except Exception as e:
+                print(f"[WARNING] {self.name}: ошибка закрытия выхода: {e}")
+            self.stream = None
+
+    def callback(self, outdata, frames, time_info, status):
+        try:
+            started = time.perf_counter()
+            current_time = time.time()
+            dac_time = current_time
+            if time_info is not None:
+                output_delay = time_info.outputBufferDacTime - time_info.currentTime
+                if 0 < output_delay < 1:
+                    dac_time += output_delay
+            self.last_audio_level = self.mixer.mix(self.sources, outdata, current_time, dac_time)
+            detector = self.detector
+            if detector:
+                detector.push(outdata, dac_time)
+            self.profiler.record(time.perf_counter() - started, frames, status)
+        except Exception as e:
+            print(f"[ERROR] {self.name}: audio output error: {e}")
+            outdata.fill(0)
+
+    def receive(self, key, sock, addr, data, current_time):
+        """Датаграмма для этого выхода (из потока пула)"""
+        source = self.source_map.get(key)
+        if source is None:
+            if sock is self.control_sock:
+                return  # Unicast ответ источнику, которого у этого выхода нет
+            source = StreamSource(key, self.control_sock, addr, self.client_id, self.rate, self.chunk,
+                                  self.nack_enabled, self.playout_delay)
+            source.on_format = self.on_source_format
+            source.fast_join = self.fast_join
+            self.source_map[key] = source
+            self.sources = self.sources + (source,)
+            print(f"[DEBUG] {self.name}: новый источник {source.label}")
+        source.receive(data, current_time)
+
+    def on_source_format(self, source, reopen):
+        # Частота выхода задана конфигурацией: источник другой частоты не звучит (размер пакета не важен)
+        source.muted = source.sample_rate != self.rate
+        if source.muted:
+            print(f"[WARNING] {self.name}: частота {source.label} не совпадает с выходом, источник выключен")
+
+    def expire_sources(self, current_time):
+        expired = [s for s in self.sources if current_time - s.last_receive_time > SOURCE_TIMEOUT]
+        if expired:
+            self.sources = tuple(s for s in self.sources if s not in expired)
+            for source in expired:
+                del self.source_map[source.key]
+                print(f"[DEBUG] {self.name}: источник пропал {source.label}")
+
+    def totals(self):
+        """(пакетов, потеряно, опустошений) по всем источникам"""
+        sources = self.sources
+        return (sum(s.packet_count for s in sources), sum(s.lost_packets for s in sources),
+                sum(s.underruns for s in sources))
+
+    def report(self):
+        packets, lost, underruns = self.totals()
+        total = packets + lost
+        loss_rate = lost / total * 100 if total else 0
+        text = (f"{self.name}: источников {len(self.sources)}, пакетов {packets}, потери {loss_rate:.1f}%, "
+                f"уровень {int(self.last_audio_level * 100)}%")
+        if underruns:
+            text += f", опустошений {underruns}"
+        xruns = getattr(self.stream, 'xruns', 0)
+        if xruns:
+            text += f", пропусков таймера {xruns}"
+        profiler_report = self.profiler.report()
+        if profiler_report:
+            text += f", {profiler_report}"
+        return text
+
+
+def find_output_device(device):
+    """Индекс устройства вывода по номеру или части имени ('null' - без устройства)"""
+    if device == NULL_DEVICE or isinstance(device, int):
+        return device
+    if not SOUNDDEVICE_AVAILABLE:
+        raise RuntimeError("SoundDevice не доступен - возможны только null выходы")
+    for index, info in enumerate(sd.query_devices()):
+        if info['max_output_channels'] > 0 and device.lower() in info['name'].lower():
+            return index
+    raise ValueError(f"устройство вывода не найдено: {device}")
+
+
+def load_config(path):
+    """Конфигурация стойки из JSON: общие настройки и список выходов"""
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    if not config.get('sinks'):
+        raise ValueError("в конфигурации нет выходов (sinks)")
+    return config
+
+
+class Rack:
+    """Много выходов в одном процессе: общий опрос сокетов и общий пул потоков разбора"""
+
+    def __init__(self, config):
+        port = config.get('port', DEFAULT_PORT)
+        playout_delay_ms = config.get('playout_delay_ms')
+        playout_delay = playout_delay_ms / 1000 if playout_delay_ms is not None else None
+        self.workers = max(1, config.get('workers', DEFAULT_WORKERS))
+        self.sinks = []
+        for index, sink_config in enumerate(config['sinks']):
+            sink = Sink(sink_config.get('name', f"Выход {index + 1}"),
+                        find_output_device(sink_config.get('device', NULL_DEVICE)),
+                        parse_sources(sink_config['sources'], port),
+                        sink_config.get('rate', DEFAULT_RATE), sink_config.get('chunk', DEFAULT_CHUNK),
+                        random.getrandbits(32), config.get('nack', True), playout_delay)
+            sink.worker = index % self.workers
+            sink.fast_join = config.get('fast_join', True)
+            self.sinks.append(sink)
+        self.running = False
+        self.sockets = []
+        self.routes = {}  # сокет -> [(выход, допустимые id потоков или None)]; None - управляющий сокет
+        self.control_routes = []
+        self.queues = [queue.SimpleQueue() for _ in range(self.workers)]
+        self.threads = []
+        self.null_clock = NullClock()
+
+    def setup_network(self):
+        """По сокету на (группу, порт): сокет получает только свою группу, маршрут к выходам - по сокету.
+        Сокеты групп привязаны к адресу группы, поэтому unicast обмен с серверами идёт через отдельный сокет"""
+        control_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        control_sock.bind(('', 0))
+        control_sock.setblocking(False)
+        self.routes[control_sock] = None
+        for sink in self.sinks:
+            sink.control_sock = control_sock
+
+        sockets = {}
+        filters = {}
+        for sink in self.sinks:
+            for group, port, stream_id in sink.subscriptions:
+                sock = sockets.get((group, port))
+                if sock is None:
+                    sock = sockets[(group, port)] = open_multicast_socket(port, [group], bind_group=True)
+                    sock.setblocking(False)
+                    self.routes[sock] = []
+                allowed = filters.setdefault((sock, sink), set())
+                allowed.add(stream_id)
+        for (sock, sink), stream_ids in filters.items():
+            self.routes[sock].append((sink, None if None in stream_ids else stream_ids))
+        self.sockets = [control_sock] + list(sockets.values())
+
+    def start(self):
+        self.setup_network()
+        self.running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.worker_loop, args=(index,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self.poll_loop, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        for sink in self.sinks:
+            sink.open(self.null_clock)
+        print(f"[DEBUG] Стойка запущена: выходов {len(self.sinks)}, сокетов {len(self.sockets) - 1}, "
+              f"потоков разбора {self.workers}")
+
+    def stop(self):
+        self.running = False
+        for sink in self.sinks:
+            sink.close()
+        self.null_clock.stop()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
+        for sock in self.sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self.sockets = []
+        self.routes = {}
+
+    def poll_loop(self):
+        """Опрос всех сокетов одним потоком; пакеты уходят в пул пачками по потоку разбора"""
+        queues = self.queues
+        control_sock = self.sockets[0]
+        self.control_routes = [(sink, None) for sink in self.sinks]
+        while self.running:
+            try:
+                readable, _, _ = select.select(self.sockets, [], [], POLL_TIMEOUT)
+                if readable and len(self.sockets) > 1:
+                    time.sleep(POLL_COALESCE)
+                    readable, _, _ = select.select(self.sockets, [], [], 0)
+            except (OSError, ValueError):
+                if self.running:
+                    raise
+                break
+            current_time = time.time()
+            batches = [[] for _ in queues]
+            for sock in readable:
+                routes = self.routes[sock]
+                if routes is None:
+                    # Повторы и ответы SYNC: тем выходам, у которых есть этот источник
+                    routes = self.control_routes
+                for _ in range(RECV_BATCH):
+                    try:
+                        data, addr = sock.recvfrom(65536)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        # Windows возвращает ICMP "порт недоступен" как ошибку recvfrom
+                        break
+                    stream_id = stream_id_of(data)
+                    key = (addr[0], addr[1], stream_id)
+                    for sink, allowed in routes:
+                        if allowed is None or stream_id in allowed:
+                            if sock is control_sock and key not in sink.source_map:
+                                continue
+                            batches[sink.worker].append((sink, key, sock, addr, data))
+            for index, batch in enumerate(batches):
+                if batch:
+                    queues[index].put((current_time, batch))
+
+    def worker_loop(self, index):
+        """Поток пула: разбор пакетов своих выходов и удаление пропавших источников"""
+        work = self.queues[index]
+        sinks = [sink for sink in self.sinks if sink.worker == index]
+        last_expire = time.time()
+        while self.running:
+            try:
+                current_time, batch = work.get(timeout=POLL_TIMEOUT)
+            except queue.Empty:
+                current_time, batch = time.time(), ()
+            for sink, key, sock, addr, data in batch:
+                try:
+                    sink.receive(key, sock, addr, data, current_time)
+                except Exception as e:
+                    print(f"[ERROR] {sink.name}: receive error: {e}")
+            if current_time - last_expire >= EXPIRE_INTERVAL:
+                last_expire = current_time
+                for sink in sinks:
+                    sink.expire_sources(current_time)
+
+    def report(self):
+        return [sink.report() for sink in self.sinks]
+
+
+class BenchmarkSender:
+    """Синтетический отправитель: по потоку на группу, пакеты с заголовком в реальном темпе"""
+
+    def __init__(self, streams, rate, chunk):
+        self.groups = [f"{BENCH_GROUP_PREFIX}{i + 1}" for i in range(streams)]
+        self.interval = chunk / rate
+        noise = (np.random.default_rng().standard_normal((chunk, CHANNELS)) * 3000).astype(np.int16)
+        self.payload = noise.tobytes()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack('b', 1))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.running = False
+        self.cpu_time = 0.0  # Время CPU потока отправителя (вычитается из замера)
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        self.sock.close()
+
+    def run(self):
+        seq = 0
+        next_time = time.time()
+        while self.running:
+            packet_time = int(time.time() * 1000000)
+            packet = pack_header(PACKET_AUDIO, seq, packet_time) + self.payload
+            for group in self.groups:
+                self.sock.sendto(packet, (group, BENCH_PORT))
+            seq += 1
+            self.cpu_time = time.thread_time()
+            next_time += self.interval
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def run_benchmark(counts, seconds, chunk, workers):
+    """Загрузка CPU стойкой в зависимости от числа потоков (null выходы, без звуковых устройств)"""
+    print(f"Замер: chunk={chunk}, {DEFAULT_RATE}Hz, {seconds:.0f} с на точку, потоков разбора {workers}")
+    print(f"{'потоков':>8} {'CPU %':>8} {'CPU %/поток':>12} {'потери %':>9} {'опустошений':>12}")
+    for count in counts:
+        config = {
+            'port': BENCH_PORT,
+            'nack': False,
+            'workers': workers,
+            'sinks': [{'name': f"bench{i + 1}", 'device': NULL_DEVICE, 'sources': f"{BENCH_GROUP_PREFIX}{i + 1}",
+                       'rate': DEFAULT_RATE, 'chunk': chunk} for i in range(count)]
+        }
+        rack = Rack(config)
+        sender = BenchmarkSender(count, DEFAULT_RATE, chunk)
+        rack.start()
+        sender.start()
+        time.sleep(BENCH_WARMUP)
+
+        start_totals = [sink.totals() for sink in rack.sinks]
+        start_cpu, start_sender_cpu, start_wall = time.process_time(), sender.cpu_time, time.time()
+        time.sleep(seconds)
+        cpu = (time.process_time() - start_cpu) - (sender.cpu_time - start_sender_cpu)
+        wall = time.time() - start_wall
+        end_totals = [sink.totals() for sink in rack.sinks]
+
+        sender.stop()
+        rack.stop()
+        packets = sum(e[0] - s[0] for s, e in zip(start_totals, end_totals))
+        lost = sum(e[1] - s[1] for s, e in zip(start_totals, end_totals))
+        underruns = sum(e[2] - s[2] for s, e in zip(start_totals, end_totals))
+        loss_rate = lost / (packets + lost) * 100 if packets + lost else 100.0
+        cpu_percent = cpu / wall * 100
+        print(f"{count:>8} {cpu_percent:>8.1f} {cpu_percent / count:>12.2f} {loss_rate:>9.2f} {underruns:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Приёмник StreamAudio на много выходов в одном процессе")
+    parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG, help="JSON файл конфигурации стойки")
+    parser.add_argument('--benchmark', metavar='N,N,...', nargs='?', const=BENCH_STREAMS,
+                        help=f"Замер масштабирования на null выходах (по умолчанию {BENCH_STREAMS})")
+    parser.add_argument('--seconds', type=float, default=BENCH_SECONDS, help="Длительность точки замера")
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help="Кадров в пакете для замера")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Потоков разбора для замера")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark([int(n) for n in args.benchmark.split(',')], args.seconds, args.chunk, args.workers)
+        return
+
+    if not os.path.exists(args.config):
+        print(f"[ERROR] Файл конфигурации не найден: {args.config}")
+        sys.exit(1)
+    try:
+        rack = Rack(load_config(args.config))
+        rack.start()
+    except Exception as e:
+        print(f"[ERROR] Не удалось запустить стойку: {e}")
+        sys.exit(1)
+    try:
+        while True:
+            time.sleep(STATS_INTERVAL)
+            for line in rack.report():
+                print(f"[STATS] {line}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rack.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,712 @@
+import math
+import socket
+import struct
+import sys
+from collections import deque
+import numpy as np
+
+from StreamAudio_Protocol import (PACKET_AUDIO, PACKET_SID, PACKET_FORMAT, PACKET_SYNC, HEADER_SIZE,
+                                  FLAG_RETRANSMIT, FLAG_JOIN, MAX_NACK_SEQS, SEQ_MODULO, Reassembler, parse_header,
+                                  parse_sid, parse_format, parse_sync, seq_delta, build_report, build_nack,
+                                  build_sync_request, build_join, is_fragment)
+from StreamAudio_Codec import (ENCODING_PCM16, ENCODING_NAMES, SILENCE_BYTE, PolyphaseResampler, payload_size,
+                               decode_payload)
+from StreamAudio_JitterBuffer import JitterBuffer, JITTER_CAPACITY, JITTER_TARGET_DEPTH
+from StreamAudio_Trace import (EVENT_RECEIVE, EVENT_PLAY, EVENT_DROP, REASON_LATE, REASON_DUPLICATE,
+                               REASON_BUFFER_FULL, REASON_GAP, REASON_CONCEALED, REASON_SIZE, REASON_RETRANSMIT,
+                               REASON_UNDERRUN)
+
+# Приём одного потока (источника) и сведение нескольких источников в один выход
+DEFAULT_RATE = 44100
+CHANNELS = 2
+SOCKET_BUFFER = 32768  # Уменьшенный буфер приёма для низкой задержки
+
+# Комфортный шум во время подавления тишины на сервере (False - чистая тишина)
+COMFORT_NOISE = True
+COMFORT_NOISE_SECONDS = 1  # Длина заранее сгенерированной таблицы шума
+
+# Отчёты приёмника серверу (для адаптации битрейта)
+REPORT_INTERVAL = 1.0
+
+# Запросы повтора потерянных пакетов (NACK)
+RETRANSMIT_WAIT_PACKETS = 2  # Сколько интервалов пакета ждать повтор, прежде чем пропустить дыру
+NACK_PENDING_TIMEOUT = 1.0  # Через сколько секунд забываем неотвеченный запрос
+NACK_RTT_DEFAULT = 0.01  # RTT до сервера до первого замера SYNC, с
+
+# Сколько интервалов пакета ждать недостающие фрагменты, прежде чем играть пакет с тишиной на их месте
+REASSEMBLY_WAIT_PACKETS = 1
+
+SOURCE_TIMEOUT = 5.0  # Источник без пакетов дольше этого убирается из сведения
+
+# Синхронное воспроизведение: пакет звучит в момент "время захвата на сервере + задержка воспроизведения"
+PLAYOUT_DELAY_MS = 80  # Одинаковая на всех клиентах комнаты; должна покрывать сеть и буфер устройства
+SYNC_INTERVAL = 1.0  # Обмен временем с сервером
+SYNC_FAST_INTERVAL = 0.1  # Пока окно замеров не заполнено
+SYNC_WINDOW = 8  # Замеров, из которых берётся лучший (с минимальным RTT)
+SYNC_SMOOTHING = 8  # Сглаживание отклонения от целевого времени для статистики
+SYNC_TOLERANCE = 0.001  # Гистерезис сверх половины чанка, чтобы дрожание не вызывало пропуск за задержкой
+
+# Таблица белого шума с единичным RMS - в callback только масштабирование
+COMFORT_NOISE_TABLE = np.random.default_rng().uniform(
+    -np.sqrt(3), np.sqrt(3), (DEFAULT_RATE * COMFORT_NOISE_SECONDS, CHANNELS)).astype(np.float32)
+EMPTY_CARRY = np.zeros((0, CHANNELS), dtype=np.int16)
+
+
+def parse_sources(text, default_port):
+    """Список подписок из строки "группа[:порт][#id потока], ...". id None - любой поток группы"""
+    sources = []
+    for item in text.replace(',', ' ').split():
+        address, _, stream_id = item.partition('#')
+        group, _, port = address.partition(':')
+        socket.inet_aton(group)  # Проверка адреса (OSError при ошибке)
+        sources.append((group, int(port) if port else default_port, int(stream_id) if stream_id else None))
+    if not sources:
+        raise ValueError("не задана ни одна multicast группа")
+    return sources
+
+
+def open_multicast_socket(port, groups, bind_group=False, tuning=None, buffer_size=SOCKET_BUFFER):
+    """Сокет на порт с подпиской на несколько групп.
+    bind_group - привязать к адресу единственной группы: ядро само отсекает чужие группы на этом порту,
+    но unicast (повторы, ответы SYNC) на такой сокет не приходит. Windows так не умеет - там привязка к порту.
+    tuning - SocketTuning (интерфейс подписки, QoS, busy poll); без него - прежние настройки"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    address = groups[0] if bind_group and len(groups) == 1 and sys.platform != 'win32' else ''
+    sock.bind((address, port))
+    for group in groups:
+        if tuning is not None:
+            mreq = tuning.membership(group)
+        else:
+            mreq = struct.pack('4sL', socket.inet_aton(group), socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    # Linux по умолчанию отдаёт сокету все группы на этом порту, даже чужие
+    multicast_all = getattr(socket, 'IP_MULTICAST_ALL', None)
+    if multicast_all is not None:
+        sock.setsockopt(socket.IPPROTO_IP, multicast_all, 0)
+    sock.settimeout(0.1)
+    if tuning is not None:
+        tuning.apply_receiver(sock, buffer_size)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        # Включаем loopback для multicast (чтобы работало на одном компьютере)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    print(f"[DEBUG] Multicast настроен: группы={', '.join(groups)}, порт={port}")
+    return sock
+
+
+def stream_id_of(data):
+    """id потока из заголовка (0 для сырого PCM)"""
+    header = parse_header(data)
+    return header[1] if header is not None else 0
+
+
+class ClockSync:
+    """Смещение часов сервера относительно клиента по обмену SYNC (как в NTP).
+    Из последних замеров берётся замер с минимальным RTT - он меньше всего искажён очередями"""
+
+    def __init__(self, window=SYNC_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.offset = None  # Секунды: время сервера = время клиента + offset
+        self.rtt = 0.0
+
+    def update(self, request_time, server_receive, server_send, reply_time):
+        """Замер: отправка запроса и приём ответа по часам клиента, приём и ответ по часам сервера"""
+        rtt = (reply_time - request_time) - (server_send - server_receive)
+        offset = ((server_receive - request_time) + (server_send - reply_time)) / 2
+        self.samples.append((rtt, offset))
+        self.rtt, self.offset = min(self.samples)
+
+    def ready(self):
+        return self.offset is not None
+
+    def settled(self):
+        return len(self.samples) == self.samples.maxlen
+
+
+class StreamSource:
+    """Один принимаемый поток: сборка фрагментов, буфер по номерам, DTX, повторы, отчёты и статистика"""
+
+    def __init__(self, key, sock, addr, client_id, rate=DEFAULT_RATE, chunk=256, nack_enabled=False,
+                 playout_delay=None):
+        self.key = key
+        self.label = f"{addr[0]}:{addr[1]}#{key[2]}"
+        self.sock = sock
+        self.addr = addr
+        self.client_id = client_id
+        self.gain = 1.0
+        self.muted = False  # Формат не совпадает с выходом
+        self.recorder = None
+        self.trace = None  # TraceWriter: каждый пакет и блок воспроизведения
+        self.advised_packet_us = 0  # Рекомендация автовыбора профиля (длительность пакета), уходит серверу в отчёте
+        self.on_format = None  # callback(source, reopen) из потока приема
+        self.nack_enabled = nack_enabled
+        self.jitter_buffer = JitterBuffer()
+        self.reassembler = Reassembler()
+        # Синхронное воспроизведение (None - играть по мере прихода, как раньше)
+        self.playout_delay = playout_delay
+        self.clock = ClockSync()
+        self.clock_wanted = False  # Сводить часы и без синхронного воспроизведения (замер задержки по маркеру)
+        # Быстрый вход: при первом пакете просим у сервера последние пакеты, чтобы не ждать заполнения буфера
+        self.fast_join = True
+        self.join_time = None  # Первый пакет источника
+        self.join_packets = 0  # Получено пакетов из пачки входа
+        self.format_known = False  # Сервер объявил формат (до этого играем по профилю клиента)
+        self.first_audio_time = None  # От первого пакета до первого звука, с
+        self.stable_time = None  # От первого пакета до воспроизведения в известном формате (и вовремя), с
+        self.capture_times = [0.0] * self.jitter_buffer.capacity  # Время захвата по номеру пакета
+        self.last_sync_time = 0.0
+        self.sync_error = 0.0
+        self.sync_held = 0
+        self.sync_skipped = 0
+        self.sync_aligned = False  # Хотя бы один пакет сыгран в пределах допуска от целевого времени
+
+        self.packet_count = 0
+        self.lost_packets = 0
+        self.underruns = 0
+        self.jitter = 0.0
+        self.last_transit = None
+        self.last_seq = None
+        self.estimated_latency = 0.0
+        self.last_packet_time = 0
+        self.last_report_time = 0.0
+        self.last_receive_time = 0.0
+        self.last_audio_level = 0.0
+        self.nack_pending = {}  # номер -> время запроса
+        self.lost_seqs = set()  # Номера, посчитанные потерянными по разрыву (повтор вычитает только их)
+        self.base_depth = JITTER_TARGET_DEPTH  # Глубина буфера без запаса на повторы
+        self.nack_requested = 0
+        self.nack_recovered = 0
+        self.nack_recovery_time = 0.0
+        self.nack_wait_time = 0.0
+        self.in_dtx = False
+        self.comfort_noise_level = 0.0
+        self.comfort_noise_pos = 0
+        # Недоигранный остаток пакета (кадры x каналы потока): блок устройства не равен чанку потока
+        self.carry = EMPTY_CARRY
+        self.carry_pos = 0
+        # Формат потока (объявляется сервером, по умолчанию - PCM стерео)
+        self.set_format(rate, CHANNELS, ENCODING_PCM16, chunk)
+
+    def set_format(self, rate, channels, encoding, chunk):
+        self.sample_rate = rate
+        self.chunk_size = chunk
+        self.stream_channels = channels
+        self.encoding = encoding
+        self.expected_packet_interval = chunk / rate  # Ожидаемый интервал между пакетами
+        self.frame_size = payload_size(channels, encoding, 1)
+        self.retransmit_wait = RETRANSMIT_WAIT_PACKETS * self.expected_packet_interval if self.nack_enabled else 0.0
+        self.reassembler.timeout = REASSEMBLY_WAIT_PACKETS * self.expected_packet_interval
+        self.reassembler.fill_byte = SILENCE_BYTE[encoding]
+        if self.playout_delay is None:
+            self.update_depth()
+        else:
+            # Буфер должен вмещать всю задержку воспроизведения, а не два пакета
+            depth = math.ceil(self.playout_delay / self.expected_packet_interval) + RETRANSMIT_WAIT_PACKETS + 1
+            jitter_buffer = self.jitter_buffer
+            jitter_buffer.max_depth = depth
+            capacity = max(JITTER_CAPACITY, 2 * depth)
+            if capacity != jitter_buffer.capacity:
+                jitter_buffer.capacity = capacity
+                jitter_buffer.reset()
+                self.capture_times = [0.0] * capacity
+
+    def set_depth(self, depth):
+        """Глубина буфера от автовыбора профиля (в синхронном режиме её задаёт задержка воспроизведения)"""
+        if self.playout_delay is None:
+            self.base_depth = depth
+            self.update_depth()
+
+    def nack_depth(self):
+        """Глубина, при которой повтор успевает до воспроизведения дыры: дыра видна со следующим пакетом,
+        дальше RTT до сервера и ожидание повтора"""
+        if not self.nack_enabled:
+            return 0
+        rtt = self.clock.rtt if self.clock.ready() else NACK_RTT_DEFAULT
+        return 1 + math.ceil((rtt + self.retransmit_wait) / self.expected_packet_interval)
+
+    def update_depth(self):
+        """Глубина буфера: заданная, но не меньше нужной для повторов по NACK"""
+        depth = min(max(self.base_depth, self.nack_depth()), self.jitter_buffer.capacity // 2)
+        self.jitter_buffer.target_depth = depth
+        self.jitter_buffer.max_depth = depth + 1
+
+    def receive(self, data, current_time):
+        """Датаграмма этого источника из потока приема"""
+        self.last_receive_time = current_time
+        if self.join_time is None:
+            self.join_time = current_time
+            if self.fast_join:
+                self.send_join(current_time)
+        if current_time - self.last_report_time >= REPORT_INTERVAL:
+            self.send_report(current_time)
+        if self.playout_delay is not None or self.clock_wanted or self.nack_enabled:
+            # Для NACK нужен RTT до сервера - глубина буфера покрывает ожидание повтора
+            sync_interval = SYNC_INTERVAL if self.clock.settled() else SYNC_FAST_INTERVAL
+            if current_time - self.last_sync_time >= sync_interval:
+                self.send_sync(current_time)
+
+        # Отладочная информация для первых пакетов
+        if self.packet_count < 5:
+            print(f"[DEBUG] Получен пакет #{self.packet_count + 1}: размер={len(data)} байт, от {self.label}")
+
+        # Фрагменты собираем по номеру пакета, остальное обрабатываем сразу
+        if is_fragment(data):
+            for packet in self.reassembler.add(data, current_time):
+                self.handle_packet(packet, current_time)
+        else:
+            self.handle_packet(data, current_time)
+
+        # Неполный пакет отдаём по таймауту: теряются только недостающие фрагменты
+        if self.reassembler.pending():
+            for packet in self.reassembler.expire(current_time):
+                self.handle_packet(packet, current_time)
+
+    def handle_packet(self, data, current_time):
+        """Обработать целый (или собранный из фрагментов) пакет"""
+        header = parse_header(data)
+        seq = 0
+        late = False
+        joined = False
+        if header is not None:
+            packet_type, stream_id, flags, seq, timestamp_us = header
+            if packet_type == PACKET_SYNC:
+                # Ответ на запрос времени - вне нумерации потока
+                client_id, request_us, receive_us, send_us = parse_sync(data)
+                # Ответы другим клиентам на этой машине могут прийти на наш сокет (общий порт)
+                if client_id == self.client_id and request_us:
+                    self.clock.update(request_us / 1000000, receive_us / 1000000, send_us / 1000000, current_time)
+                    if self.nack_enabled and self.playout_delay is None:
+                        self.update_depth()
+                return
+            trace = self.trace
+            if trace:
+                trace.record(EVENT_RECEIVE, seq, timestamp_us, len(data), packet_type, stream_id,
+                             REASON_RETRANSMIT if flags & FLAG_RETRANSMIT else 0, self.jitter_buffer.qsize(),
+                             event_time=current_time)
+
+            # Потери считаем по разрывам номеров: подавленные сервером чанки номеров не занимают
+            gap = seq_delta(seq, self.last_seq) if self.last_seq is not None else 1
+            if flags & FLAG_RETRANSMIT or gap <= 0:
+                # Повтор или опоздавший пакет: в буфер, если его номер ещё не проигран
+                late = True
+                joined = bool(flags & FLAG_JOIN)
+                if joined:
+                    self.join_packets += 1
+                    if packet_type == PACKET_FORMAT:
+                        # Пачка входа начинается с текущего формата; его номер далеко позади - в буфер не кладём
+                        self.handle_format(data)
+                        return
+                if packet_type != PACKET_AUDIO:
+                    # Служебный пакет только освобождает номер, его содержимое уже устарело
+                    if self.jitter_buffer.put(seq, None, current_time) and not joined:
+                        self.on_packet_recovered(seq, current_time)
+                    return
+            else:
+                if gap > 1:
+                    self.lost_packets += gap - 1
+                    # Играть можно только номера в пределах кольца буфера - запоминаем только их
+                    first = max(1, gap - self.jitter_buffer.capacity)
+                    self.lost_seqs.update((self.last_seq + i) % SEQ_MODULO for i in range(first, gap))
+                    if trace:
+                        trace.record(EVENT_DROP, (self.last_seq + 1) % SEQ_MODULO, timestamp_us,
+                                     stream=stream_id, reason=REASON_GAP, value=gap - 1, event_time=current_time)
+                    if self.nack_enabled:
+                        self.request_retransmit(seq, gap - 1, current_time)
+                self.last_seq = seq
+
+            if packet_type == PACKET_FORMAT:
+                self.jitter_buffer.put(seq, None, current_time)
+                self.handle_format(data)
+                return
+            if packet_type == PACKET_SID:
+                # Сервер подавляет тишину - это не потеря, играем комфортный шум
+                self.jitter_buffer.put(seq, None, current_time)
+                noise_level, _ = parse_sid(data)
+                self.comfort_noise_level = float(noise_level)
+                self.in_dtx = True
+                self.last_packet_time = 0
+                return
+            if packet_type != PACKET_AUDIO:
+                return
+            data = data[HEADER_SIZE:]
+            self.capture_times[seq % len(self.capture_times)] = timestamp_us / 1000000
+
+            if not late:
+                self.in_dtx = False
+                # Джиттер по RFC 3550: сглаженное изменение времени в пути
+                transit = current_time - timestamp_us / 1000000
+                if self.last_transit is not None:
+                    self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+                self.last_transit = transit
+
+        # Пакет любой длины: воспроизведение собирает блоки устройства кадр в кадр, нужен хотя бы один целый кадр
+        frame_size = self.frame_size
+        usable = len(data) - len(data) % frame_size
+        if usable > 0:
+            # Неполный кадр в конце отбрасываем
+            if usable < len(data):
+                data = data[:usable]
+            data = decode_payload(data, self.encoding)
+
+            # Переполнение буфера выбрасывает старейшие пакеты - считаем их потерями
+            jitter_buffer = self.jitter_buffer
+            dropped = jitter_buffer.dropped
+            late_count = jitter_buffer.late
+            if header is None:
+                # Старый сервер без номеров - нумеруем сами по порядку прихода
+                seq = (jitter_buffer.newest_seq + 1) % SEQ_MODULO if jitter_buffer.newest_seq is not None else 0
+            if not jitter_buffer.put(seq, data, current_time):
+                if self.trace:
+                    self.trace.record(EVENT_DROP, seq, stream=self.key[2], event_time=current_time, value=1,
+                                      reason=REASON_LATE if jitter_buffer.late != late_count else REASON_DUPLICATE)
+                return  # Дубликат или номер уже проигран
+            self.lost_packets += jitter_buffer.dropped - dropped
+            self.packet_count += 1
+            if jitter_buffer.dropped != dropped and self.trace:
+                self.trace.record(EVENT_DROP, seq, stream=self.key[2], reason=REASON_BUFFER_FULL,
+                                  depth=jitter_buffer.qsize(), value=jitter_buffer.dropped - dropped,
+                                  event_time=current_time)
+
+            recorder = self.recorder
+            if recorder:
+                recorder.append(data, current_time, seq)
+
+            if late:
+                if not joined:
+                    self.on_packet_recovered(seq, current_time)
+                return
+
+            # Оцениваем задержку на основе интервала между пакетами
+            if self.last_packet_time > 0:
+                interval = current_time - self.last_packet_time
+                # Задержка = разница между ожидаемым и реальным интервалом
+                delay_diff = interval - self.expected_packet_interval
+                if delay_diff > 0:
+                    self.estimated_latency = delay_diff * 1000  # в миллисекундах
+
+            self.last_packet_time = current_time
+        else:
+            if self.lost_packets < 5:  # Выводим только первые несколько ошибок
+                print(f"[WARNING] Пакет отклонен: размер {len(data)} байт меньше кадра ({frame_size} байт)")
+            self.lost_packets += 1
+            if self.trace:
+                self.trace.record(EVENT_DROP, seq, size=len(data), stream=self.key[2], reason=REASON_SIZE, value=1,
+                                  event_time=current_time)
+
+    def handle_format(self, data):
+        """Объявление формата сервером"""
+        self.format_known = True
+        stream_format = parse_format(data)
+        if stream_format != (self.sample_rate, self.stream_channels, self.encoding, self.chunk_size):
+            self.apply_stream_format(*stream_format)
+
+    def apply_stream_format(self, rate, channels, encoding, chunk):
+        """Подстроиться под объявленный сервером формат"""
+        reopen = rate != self.sample_rate or chunk != self.chunk_size
+        # Смена только размера чанка (профиль на лету) - буфер доигрывается, блоки пересобираются без разрыва
+        playable = (rate, channels, encoding) == (self.sample_rate, self.stream_channels, self.encoding)
+        self.set_format(rate, channels, encoding, chunk)
+        if not playable:
+            # Пакеты старого формата не играем
+            self.jitter_buffer.reset()
+            self.carry = EMPTY_CARRY
+            self.carry_pos = 0
+        print(f"[DEBUG] Формат потока {self.label}: {rate}Hz, {channels}ch, {ENCODING_NAMES[encoding]}, chunk={chunk}")
+        if self.on_format:
+            self.on_format(self, reopen)
+
+    def request_retransmit(self, next_seq, missing, current_time):
+        """NACK на пропущенные перед next_seq номера (самые свежие, не больше MAX_NACK_SEQS)"""
+        missing = min(missing, MAX_NACK_SEQS)
+        seqs = [(next_seq - i) % SEQ_MODULO for i in range(missing, 0, -1)]
+        for lost_seq in seqs:
+            self.nack_pending[lost_seq] = current_time
+        self.nack_requested += missing
+        try:
+            self.sock.sendto(build_nack(int(current_time * 1000000), self.client_id, seqs, self.key[2]), self.addr)
+        except OSError as e:
+            print(f"[WARNING] Не удалось отправить NACK: {e}")
+
+    def on_packet_recovered(self, seq, current_time):
+        """Пропущенный пакет пришёл вовремя - он больше не потеря"""
+        requested_at = self.nack_pending.pop(seq, None)
+        if requested_at is not None:
+            self.nack_recovered += 1
+            self.nack_recovery_time += current_time - requested_at
+        if seq in self.lost_seqs:
+            self.lost_seqs.discard(seq)
+            self.lost_packets -= 1
+
+    def send_report(self, current_time):
+        """Отчёт приёмника на адрес, с которого пришёл поток"""
+        self.last_report_time = current_time
+        # Заодно забываем запросы повтора, на которые уже не ответят
+        if self.nack_pending:
+            self.nack_pending = {s: t for s, t in self.nack_pending.items()
+                                 if current_time - t < NACK_PENDING_TIMEOUT}
+        if self.lost_seqs:
+            # Номера позади кольца буфера уже не сыграют
+            capacity = self.jitter_buffer.capacity
+            self.lost_seqs = {s for s in self.lost_seqs if seq_delta(self.last_seq, s) < capacity}
+        buffer_ms = self.buffer_ms()
+        report = build_report(0, int(current_time * 1000000), self.client_id, self.packet_count,
+                              self.lost_packets, self.underruns, self.jitter * 1000000, buffer_ms,
+                              self.estimated_latency + buffer_ms, self.key[2], self.advised_packet_us)
+        try:
+            self.sock.sendto(report, self.addr)
+        except OSError as e:
+            print(f"[WARNING] Не удалось отправить отчёт: {e}")
+
+    def send_join(self, current_time):
+        """Запрос пачки последних пакетов: сколько нужно, чтобы буфер (или задержка воспроизведения) заполнился сразу"""
+        if self.playout_delay is not None:
+            packets = math.ceil(self.playout_delay / self.expected_packet_interval) + 1
+        else:
+            packets = self.jitter_buffer.target_depth
+        try:
+            self.sock.sendto(build_join(int(current_time * 1000000), self.client_id, packets, self.key[2]), self.addr)
+        except OSError as e:
+            print(f"[WARNING] Не удалось отправить запрос быстрого входа: {e}")
+
+    def note_playback(self, current_time):
+        """Время до первого звука и до устойчивого воспроизведения (формат известен; синхронно - пакет сыгран вовремя)"""
+        if self.first_audio_time is None:
+            self.first_audio_time = current_time - self.join_time
+        if self.format_known and (self.playout_delay is None or self.sync_aligned):
+            self.stable_time = current_time - self.join_time
+
+    def join_report(self):
+        """Строка для статистики: как быстро источник зазвучал"""
+        if self.first_audio_time is None:
+            return ""
+        text = f"Вход: звук {self.first_audio_time * 1000:.0f}мс"
+        if self.stable_time is not None:
+            text += f", стабильно {self.stable_time * 1000:.0f}мс"
+        if self.join_packets:
+            text += f" (пачка {self.join_packets} пак.)"
+        return text
+
+    def send_sync(self, current_time):
+        """Запрос времени сервера (ответ приходит на этот же сокет)"""
+        self.last_sync_time = current_time
+        try:
+            self.sock.sendto(build_sync_request(int(current_time * 1000000), self.client_id, self.key[2]), self.addr)
+        except OSError as e:
+            print(f"[WARNING] Не удалось отправить запрос синхронизации: {e}")
+
+    def align_playout(self, dac_time, current_time):
+        """Подогнать очередь к целевому времени воспроизведения. False - пакет ещё рано играть.
+        Точность - половина чанка (плюс SYNC_TOLERANCE): рано - пропускаем блок тишиной, поздно - выбрасываем пакет"""
+        # Время сервера, когда должен был быть захвачен звук, который сейчас дойдёт до динамика
+        target = dac_time + self.clock.offset - self.playout_delay
+        half_interval = self.expected_packet_interval / 2 + SYNC_TOLERANCE
+        jitter_buffer = self.jitter_buffer
+        while True:
+            seq = jitter_buffer.peek_seq()
+            if seq is None:
+                return True
+            captured = self.capture_times[seq % len(self.capture_times)]
+            if not captured:
+                return True  # Пакет без времени захвата (старый сервер)
+            error = target - captured
+            if error < -half_interval:
+                self.sync_error += (error - self.sync_error) / SYNC_SMOOTHING
+                self.sync_held += 1
+                return False
+            if error > half_interval and jitter_buffer.qsize() > 1:
+                # Опаздываем, а в буфере есть следующий - догоняем
+                if jitter_buffer.get(current_time) is None:
+                    return True
+                self.sync_skipped += 1
+                continue
+            self.sync_error += (error - self.sync_error) / SYNC_SMOOTHING
+            self.sync_aligned = True
+            return True
+
+    def buffer_ms(self):
+        carried = (len(self.carry) - self.carry_pos) / self.sample_rate
+        return (self.jitter_buffer.qsize() * self.expected_packet_interval + carried) * 1000
+
+    def loss_rate(self):
+        total_packets = self.packet_count + self.lost_packets
+        return (self.lost_packets / total_packets) * 100 if total_packets > 0 else 0
+
+    def read_into(self, out, current_time, dac_time=None):
+        """Следующие len(out) кадров источника в out (int16, кадры x каналы выхода). Вызывается из аудио callback.
+        Размер блока устройства не обязан совпадать с чанком потока: остаток пакета переходит в следующий вызов.
+        dac_time - когда первый кадр out прозвучит (часы клиента), нужен для синхронного воспроизведения"""
+        frames = len(out)
+        carry = self.carry
+        if (self.carry_pos >= len(carry) and self.playout_delay is not None and dac_time is not None
+                and self.clock.ready()):
+            # Выравниваем только на границе пакета - начатый пакет доигрывается без разрыва
+            if not self.align_playout(dac_time, current_time):
+                out.fill(0)
+                self.last_audio_level = 0.0
+                return 0.0
+        jitter_buffer = self.jitter_buffer
+        trace = self.trace
+        play_time = dac_time if dac_time is not None else current_time
+        filled = 0
+        level = 0
+        while filled < frames:
+            if self.carry_pos >= len(carry):
+                # Следующий по номеру пакет; при дыре ждём повтор не дольше retransmit_wait
+                concealed = jitter_buffer.concealed
+                audio_data = jitter_buffer.get(current_time, self.retransmit_wait)
+                if trace and jitter_buffer.concealed != concealed:
+                    trace.record(EVENT_DROP, stream=self.key[2], reason=REASON_CONCEALED,
+                                 value=jitter_buffer.concealed - concealed, event_time=play_time)
+                if audio_data is None:
+                    self.fill_missing(out[filled:], play_time + filled / self.sample_rate)
+                    break
+                if self.stable_time is None and self.join_time is not None:
+                    self.note_playback(current_time)
+                next_seq = jitter_buffer.next_seq
+                if trace and next_seq is not None:
+                    # get() уже перешёл к следующему номеру
+                    seq = (next_seq - 1) % SEQ_MODULO
+                    trace.record(EVENT_PLAY, seq, int(self.capture_times[seq % len(self.capture_times)] * 1000000),
+                                 len(audio_data), PACKET_AUDIO, self.key[2], depth=jitter_buffer.qsize(),
+                                 event_time=play_time + filled / self.sample_rate)
+                # Вид на данные пакета без копирования; по каналам потока (моно размножается на все каналы)
+                channels = self.stream_channels
+                audio_array = np.frombuffer(audio_data, dtype=np.int16)
+                carry = self.carry = audio_array[:len(audio_array) // channels * channels].reshape(-1, channels)
+                self.carry_pos = 0
+                continue
+            count = min(frames - filled, len(carry) - self.carry_pos)
+            block = carry[self.carry_pos:self.carry_pos + count]
+            out[filled:filled + count] = block
+            # Уровень для индикатора
+            level = max(level, int(np.abs(block).max()))
+            self.carry_pos += count
+            filled += count
+        self.last_audio_level = level / 32768.0
+        return self.last_audio_level
+
+    def fill_missing(self, out, play_time):
+        """Данных нет: тишина на время ожидания повтора, комфортный шум во время DTX, иначе тишина и опустошение"""
+        frames = len(out)
+        if self.jitter_buffer.waiting:
+            # Ждём повтор пропущенного пакета - это не опустошение буфера
+            self.nack_wait_time += frames / self.sample_rate
+            out.fill(0)
+            return
+        if self.in_dtx and COMFORT_NOISE:
+            self.fill_comfort_noise(out, frames)
+            return
+        out.fill(0)
+        # Первое заполнение буфера (до первого сыгранного пакета) - не опустошение
+        if self.jitter_buffer.playing and not self.in_dtx:
+            self.underruns += 1
+            if self.trace:
+                self.trace.record(EVENT_PLAY, stream=self.key[2], size=frames, reason=REASON_UNDERRUN,
+                                  event_time=play_time)
+
+    def fill_comfort_noise(self, out, frames):
+        """Комфортный шум на уровне из последнего описателя тишины"""
+        table = COMFORT_NOISE_TABLE
+        if frames > len(table):
+            out.fill(0)
+            return
+        pos = self.comfort_noise_pos
+        if pos + frames > len(table):
+            pos = 0
+        np.multiply(table[pos:pos + frames, :out.shape[1]], self.comfort_noise_level,
+                    out=out, casting='unsafe')
+        self.comfort_noise_pos = pos + frames
+
+
+class Mixer:
+    """Сведение источников в один выход: усиление и насыщающее сложение в предвыделенных буферах"""
+
+    def __init__(self):
+        self._acc = None
+
+    def mix(self, sources, outdata, current_time, dac_time=None):
+        """Заполнить outdata (int16). Возвращает уровень для индикатора"""
+        if len(sources) == 1 and sources[0].gain == 1.0 and not sources[0].muted:
+            # Один источник без усиления - прямо в буфер устройства, как раньше
+            return sources[0].read_into(outdata, current_time, dac_time)
+        frames, channels = outdata.shape
+        if self._acc is None or len(self._acc) < frames or self._acc.shape[1] != channels:
+            # Выделение только при росте блока (при blocksize=0 размер меняется от вызова к вызову)
+            self._acc = np.empty(outdata.shape, dtype=np.float32)
+            self._scaled = np.empty(outdata.shape, dtype=np.float32)
+            self._scratch = np.empty(outdata.shape, dtype=np.int16)
+        acc, scaled, scratch = self._acc[:frames], self._scaled[:frames], self._scratch[:frames]
+        acc.fill(0)
+        level = 0.0
+        for source in sources:
+            if source.muted:
+                continue
+            source_level = source.read_into(scratch, current_time, dac_time)
+            np.multiply(scratch, np.float32(source.gain), out=scaled)
+            acc += scaled
+            level = max(level, source_level * source.gain)
+        # Насыщение вместо переполнения int16
+        np.clip(acc, -32768, 32767, out=acc)
+        np.copyto(outdata, acc, casting='unsafe')
+        return min(level, 1.0)
+
+
+class ResampledOutput:
+    """Выход на родной частоте устройства: сведение целыми чанками потока (границы пакетов не режутся,
+    иначе блок устройства забегает в ещё не пришедший пакет), полифазное преобразование и FIFO,
+    из которого берётся ровно столько кадров, сколько просит устройство"""
+
+    def __init__(self, stream_rate, device_rate, channels, chunk):
+        self.stream_rate = stream_rate
+        self.device_rate = device_rate
+        self.resampler = PolyphaseResampler(stream_rate, device_rate, channels, chunk)
+        self._mixed = np.zeros((chunk, channels), dtype=np.int16)
+        self._fifo = np.zeros((2 * self.converted_frames(chunk), channels), dtype=np.float32)
+        self._fill = 0
+        self._residue = 0.0  # Сглаженный остаток FIFO после блока устройства, кадров
+        self.calls = 0
+
+    def converted_frames(self, frames):
+        """Верхняя граница кадров устройства из frames кадров потока"""
+        return frames * self.resampler.up // self.resampler.down + 2
+
+    def render(self, mixer, sources, outdata, current_time, dac_time=None):
+        """Заполнить outdata (int16, частота устройства). Возвращает уровень для индикатора"""
+        frames, channels = outdata.shape
+        # Чанк первого источника: после смены профиля на лету блок сведения следует за пакетами
+        chunk = sources[0].chunk_size if sources else len(self._mixed)
+        if chunk > len(self._mixed):
+            self._mixed = np.zeros((chunk, channels), dtype=np.int16)
+        if frames + self.converted_frames(chunk) > len(self._fifo):
+            # Блок устройства больше запаса (blocksize=0) - FIFO растёт один раз
+            fifo = np.zeros((frames + self.converted_frames(chunk), channels), dtype=np.float32)
+            fifo[:self._fill] = self._fifo[:self._fill]
+            self._fifo = fifo
+        mixed = self._mixed[:chunk]
+        level = 0.0
+        while self._fill < frames:
+            # Кадры, уже лежащие в FIFO, прозвучат раньше сведённых сейчас
+            block_time = None if dac_time is None else dac_time + self._fill / self.device_rate
+            level = max(level, mixer.mix(sources, mixed, current_time, block_time))
+            converted = self.resampler.process(mixed)
+            self._fifo[self._fill:self._fill + len(converted)] = converted
+            self._fill += len(converted)
+        block = self._fifo[:frames]
+        np.clip(block, -32768, 32767, out=block)
+        np.rint(block, out=block)
+        np.copyto(outdata, block, casting='unsafe')
+        self._fill -= frames
+        self._fifo[:self._fill] = self._fifo[frames:frames + self._fill]
+        self._residue += (self._fill - self._residue) / 16
+        self.calls += 1
+        return level
+
+    def added_latency(self):
+        """Задержка преобразования, с: групповая задержка фильтра плюс средний остаток FIFO"""
+        return self.resampler.delay + self._residue / self.device_rate
+
+    def report(self):
+        """Строка для статистики: частоты, добавленная задержка и стоимость на чанк потока"""
+        return (f"SRC {self.stream_rate}→{self.device_rate} Гц: +{self.added_latency() * 1000:.1f}мс, "
+                f"{self.resampler.cost_us():.0f}мкс/чанк")
@@ -0,0 +1,208 @@
+import os
+import sys
+import mmap
+import time
+import wave
+import struct
+import argparse
+
+# Кольцевой файл записи: заголовок | аудио (int16 кадры) | журнал прихода пакетов
+RING_MAGIC = b'SARING01'
+RING_HEADER = struct.Struct('<8sIIIIIQQ')  # magic, rate, channels, width, cap_frames, log_cap, frames, log_count
+RING_HEADER_SIZE = 64
+LOG_RECORD = struct.Struct('<dQII')  # время прихода, позиция (кадр), кадров, seq
+SAMPLE_WIDTH = 2  # int16
+
+DEFAULT_RECORD_FILE = 'StreamAudio_record.ring'
+DEFAULT_RECORD_SECONDS = 300  # Последние 5 минут
+MIN_PACKET_FRAMES = 64  # Самый маленький ожидаемый пакет - определяет размер журнала
+
+
+class RollingRecorder:
+    """Кольцевая запись принятого аудио в memory-mapped файл фиксированного размера"""
+
+    def __init__(self, path, sample_rate, channels, seconds=DEFAULT_RECORD_SECONDS):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_bytes = channels * SAMPLE_WIDTH
+        self.capacity_frames = int(sample_rate * seconds)
+        self.log_capacity = max(1, self.capacity_frames // MIN_PACKET_FRAMES)
+
+        self.audio_offset = RING_HEADER_SIZE
+        self.audio_size = self.capacity_frames * self.frame_bytes
+        self.log_offset = self.audio_offset + self.audio_size
+        file_size = self.log_offset + self.log_capacity * LOG_RECORD.size
+
+        # Файл создаётся заранее целиком - в приёмном пути только запись в память
+        with open(path, 'wb') as f:
+            f.truncate(file_size)
+        self._file = open(path, 'r+b')
+        self._mm = mmap.mmap(self._file.fileno(), file_size)
+
+        self.frames_written = 0
+        self.log_count = 0
+        self._write_header()
+
+    def _write_header(self):
+        RING_HEADER.pack_into(self._mm, 0, RING_MAGIC, self.sample_rate, self.channels,
+                              SAMPLE_WIDTH, self.capacity_frames, self.log_capacity,
+                              self.frames_written, self.log_count)
+
+    def append(self, data, arrival_time, seq=0):
+        """Дописать пакет в кольцо (вызывается из потока приёма, без выделения буферов)"""
+        nbytes = len(data) - len(data) % self.frame_bytes
+        if nbytes <= 0:
+            return
+        frames = nbytes // self.frame_bytes
+        mm = self._mm
+
+        start = (self.frames_written % self.capacity_frames) * self.frame_bytes
+        first = min(nbytes, self.audio_size - start)
+        pos = self.audio_offset + start
+        if first == nbytes and nbytes == len(data):
+            mm[pos:pos + nbytes] = data
+        else:
+            # Перенос через границу кольца (или обрезка неполного кадра)
+            view = memoryview(data)
+            mm[pos:pos + first] = view[:first]
+            if first < nbytes:
+                mm[self.audio_offset:self.audio_offset + nbytes - first] = view[first:nbytes]
+
+        LOG_RECORD.pack_into(mm, self.log_offset + (self.log_count % self.log_capacity) * LOG_RECORD.size,
+                             arrival_time, self.frames_written, frames, seq)
+        self.frames_written += frames
+        self.log_count += 1
+        # Счётчики пишем последними, чтобы экспорт не читал незаписанные данные
+        struct.pack_into('<QQ', mm, RING_HEADER.size - 16, self.frames_written, self.log_count)
+
+    def close(self):
+        """Закрыть файл записи (содержимое остаётся на диске для экспорта)"""
+        try:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+        except (ValueError, OSError):
+            pass
+
+
+class RingSnapshot:
+    """Снимок кольцевого файла для экспорта (только чтение)"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        (magic, self.sample_rate, self.channels, self.sample_width, self.capacity_frames,
+         self.log_capacity, self.frames_written, self.log_count) = RING_HEADER.unpack_from(self.data, 0)
+        if magic != RING_MAGIC:
+            raise ValueError(f"{path}: не является файлом записи StreamAudio")
+        self.frame_bytes = self.channels * self.sample_width
+        self.audio_offset = RING_HEADER_SIZE
+        self.log_offset = self.audio_offset + self.capacity_frames * self.frame_bytes
+
+    def oldest_frame(self):
+        return max(0, self.frames_written - self.capacity_frames)
+
+    def packet_log(self):
+        """Записи журнала прихода в хронологическом порядке, только для доступного аудио"""
+        count = min(self.log_count, self.log_capacity)
+        first = self.log_count - count
+        oldest = self.oldest_frame()
+        records = []
+        for i in range(first, self.log_count):
+            offset = self.log_offset + (i % self.log_capacity) * LOG_RECORD.size
+            arrival, frame_pos, frames, seq = LOG_RECORD.unpack_from(self.data, offset)
+            if frame_pos >= oldest:
+                records.append((arrival, frame_pos, frames, seq))
+        return records
+
+    def frame_range(self, start_time=None, end_time=None):
+        """Диапазон кадров [start, end) по времени прихода пакетов"""
+        records = self.packet_log()
+        if not records:
+            return self.frames_written, self.frames_written
+        start = records[0][1]
+        end = records[-1][1] + records[-1][2]
+        if start_time is not None:
+            start = next((r[1] for r in records if r[0] >= start_time), end)
+        if end_time is not None:
+            end = next((r[1] for r in records if r[0] > end_time), end)
+        return start, max(start, end)
+
+    def read_frames(self, start, end):
+        """PCM данные кадров [start, end) с учётом переноса через границу кольца"""
+        start = max(start, self.oldest_frame())
+        end = min(end, self.frames_written)
+        if end <= start:
+            return b''
+        chunks = []
+        while start < end:
+            ring_pos = start % self.capacity_frames
+            count = min(end - start, self.capacity_frames - ring_pos)
+            offset = self.audio_offset + ring_pos * self.frame_bytes
+            chunks.append(self.data[offset:offset + count * self.frame_bytes])
+            start += count
+        return b''.join(chunks)
+
+
+def export_wav(ring_path, wav_path, start_time=None, end_time=None):
+    """Экспорт временного диапазона из кольцевого файла в WAV. Возвращает длительность в секундах"""
+    snapshot = RingSnapshot(ring_path)
+    start, end = snapshot.frame_range(start_time, end_time)
+    pcm = snapshot.read_frames(start, end)
+    with wave.open(wav_path, 'wb') as wav:
+        wav.setnchannels(snapshot.channels)
+        wav.setsampwidth(snapshot.sample_width)
+        wav.setframerate(snapshot.sample_rate)
+        wav.writeframes(pcm)
+    return len(pcm) / snapshot.frame_bytes / snapshot.sample_rate
+
+
+def export_log(ring_path, csv_path, start_time=None, end_time=None):
+    """Экспорт журнала прихода пакетов в CSV"""
+    snapshot = RingSnapshot(ring_path)
+    records = [r for r in snapshot.packet_log()
+               if (start_time is None or r[0] >= start_time) and (end_time is None or r[0] <= end_time)]
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write("arrival_time,frame_pos,frames,seq\n")
+        for arrival, frame_pos, frames, seq in records:
+            f.write(f"{arrival:.6f},{frame_pos},{frames},{seq}\n")
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт кольцевой записи клиента StreamAudio в WAV")
+    parser.add_argument('ring', nargs='?', default=DEFAULT_RECORD_FILE, help="Файл кольцевой записи")
+    parser.add_argument('output', help="Выходной WAV файл")
+    parser.add_argument('--last', type=float, help="Экспортировать последние N секунд")
+    parser.add_argument('--start', type=float, help="Начало: секунд назад (или unix-время)")
+    parser.add_argument('--end', type=float, help="Конец: секунд назад (или unix-время)")
+    parser.add_argument('--log', help="Дополнительно сохранить журнал прихода пакетов в CSV")
+    args = parser.parse_args()
+
+    now = time.time()
+
+    def to_time(value):
+        # Небольшие значения - это "секунд назад", большие - абсолютное unix-время
+        if value is None:
+            return None
+        return value if value > 1e9 else now - value
+
+    start_time = to_time(args.start)
+    end_time = to_time(args.end)
+    if args.last is not None:
+        start_time, end_time = now - args.last, None
+
+    if not os.path.exists(args.ring):
+        print(f"[ERROR] Файл записи не найден: {args.ring}")
+        sys.exit(1)
+
+    duration = export_wav(args.ring, args.output, start_time, end_time)
+    print(f"Экспортировано {duration:.1f} с в {args.output}")
+    if args.log:
+        count = export_log(args.ring, args.log, start_time, end_time)
+        print(f"Журнал пакетов ({count} записей) сохранён в {args.log}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,39 @@
+import math
 import socket
 import time
 import threading
+import functools
 import numpy as np
 import tkinter as tk
 from tkinter import ttk, messagebox
 import queue
 
-try:
-    import sounddevice as sd
-    SOUNDDEVICE_AVAILABLE = True
-except ImportError:
-    SOUNDDEVICE_AVAILABLE = False
+# Первым из модулей проекта: отсчёт времени запуска
+from StreamAudio_Devices import STARTUP, DeviceCatalog, load_sounddevice, sounddevice_available
+from StreamAudio_Protocol import (PACKET_AUDIO, PACKET_SID, PACKET_REPORT, PACKET_NACK, PACKET_SYNC, PACKET_JOIN,
+                                  FLAG_RETRANSMIT, FLAG_JOIN, DEFAULT_MTU, MIN_MTU, HEADER_SIZE, pack_header,
+                                  pack_header_into, build_sid, build_format, build_sync_reply, parse_header,
+                                  parse_report, parse_nack, parse_join, mark_retransmit, fragment_packet)
+from StreamAudio_Codec import (STREAM_VARIANTS, DEFAULT_VARIANT, ENCODING_NAMES, StreamEncoder,
+                               variant_format, bitrate_kbps, native_rate)
+from StreamAudio_Feedback import (ClientHealthTable, AdaptiveController, Retransmitter,
+                                  LOSS_TARGET, JITTER_TARGET, HISTORY_SIZE, ADAPT_INTERVAL, RETRANSMIT_BURST)
+from StreamAudio_PacketPool import PacketPool, POOL_MARGIN
+from StreamAudio_DSP import DSPChain, HighPass, LoudnessNormalizer, Gain, Limiter
+from StreamAudio_Simulcast import Simulcast, parse_tiers
+from StreamAudio_Profiler import CallbackProfiler
+from StreamAudio_Socket import SocketTuning, DSCP_CLASSES, DEFAULT_DSCP, SEND_BUFFER_TIME, socket_buffer_size
+from StreamAudio_Latency import MarkerInjector
+from StreamAudio_SharedMemory import (PacketRing, SERVER_TRANSPORTS, TRANSPORT_MULTICAST, TRANSPORT_SHM,
+                                      ring_name)
+from StreamAudio_Trace import (TraceWriter, DEFAULT_SERVER_TRACE, EVENT_SEND, EVENT_DROP, EVENT_CALLBACK,
+                               REASON_QUEUE_FULL, REASON_RETRANSMIT, REASON_XRUN)
+
+# Сам sounddevice (и PortAudio) загружается в фоне или при старте потока
+SOUNDDEVICE_AVAILABLE = sounddevice_available()
+
+# Фрагменты отправляем заголовком и видом на данные пакета без склейки (на Windows sendmsg нет)
+SENDMSG_AVAILABLE = hasattr(socket.socket, 'sendmsg')
 
 # КОНСИСТЕНТНЫЕ НАСТРОЙКИ - ДОЛЖНЫ СОВПАДАТЬ С КЛИЕНТОМ
 # Можно настроить через GUI
@@ -21,6 +44,24 @@ FORMAT = 'int16'  # Единый формат
 MULTICAST_GROUP = '224.1.1.1'
 PORT = 5007
 
+# Подавление тишины (DTX): в меню и на загрузках не шлём пакеты нулей
+DTX_THRESHOLD = 0.001  # Пиковый уровень (доля от полной шкалы), ниже которого чанк считается тишиной
+DTX_HANGOVER = 0.3  # Секунд тишины до начала подавления (не режем паузы в речи)
+DTX_KEEPALIVE = 0.5  # Интервал описателей тишины во время подавления
+
+FORMAT_INTERVAL = 1.0  # Период объявления формата потока для клиентов
+
+# Ключевые слова устройств системного захвата (Stereo Mix и виртуальные кабели)
+STEREO_MIX_KEYWORDS = ('stereo mix', 'what you hear', 'waveout mix',
+                       'mix stereo', 'system sounds', 'voicemeeter', 'cable')
+
+# Смена профиля на лету: новый поток захвата открывается до закрытия старого
+CAPTURE_SWITCH_POLL_MS = 20
+CAPTURE_SWITCH_TIMEOUT = 1.0  # Старый поток закрывается не позже, даже если новый молчит
+
+# Трасса пакетов для разбора проблем (анализ - StreamAudio_Trace.py)
+TRACE_FILE = DEFAULT_SERVER_TRACE
+
 # Профили задержки
 LATENCY_PROFILES = {
     'Минимальная': {'chunk': 128, 'rate': 44100},
@@ -34,11 +75,35 @@ class GameAudioStreamServer:
         self.root = root
         self.running = False
         self.stream = None
+        self.capture_generation = 0  # Номер последнего открытого потока захвата
+        self.active_capture = 0  # Номер потока, чьи блоки идут в отправку
         self.audio_queue = queue.Queue(maxsize=2)  # Ограничиваем очередь для минимальной задержки
         self.last_audio_level = 0.0
         self.dropped_packets = 0
         self.chunk_size = DEFAULT_CHUNK
         self.sample_rate = DEFAULT_RATE
+        self.stream_variant = DEFAULT_VARIANT
+        self.pending_variant = None
+        self.profile_switch_time = 0.0  # Последняя смена профиля по рекомендациям клиентов
+        self.health = ClientHealthTable()
+        # Обработка между захватом и отправкой; процессоры хранят состояние между перенастройками
+        self.dsp = DSPChain(DEFAULT_RATE)
+        self.highpass = HighPass()
+        self.normalizer = LoudnessNormalizer()
+        self.gain_stage = Gain()
+        self.limiter = Limiter()
+        self.silent_time = 0.0
+        self.last_sid_time = 0.0
+        self.suppressed_packets = 0
+        self.simulcast = None
+        self.trace = None
+        self.injector = None  # MarkerInjector: маркер для замера задержки на клиенте
+        self.ring = None  # PacketRing: поток для клиентов на этой же машине через общую память
+        self.multicast_enabled = True
+        self.capture_age = 0.0  # Сколько назад по оценке PortAudio захвачен первый кадр блока (0 - неизвестно)
+        self.profiler = CallbackProfiler(DEFAULT_RATE)
+        self.devices = DeviceCatalog()
+        self.device_info = {}
         self.setup_gui()
         self.refresh_devices()
         
@@ -106,17 +171,82 @@ class GameAudioStreamServer:
         tk.Label(settings_row, text="Профиль:", 
                 font=('Segoe UI', 8), bg=bg_color, fg=fg_color).pack(side=tk.LEFT, padx=(0, 5))
         self.latency_profile_var = tk.StringVar(value='Низкая')
+        self.active_profile = self.latency_profile_var.get()  # Профиль, который сейчас применён
         self.latency_combo = ttk.Combobox(settings_row, textvariable=self.latency_profile_var,
                                      values=list(LATENCY_PROFILES.keys()), state="readonly", width=12)
         self.latency_combo.pack(side=tk.LEFT, padx=(0, 15))
         self.latency_combo.bind('<<ComboboxSelected>>', self.on_latency_profile_change)
         
+        # Вариант потока: моно/пониженная частота/µ-law для экономии полосы
+        tk.Label(settings_row, text="Формат:", 
+                font=('Segoe UI', 8), bg=bg_color, fg=fg_color).pack(side=tk.LEFT, padx=(0, 5))
+        self.variant_var = tk.StringVar(value=self.stream_variant)
+        self.variant_combo = ttk.Combobox(settings_row, textvariable=self.variant_var,
+                                          values=list(STREAM_VARIANTS.keys()), state="readonly", width=18)
+        self.variant_combo.pack(side=tk.LEFT, padx=(0, 15))
+        self.variant_combo.bind('<<ComboboxSelected>>', self.on_variant_change)
+        
         self.settings_info_var = tk.StringVar()
         self.update_settings_info()
         settings_label = tk.Label(settings_row, textvariable=self.settings_info_var, 
                                   font=('Consolas', 7), bg=bg_color, fg='#a6e3a1')
         settings_label.pack(side=tk.LEFT)
+
+        # Подавление тишины можно переключать и во время стрима
+        self.dtx_var = tk.BooleanVar(value=True)
+        self.dtx_enabled = True
+        dtx_check = tk.Checkbutton(settings_row, text="🔇 Подавлять тишину (DTX)",
+                                   variable=self.dtx_var, command=self.on_dtx_change,
+                                   font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                   selectcolor='#313244', activebackground=bg_color,
+                                   activeforeground=fg_color)
+        dtx_check.pack(side=tk.RIGHT)
+        
+        # Адаптация формата по отчётам клиентов (выбранный формат - потолок)
+        self.adaptive_var = tk.BooleanVar(value=False)
+        adaptive_check = tk.Checkbutton(settings_row, text="📶 Авто-битрейт",
+                                        variable=self.adaptive_var,
+                                        font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                        selectcolor='#313244', activebackground=bg_color,
+                                        activeforeground=fg_color)
+        adaptive_check.pack(side=tk.RIGHT, padx=(0, 5))
+        
+        # Профиль задержки по рекомендациям клиентов (чанк, который устраивает худшего)
+        self.auto_profile_var = tk.BooleanVar(value=False)
+        auto_profile_check = tk.Checkbutton(settings_row, text="🎯 Профиль по клиентам",
+                                            variable=self.auto_profile_var,
+                                            font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                            selectcolor='#313244', activebackground=bg_color,
+                                            activeforeground=fg_color)
+        auto_profile_check.pack(side=tk.RIGHT, padx=(0, 5))
         
+        # Маркер для замера задержки от захвата до динамика (слышен - щелчок каждые 2 с)
+        self.marker_var = tk.BooleanVar(value=False)
+        marker_check = tk.Checkbutton(settings_row, text="📏 Маркер задержки",
+                                      variable=self.marker_var, command=self.on_marker_change,
+                                      font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                      selectcolor='#313244', activebackground=bg_color,
+                                      activeforeground=fg_color)
+        marker_check.pack(side=tk.RIGHT, padx=(0, 5))
+        
+        # Трасса каждого пакета в memory-mapped файл (по умолчанию выключена)
+        self.trace_var = tk.BooleanVar(value=False)
+        self.trace_check = tk.Checkbutton(settings_row, text="📝 Трасса",
+                                          variable=self.trace_var,
+                                          font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                          selectcolor='#313244', activebackground=bg_color,
+                                          activeforeground=fg_color)
+        self.trace_check.pack(side=tk.RIGHT, padx=(0, 5))
+        
+        # Захват на частоте микшера ОС (обычно 48 кГц): поток идёт на ней же, клиенты узнают её из формата
+        self.native_rate_var = tk.BooleanVar(value=True)
+        self.native_rate_check = tk.Checkbutton(settings_row, text="🎚 Родная частота",
+                                                variable=self.native_rate_var,
+                                                font=('Segoe UI', 8), bg=bg_color, fg=fg_color,
+                                                selectcolor='#313244', activebackground=bg_color,
+                                                activeforeground=fg_color)
+        self.native_rate_check.pack(side=tk.RIGHT, padx=(0, 5))
+
         # Компактная панель устройств и сети
         device_network_frame = ttk.LabelFrame(main_frame, text="🎤 Устройство и сеть", padding="8")
         device_network_frame.pack(fill=tk.X, pady=(0, 8))
@@ -149,8 +279,73 @@ class GameAudioStreamServer:
         port_entry = ttk.Entry(device_network_inner, textvariable=self.port_var, width=8)
         port_entry.grid(row=0, column=6, padx=2, pady=5)
         
+        # Пакеты больше MTU режутся на фрагменты (профиль "Высокая" - 4 КБ на чанк)
+        tk.Label(device_network_inner, text="MTU:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=0, column=7, sticky=tk.W, padx=(8, 5), pady=5)
+        self.mtu_var = tk.StringVar(value=str(DEFAULT_MTU))
+        mtu_entry = ttk.Entry(device_network_inner, textvariable=self.mtu_var, width=6)
+        mtu_entry.grid(row=0, column=8, padx=2, pady=5)
+        
+        # Simulcast: тот же захват дополнительными уровнями, "группа[:порт] чанк вариант; ..."
+        tk.Label(device_network_inner, text="Уровни:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=1, column=0, sticky=tk.W, padx=(5, 5), pady=5)
+        self.tiers_var = tk.StringVar(value="")
+        self.tiers_entry = ttk.Entry(device_network_inner, textvariable=self.tiers_var)
+        self.tiers_entry.grid(row=1, column=1, columnspan=8, padx=5, sticky=tk.EW, pady=5)
+        
+        # Маркировка QoS (DSCP EF для управляемых коммутаторов) и интерфейс для multicast (пусто - по маршруту)
+        tk.Label(device_network_inner, text="QoS:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=2, column=0, sticky=tk.W, padx=(5, 5), pady=5)
+        self.qos_var = tk.StringVar(value=DEFAULT_DSCP)
+        self.qos_combo = ttk.Combobox(device_network_inner, textvariable=self.qos_var,
+                                      values=list(DSCP_CLASSES.keys()), state="readonly", width=10)
+        self.qos_combo.grid(row=2, column=1, padx=5, sticky=tk.W, pady=5)
+        
+        tk.Label(device_network_inner, text="Интерфейс:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=2, column=3, sticky=tk.W, padx=(15, 5), pady=5)
+        self.interface_var = tk.StringVar(value="")
+        self.interface_entry = ttk.Entry(device_network_inner, textvariable=self.interface_var, width=12)
+        self.interface_entry.grid(row=2, column=4, padx=2, pady=5)
+        
+        # Клиенты на этой же машине могут читать поток из общей памяти вместо loopback multicast
+        tk.Label(device_network_inner, text="Транспорт:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').grid(row=2, column=5, sticky=tk.W, padx=(15, 5), pady=5)
+        self.transport_var = tk.StringVar(value=TRANSPORT_MULTICAST)
+        self.transport_combo = ttk.Combobox(device_network_inner, textvariable=self.transport_var,
+                                            values=list(SERVER_TRANSPORTS), state="readonly", width=17)
+        self.transport_combo.grid(row=2, column=6, columnspan=3, padx=2, sticky=tk.W, pady=5)
+        
+        # Что ядро реально применило (буферы урезаются по wmem_max, приоритет может быть запрещён)
+        self.socket_info_var = tk.StringVar(value="")
+        tk.Label(device_network_inner, textvariable=self.socket_info_var, font=('Consolas', 7),
+                 bg='#313244', fg='#a6e3a1', anchor='w').grid(row=3, column=0, columnspan=9, sticky=tk.W, padx=5)
+        
         device_network_inner.columnconfigure(1, weight=1)
         
+        # Обработка звука перед отправкой - переключается во время стрима
+        dsp_frame = ttk.LabelFrame(main_frame, text="🎚 Обработка", padding="8")
+        dsp_frame.pack(fill=tk.X, pady=(0, 8))
+        
+        dsp_inner = tk.Frame(dsp_frame, bg='#313244')
+        dsp_inner.pack(fill=tk.X, padx=3, pady=3)
+        
+        self.highpass_var = tk.BooleanVar(value=False)
+        self.normalizer_var = tk.BooleanVar(value=False)
+        self.limiter_var = tk.BooleanVar(value=False)
+        for text, var in (("ФВЧ 80 Гц", self.highpass_var), ("Нормализация громкости", self.normalizer_var),
+                          ("Лимитер", self.limiter_var)):
+            tk.Checkbutton(dsp_inner, text=text, variable=var, command=self.on_dsp_change,
+                           font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4', selectcolor='#1e1e2e',
+                           activebackground='#313244', activeforeground='#cdd6f4').pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(dsp_inner, text="Усиление, дБ:", 
+                font=('Segoe UI', 8), bg='#313244', fg='#cdd6f4').pack(side=tk.LEFT, padx=(15, 5))
+        self.gain_var = tk.StringVar(value="0")
+        gain_spin = tk.Spinbox(dsp_inner, from_=-20, to=20, increment=1, width=4,
+                               textvariable=self.gain_var, command=self.on_dsp_change)
+        gain_spin.pack(side=tk.LEFT)
+        gain_spin.bind('<Return>', self.on_dsp_change)
+        
         # Компактная панель статуса и статистики в одну строку
         status_stats_frame = ttk.LabelFrame(main_frame, text="📡 Статус и статистика", padding="8")
         status_stats_frame.pack(fill=tk.X, pady=(0, 8))
@@ -170,6 +365,27 @@ class GameAudioStreamServer:
                                    anchor='w', padx=5)
         self.stats_label.grid(row=0, column=1, sticky=tk.W, padx=5, pady=3)
         
+        # Сводка по отчётам клиентов
+        self.clients_var = tk.StringVar(value="Клиенты: нет отчётов")
+        self.clients_label = tk.Label(status_stats_inner, textvariable=self.clients_var,
+                                      font=('Consolas', 8), bg='#313244', fg='#cdd6f4',
+                                      anchor='w', padx=5)
+        self.clients_label.grid(row=1, column=0, columnspan=2, sticky=tk.W, padx=5, pady=3)
+        
+        # Время callback захвата и стадий обработки относительно длительности чанка, xrun
+        self.dsp_var = tk.StringVar(value="")
+        self.dsp_label = tk.Label(status_stats_inner, textvariable=self.dsp_var,
+                                  font=('Consolas', 8), bg='#313244', fg='#cdd6f4',
+                                  anchor='w', padx=5)
+        self.dsp_label.grid(row=2, column=0, columnspan=2, sticky=tk.W, padx=5, pady=3)
+        
+        # Уровни simulcast: темп, битрейт, CPU кодирования и время отправки по каждому
+        self.tiers_stats_var = tk.StringVar(value="")
+        self.tiers_label = tk.Label(status_stats_inner, textvariable=self.tiers_stats_var,
+                                    font=('Consolas', 8), bg='#313244', fg='#cdd6f4',
+                                    anchor='w', justify=tk.LEFT, padx=5)
+        self.tiers_label.grid(row=3, column=0, columnspan=2, sticky=tk.W, padx=5, pady=3)
+        
         # Компактный индикатор уровня звука
         level_frame = ttk.LabelFrame(main_frame, text="🔊 Уровень звука", padding="8")
         level_frame.pack(fill=tk.X, pady=(0, 8))
@@ -199,7 +415,8 @@ class GameAudioStreamServer:
                                    bg='#a6e3a1', fg='#1e1e2e',
                                    activebackground='#94e2d5', activeforeground='#1e1e2e',
                                    relief=tk.FLAT, padx=20, pady=10,
-                                   cursor='hand2', width=18)
+                                   cursor='hand2', width=18,
+                                   state=tk.DISABLED)  # Включается после свежего опроса PortAudio
         self.start_btn.pack(side=tk.LEFT, padx=(0, 10))
         
         self.stop_btn = tk.Button(button_container, text="⏹️ Остановить", 
@@ -213,76 +430,187 @@ class GameAudioStreamServer:
     
     def update_settings_info(self):
         """Обновить информацию о настройках"""
-        info_text = f"{self.sample_rate}Hz | {CHANNELS}ch | {FORMAT} | chunk:{self.chunk_size}"
+        rate, channels, encoding, chunk = variant_format(self.stream_variant, self.sample_rate, self.chunk_size)
+        info_text = (f"{rate}Hz | {channels}ch | {ENCODING_NAMES[encoding]} | chunk:{chunk} | "
+                     f"{bitrate_kbps(rate, channels, encoding):.0f} кбит/с")
         self.settings_info_var.set(info_text)
     
+    def on_variant_change(self, event=None):
+        """Обработка изменения варианта потока"""
+        if self.variant_var.get() in STREAM_VARIANTS:
+            self.stream_variant = self.variant_var.get()
+            self.update_settings_info()
+    
     def on_latency_profile_change(self, event=None):
-        """Обработка изменения профиля задержки"""
+        """Обработка изменения профиля задержки (во время стрима - без остановки)"""
         profile = self.latency_profile_var.get()
         if profile in LATENCY_PROFILES:
             config = LATENCY_PROFILES[profile]
+            if self.running:
+                # На родной частоте устройства частота профиля не используется
+                if not self.native_rate_var.get() and config['rate'] != self.sample_rate:
+                    messagebox.showerror("Ошибка", "Смена частоты - только после остановки стрима")
+                    # В списке остаётся профиль, который на самом деле работает
+                    self.latency_profile_var.set(self.active_profile)
+                    return
+                if config['chunk'] != self.chunk_size:
+                    self.switch_capture_chunk(config['chunk'])
+                    # Буфер отправки следует за темпом пакетов нового профиля
+                    self.tuning.set_buffer(self.sock, 'SO_SNDBUF', self.send_buffer_size(config['chunk']))
+                    self.socket_info_var.set(self.tuning.report())
             self.chunk_size = config['chunk']
-            self.sample_rate = config['rate']
+            if not self.running:
+                self.sample_rate = config['rate']
+            self.active_profile = profile
             self.update_settings_info()
     
+    def send_buffer_size(self, chunk):
+        """Буфер отправки: темп основного потока с пачкой повторов плюс уровни simulcast"""
+        return (socket_buffer_size(chunk, self.sample_rate, SEND_BUFFER_TIME, RETRANSMIT_BURST, self.mtu) +
+                self.tier_send_buffer)
+    
+    def open_capture_stream(self, chunk):
+        """Открыть и запустить захват с блоком chunk. У каждого потока свой номер и пул пакетов под его размер"""
+        self.capture_generation += 1
+        history = self.retransmitter.history
+        pool = PacketPool(HISTORY_SIZE + POOL_MARGIN, chunk, CHANNELS,
+                          in_use=lambda slot: history.holds(slot.seq, slot.packet))
+        sd = load_sounddevice()
+        stream = sd.InputStream(
+            device=self.device_index,
+            channels=CHANNELS,
+            samplerate=self.sample_rate,
+            blocksize=chunk,  # Настраиваемый размер для баланса задержки/качества
+            callback=functools.partial(self.audio_callback, generation=self.capture_generation, pool=pool),
+            dtype=FORMAT,  # Используем int16 напрямую
+            latency='low'  # Минимальная задержка устройства
+        )
+        stream.start()
+        return stream
+    
+    def switch_capture_chunk(self, chunk):
+        """Новый размер чанка без остановки: старый захват пишет, пока новый не выдаст первый блок.
+        Отправка объявит новый формат перед первым пакетом нового размера, клиенты пересоберут блоки"""
+        old_stream = self.stream
+        try:
+            self.stream = self.open_capture_stream(chunk)
+        except Exception as e:
+            # Драйвер не даёт открыть устройство дважды - короткий разрыв вместо перекрытия
+            print(f"[WARNING] Перекрытие потоков захвата недоступно ({e}), переоткрываем устройство")
+            old_stream.stop()
+            old_stream.close()
+            old_stream = None
+            self.stream = self.open_capture_stream(chunk)
+        print(f"[DEBUG] Профиль на лету: chunk {self.chunk_size} -> {chunk}")
+        if old_stream is not None:
+            self.root.after(CAPTURE_SWITCH_POLL_MS, self.finish_capture_switch, old_stream,
+                            self.capture_generation, time.time() + CAPTURE_SWITCH_TIMEOUT)
+    
+    def finish_capture_switch(self, old_stream, generation, deadline):
+        """Закрыть старый поток захвата, когда новый начал писать (в GUI потоке)"""
+        if self.active_capture < generation and time.time() < deadline and self.running:
+            self.root.after(CAPTURE_SWITCH_POLL_MS, self.finish_capture_switch, old_stream, generation, deadline)
+            return
+        try:
+            old_stream.stop()
+            old_stream.close()
+        except Exception as e:
+            print(f"[WARNING] Ошибка закрытия старого потока захвата: {e}")
+
+    def on_dtx_change(self):
+        """Включение/выключение подавления тишины"""
+        self.dtx_enabled = self.dtx_var.get()
+        self.silent_time = 0.0
+
+    def on_marker_change(self):
+        """Включение/выключение маркера задержки (можно во время стрима)"""
+        self.injector = MarkerInjector(self.sample_rate) if self.marker_var.get() else None
+
+    def on_dsp_change(self, event=None):
+        """Пересобрать цепочку обработки (можно во время стрима)"""
+        try:
+            gain_db = float(self.gain_var.get())
+        except ValueError:
+            gain_db = 0.0
+        self.gain_stage.set_db(gain_db)
+        stages = []
+        if self.highpass_var.get():
+            stages.append(self.highpass)
+        if self.normalizer_var.get():
+            stages.append(self.normalizer)
+        if gain_db != 0.0:
+            stages.append(self.gain_stage)
+        if self.limiter_var.get():
+            stages.append(self.limiter)
+        self.dsp.configure(stages, rate=self.sample_rate)
+
     def refresh_devices(self):
-        """Обновить список устройств с поиском Stereo Mix"""
+        """Обновить список устройств с поиском Stereo Mix: сразу из кэша, опрос PortAudio - в фоне"""
         if not SOUNDDEVICE_AVAILABLE:
             return
+        if not self.device_info:
+            snapshot = self.devices.cached()
+            if snapshot is not None:
+                self.show_devices(snapshot, None, True)
+        self.devices.refresh_async(lambda snapshot, error, changed:
+                                   self.root.after(0, self.show_devices, snapshot, error, changed))
+    
+    def show_devices(self, snapshot, error, changed):
+        """Заполнить список устройств захвата из снимка каталога (из кэша или после опроса)"""
+        if error is not None:
+            messagebox.showerror("Ошибка", f"Не удалось получить устройства: {error}")
+            return
+        STARTUP.mark("список устройств" if self.devices.fresh else "список устройств из кэша")
+        if self.devices.fresh and not self.running:
+            # Список из кэша сверяется со свежим при старте - до опроса старт недоступен
+            self.start_btn.config(state=tk.NORMAL)
+        if not changed:
+            return
             
         devices = []
         self.device_info = {}
+        device_list = snapshot['devices']
         
-        try:
-            device_list = sd.query_devices()
-            
-            # Сначала ищем устройства для системного захвата
-            stereo_mix_devices = self.find_stereo_mix_devices(device_list)
-            devices.extend(stereo_mix_devices)
-            
-            # Затем обычные микрофоны
-            for i, device in enumerate(device_list):
-                if device['max_input_channels'] > 0:
-                    device_name = f"{i}: {device['name']}"
-                    # Пропускаем если уже добавили как Stereo Mix
-                    if not any(device_name in stereo_mix for stereo_mix in stereo_mix_devices):
-                        devices.append(device_name)
-                        self.device_info[device_name] = {
-                            'index': i,
-                            'device': device,
-                            'type': 'microphone'
-                        }
-            
-            self.device_combo['values'] = devices
-            
-            # Автоматически выбираем Stereo Mix если найден
-            if stereo_mix_devices:
-                self.device_combo.set(stereo_mix_devices[0])
-            elif devices:
-                self.device_combo.set(devices[0])
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось получить устройства: {e}")
+        # Сначала ищем устройства для системного захвата
+        stereo_mix_devices = self.find_stereo_mix_devices(device_list)
+        devices.extend(stereo_mix_devices)
+        
+        # Затем обычные микрофоны
+        for device in device_list:
+            if device['max_input_channels'] > 0:
+                device_name = f"{device['index']}: {device['name']}"
+                # Пропускаем если уже добавили как Stereo Mix
+                if not any(device_name in stereo_mix for stereo_mix in stereo_mix_devices):
+                    devices.append(device_name)
+                    self.device_info[device_name] = {
+                        'index': device['index'],
+                        'device': device,
+                        'type': 'microphone'
+                    }
+        
+        self.device_combo['values'] = devices
+        
+        # Выбор пользователя сохраняем, иначе автоматически выбираем Stereo Mix если найден
+        if self.device_var.get() in self.device_info:
+            return
+        if stereo_mix_devices:
+            self.device_combo.set(stereo_mix_devices[0])
+        elif devices:
+            self.device_combo.set(devices[0])
     
     def find_stereo_mix_devices(self, device_list):
         """Найти устройства для захвата системного звука"""
         stereo_mix_devices = []
         
-        for i, device in enumerate(device_list):
+        for device in device_list:
             if device['max_input_channels'] > 0:
                 device_name_lower = device['name'].lower()
                 
-                # Ключевые слова для системного захвата
-                stereo_mix_keywords = [
-                    'stereo mix', 'what you hear', 'waveout mix',
-                    'mix stereo', 'system sounds', 'voicemeeter', 'cable'
-                ]
-                
-                if any(keyword in device_name_lower for keyword in stereo_mix_keywords):
-                    device_name = f"{i}: {device['name']} 🔊 СИСТЕМНЫЙ ЗВУК"
+                if any(keyword in device_name_lower for keyword in STEREO_MIX_KEYWORDS):
+                    device_name = f"{device['index']}: {device['name']} 🔊 СИСТЕМНЫЙ ЗВУК"
                     stereo_mix_devices.append(device_name)
                     self.device_info[device_name] = {
-                        'index': i,
+                        'index': device['index'],
                         'device': device,
                         'type': 'stereo_mix'
                     }
@@ -298,93 +626,252 @@ class GameAudioStreamServer:
                 return
             
             device_info = self.device_info[selected_device]
-            device_index = device_info['index']
+            # Список мог прийти из кэша: номер устройства сверяем со свежим опросом PortAudio
+            device = self.devices.resolve(device_info['index'], device_info['device']['name'])
+            if device is None:
+                messagebox.showerror("Ошибка", "Список устройств изменился - выберите устройство захвата заново")
+                return
+            self.device_index = device['index']
+            self.sample_rate = LATENCY_PROFILES[self.latency_profile_var.get()]['rate']
+            if self.native_rate_var.get():
+                # Без пересчёта частоты микшером ОС и его буфера; чанк в кадрах тот же, что у профиля
+                self.sample_rate = native_rate(device, self.sample_rate)
+            self.update_settings_info()
             
-            # Настройка сети с минимальными буферами и оптимизациями
+            self.mtu = int(self.mtu_var.get())
+            if self.mtu < MIN_MTU:
+                messagebox.showerror("Ошибка", f"MTU должен быть не меньше {MIN_MTU} байт")
+                return
+            tiers = parse_tiers(self.tiers_var.get(), int(self.port_var.get()))
+            
+            self.tuning = SocketTuning(DSCP_CLASSES[self.qos_var.get()], interface=self.interface_var.get().strip())
+            self.tier_send_buffer = sum(socket_buffer_size(chunk, self.sample_rate, SEND_BUFFER_TIME, mtu=self.mtu)
+                                        for _, _, chunk, _ in tiers)
+            
+            # Настройка сети: буфер отправки под темп пакетов профиля, маркировка QoS
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 32768)  # Уменьшенный буфер отправки
-            # Включаем loopback для multicast (чтобы работало на одном компьютере)
-            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            # Явная привязка: на этот же сокет клиенты присылают отчёты
+            self.sock.bind(('', 0))
+            self.sock.settimeout(0.1)
+            self.tuning.apply_sender(self.sock, self.send_buffer_size(self.chunk_size))
+            transport = self.transport_var.get()
+            self.multicast_enabled = transport != TRANSPORT_SHM
+            if transport != TRANSPORT_MULTICAST:
+                # Отчёты клиентов из общей памяти приходят на этот же сокет - его порт записан в кольце
+                name = ring_name(int(self.port_var.get()))
+                self.ring = PacketRing.create(name, self.sock.getsockname()[1])
+                print(f"[DEBUG] Общая память: {name}, {self.ring.slots} слотов по {self.ring.slot_size} байт")
+            self.socket_info_var.set(self.tuning.report())
             
             multicast_addr = (self.group_var.get(), int(self.port_var.get()))
             print(f"[DEBUG] Сервер настроен: отправка на {multicast_addr[0]}:{multicast_addr[1]}")
+            print(f"[DEBUG] Сокет: {self.tuning.report()}")
             
             self.running = True
             self.packet_count = 0
+            self.fragment_count = 0
+            self.bytes_copied = 0
+            self.profiler = CallbackProfiler(self.sample_rate)
+            self.send_cpu_time = 0.0
+            self.send_time = 0.0
+            self.send_calls = 0
             self.dropped_packets = 0
+            self.seq = 0
+            self.suppressed_packets = 0
+            self.silent_time = 0.0
+            self.last_sid_time = 0.0
             self.start_time = time.time()
             self.last_audio_level = 0.0
+            self.capture_age = 0.0
+            self.on_marker_change()
+            self.encoder = StreamEncoder(self.stream_variant, self.sample_rate, CHANNELS, self.chunk_size)
+            self.pending_variant = None
+            self.health = ClientHealthTable()
+            self.controller = AdaptiveController(STREAM_VARIANTS.keys(), self.stream_variant)
+            self.retransmitter = Retransmitter()
+            self.on_dsp_change()
+            # Файл трассы создаётся заранее, в потоках только запись в память
+            self.trace = TraceWriter(TRACE_FILE) if self.trace_var.get() else None
+            # Дополнительные уровни кодируются в своём пуле потоков и не задерживают основной поток
+            self.simulcast = Simulcast(tiers, self.sample_rate, self.transmit, trace=self.trace) if tiers else None
+            if self.simulcast:
+                self.simulcast.start()
+                for tier in self.simulcast.tiers:
+                    print(f"[DEBUG] Уровень {tier.label()}")
             
             # Запуск потоков
             self.send_thread = threading.Thread(target=self.send_audio_data, daemon=True)
             self.send_thread.start()
+            self.feedback_thread = threading.Thread(target=self.receive_feedback, daemon=True)
+            self.feedback_thread.start()
             
             print(f"Starting audio capture: {self.sample_rate}Hz, {CHANNELS} channels, format: {FORMAT}, chunk: {self.chunk_size}")
             
-            # Запуск аудио захвата с правильными параметрами
-            # Используем меньший blocksize для минимальной задержки
-            self.stream = sd.InputStream(
-                device=device_index,
-                channels=CHANNELS,
-                samplerate=self.sample_rate,
-                blocksize=self.chunk_size,  # Настраиваемый размер для баланса задержки/качества
-                callback=self.audio_callback,
-                dtype=FORMAT,  # Используем int16 напрямую
-                latency='low'  # Минимальная задержка устройства
-            )
-            self.stream.start()
+            # Запуск аудио захвата; меньший blocksize - меньше задержка
+            self.stream = self.open_capture_stream(self.chunk_size)
             
             self.status_var.set("▶️ Активен")
             self.status_label.config(fg='#a6e3a1')  # Зеленый цвет для активного статуса
             self.start_btn.config(state=tk.DISABLED)
             self.stop_btn.config(state=tk.NORMAL)
-            self.latency_combo.config(state=tk.DISABLED)  # Блокируем изменение во время работы
+            self.variant_combo.config(state=tk.DISABLED)
+            self.tiers_entry.config(state=tk.DISABLED)
+            self.trace_check.config(state=tk.DISABLED)
+            self.native_rate_check.config(state=tk.DISABLED)
+            self.qos_combo.config(state=tk.DISABLED)
+            self.interface_entry.config(state=tk.DISABLED)
+            self.transport_combo.config(state=tk.DISABLED)
             
             # Статистика
             self.stats_thread = threading.Thread(target=self.update_stats, daemon=True)
             self.stats_thread.start()
             
         except Exception as e:
+            # Захват мог не открыться уже после запуска потоков, кольца и уровней - освобождаем всё,
+            # иначе повторный старт запустит второй набор потоков поверх заменённых сокета и кольца
+            self.release_stream()
             messagebox.showerror("Ошибка", f"Ошибка запуска: {e}")
     
-    def audio_callback(self, indata, frames, time, status):
-        """Callback для захвата аудио - оптимизирован для минимальной задержки"""
+    def audio_callback(self, indata, frames, time_info, status, generation=0, pool=None):
+        """Callback для захвата аудио - оптимизирован для минимальной задержки.
+        generation/pool - номер потока захвата и его пул пакетов (при смене профиля работают два потока)"""
         if self.running:
-            # Вычисляем уровень звука для индикатора (до конвертации)
-            self.last_audio_level = float(np.abs(indata).max()) / 32768.0
-            
-            # Используем tobytes() напрямую (indata уже numpy array)
-            audio_data = indata.tobytes()
-            
+            if generation != self.active_capture:
+                if generation < self.active_capture:
+                    return  # Старый поток: новый уже пишет, ждём закрытия
+                # Первый блок нового потока - с этого момента отправляется только он
+                self.active_capture = generation
+            started = time.perf_counter()
+            if time_info is not None:
+                age = time_info.currentTime - time_info.inputBufferAdcTime
+                self.capture_age = age if 0 < age < 1 else 0.0
+            self.capture_chunk(indata, frames, pool)
+            duration = time.perf_counter() - started
+            self.profiler.record(duration, frames, status)
+            trace = self.trace
+            if trace:
+                trace.record(EVENT_CALLBACK, timestamp_us=int(frames / self.sample_rate * 1000000), size=frames,
+                             reason=REASON_XRUN if status else 0, depth=self.audio_queue.qsize(),
+                             value=duration * 1000000)
+    
+    def capture_chunk(self, indata, frames, pool):
+        """Детектор тишины и запись чанка в пакет из пула"""
+        # Вычисляем уровень звука для индикатора (до конвертации)
+        self.last_audio_level = float(np.abs(indata).max()) / 32768.0
+        now = time.time()
+        timestamp_us = int(now * 1000000)
+        
+        # Детектор тишины: подавляем только устойчивую тишину (после DTX_HANGOVER); маркер не подавляем
+        if self.dtx_enabled and self.injector is None and self.last_audio_level < DTX_THRESHOLD:
+            self.silent_time += frames / self.sample_rate
+        else:
+            self.silent_time = 0.0
+        
+        if self.silent_time >= DTX_HANGOVER:
+            self.suppressed_packets += 1
+            # Периодический описатель тишины - клиент знает, что сервер жив
+            if now - self.last_sid_time >= DTX_KEEPALIVE:
+                self.last_sid_time = now
+                noise_level = float(np.sqrt(np.mean(np.square(indata, dtype=np.float32))))
+                self.enqueue_packet((PACKET_SID, timestamp_us, (noise_level, frames)))
+            return
+        self.last_sid_time = 0.0
+        
+        # Единственная копия отсчётов: из буфера PortAudio сразу в область данных пакета
+        slot = pool.acquire()
+        np.copyto(slot.samples, indata)
+        injector = self.injector
+        if injector:
+            # Маркер на сетке часов сервера: время захвата первого кадра блока
+            injector.apply(slot.samples, now - (self.capture_age or frames / self.sample_rate))
+        self.bytes_copied += indata.nbytes
+        self.enqueue_packet((PACKET_AUDIO, timestamp_us, slot))
+    
+    def enqueue_packet(self, item):
+        """Неблокирующая запись в очередь отправки"""
+        try:
+            self.audio_queue.put_nowait(item)
+        except queue.Full:
+            # Умная обработка переполнения: удаляем старый пакет и добавляем новый
             try:
-                # Неблокирующая запись в очередь
-                self.audio_queue.put_nowait(audio_data)
-            except queue.Full:
-                # Умная обработка переполнения: удаляем старый пакет и добавляем новый
-                try:
-                    self.audio_queue.get_nowait()  # Удаляем старый
-                    self.audio_queue.put_nowait(audio_data)  # Добавляем новый
-                    if hasattr(self, 'dropped_packets'):
-                        self.dropped_packets += 1
-                except queue.Empty:
-                    pass
+                dropped = self.audio_queue.get_nowait()  # Удаляем старый
+                self.audio_queue.put_nowait(item)  # Добавляем новый
+                if hasattr(self, 'dropped_packets'):
+                    self.dropped_packets += 1
+                trace = self.trace
+                if trace:
+                    # Номер выброшенному чанку ещё не назначен - в трассе время его захвата
+                    trace.record(EVENT_DROP, timestamp_us=dropped[1], packet_type=dropped[0],
+                                 reason=REASON_QUEUE_FULL, depth=self.audio_queue.qsize(), value=1)
+            except queue.Empty:
+                pass
     
     def send_audio_data(self):
         """Отправка аудио данных - оптимизировано"""
         multicast_addr = (self.group_var.get(), int(self.port_var.get()))
         print(f"[DEBUG] Начало отправки на {multicast_addr[0]}:{multicast_addr[1]}")
+        encoder = self.encoder
+        variant = self.stream_variant
+        capture_chunk = self.chunk_size
+        last_format_time = 0.0
         
         while self.running:
             try:
-                audio_data = self.audio_queue.get(timeout=0.01)  # Уменьшенный таймаут
-                # Используем sendto без проверок для максимальной скорости
-                bytes_sent = self.sock.sendto(audio_data, multicast_addr)
-                self.packet_count += 1
+                # Смена формата адаптацией: новый кодер и внеочередное объявление формата
+                if self.pending_variant is not None:
+                    variant, self.pending_variant = self.pending_variant, None
+                    encoder = self.encoder = StreamEncoder(variant, self.sample_rate, CHANNELS, capture_chunk)
+                    last_format_time = 0.0
                 
-                # Отладочная информация для первых пакетов
-                if self.packet_count <= 5:
-                    print(f"[DEBUG] Отправлен пакет #{self.packet_count}: {bytes_sent} байт на {multicast_addr}")
+                # Периодически объявляем формат, чтобы клиенты настраивались сами
+                now = time.time()
+                if now - last_format_time >= FORMAT_INTERVAL:
+                    last_format_time = now
+                    self.send_packet(build_format(self.seq, int(now * 1000000), encoder.rate,
+                                                  encoder.channels, encoder.encoding, encoder.chunk),
+                                     multicast_addr)
+                
+                packet_type, timestamp_us, payload = self.audio_queue.get(timeout=0.01)  # Уменьшенный таймаут
+                frames = payload[1] if packet_type == PACKET_SID else len(payload.samples)
+                if frames != capture_chunk:
+                    # Первый чанк нового профиля: объявляем формат прямо перед ним
+                    capture_chunk = frames
+                    encoder = self.encoder = StreamEncoder(variant, self.sample_rate, CHANNELS, frames)
+                    now = time.time()
+                    last_format_time = now
+                    self.send_packet(build_format(self.seq, int(now * 1000000), encoder.rate,
+                                                  encoder.channels, encoder.encoding, encoder.chunk),
+                                     multicast_addr)
+                started = time.thread_time()
+                simulcast = self.simulcast
+                if packet_type == PACKET_SID:
+                    noise_level, frames = payload
+                    if simulcast:
+                        simulcast.submit(PACKET_SID, noise_level, timestamp_us)
+                    self.send_packet(build_sid(self.seq, timestamp_us, noise_level, encoder.chunk),
+                                     multicast_addr)
+                    self.send_cpu_time += time.thread_time() - started
+                    continue
+                
+                slot = payload
+                self.dsp.process(slot.samples)
+                if simulcast:
+                    # Уровни читают отсчёты слота после обработки; слот не переиспользуется, пока он в истории
+                    # повторов, а без кодера-копии - ещё HISTORY_SIZE чанков кругового обхода
+                    simulcast.submit(PACKET_AUDIO, slot.samples, timestamp_us)
+                if encoder.passthrough:
+                    # Заголовок на место перед отсчётами - в сокет уходит буфер слота
+                    pack_header_into(slot.buffer, PACKET_AUDIO, self.seq, timestamp_us)
+                    slot.seq = self.seq
+                    self.bytes_copied += HEADER_SIZE
+                    self.send_packet(slot.packet, multicast_addr)
+                else:
+                    # Даунмикс/понижение частоты могут дать 0 или несколько пакетов на чанк
+                    for encoded in encoder.encode(slot.samples):
+                        packet = pack_header(PACKET_AUDIO, self.seq, timestamp_us) + encoded
+                        self.bytes_copied += len(encoded) + len(packet)
+                        self.send_packet(packet, multicast_addr)
+                self.send_cpu_time += time.thread_time() - started
                     
             except queue.Empty:
                 continue
@@ -394,9 +881,177 @@ class GameAudioStreamServer:
                     import traceback
                     traceback.print_exc()
     
+    def send_packet(self, packet, multicast_addr):
+        """Отправить готовый пакет и обновить счётчики"""
+        self.retransmitter.history.store(self.seq, packet)
+        self.seq += 1
+        sent_at = time.perf_counter()
+        bytes_sent = len(packet)
+        ring = self.ring
+        if ring:
+            # Копия в слот кольца и один futex_wake для всех ждущих клиентов этой машины
+            ring.write(packet)
+        if self.multicast_enabled:
+            bytes_sent = self.transmit(packet, multicast_addr)
+        send_time = time.perf_counter() - sent_at
+        self.send_time += send_time
+        self.send_calls += 1
+        self.packet_count += 1
+        trace = self.trace
+        if trace:
+            packet_type, stream_id, _, seq, timestamp_us = parse_header(packet)
+            trace.record(EVENT_SEND, seq, timestamp_us, len(packet), packet_type, stream_id,
+                         depth=self.audio_queue.qsize(), value=send_time * 1000000)
+        
+        # Отладочная информация для первых пакетов
+        if self.packet_count <= 5:
+            print(f"[DEBUG] Отправлен пакет #{self.packet_count}: {bytes_sent} байт на {multicast_addr}")
+    
+    def transmit(self, packet, addr):
+        """Отправить пакет (фрагментами, если больше MTU) без копирования данных"""
+        fragments = fragment_packet(packet, self.mtu)
+        if len(fragments) > 1:
+            self.fragment_count += len(fragments)
+        for fragment in fragments:
+            # Используем sendto без проверок для максимальной скорости
+            if len(fragment) == 1:
+                bytes_sent = self.sock.sendto(fragment[0], addr)
+            elif SENDMSG_AVAILABLE:
+                # Заголовок фрагмента и часть данных - отдельные iovec
+                bytes_sent = self.sock.sendmsg(fragment, (), 0, addr)
+            else:
+                joined = b''.join(fragment)
+                self.bytes_copied += len(joined)
+                bytes_sent = self.sock.sendto(joined, addr)
+        return bytes_sent
+    
+    def signal_ring(self, addr):
+        """Клиент из общей памяти ждёт в futex кольца, а не на сокете - будим его после unicast"""
+        ring = self.ring
+        if ring and addr[0] == '127.0.0.1':
+            ring.signal()
+    
+    def receive_feedback(self):
+        """Прием отчётов клиентов на сокет отправки"""
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+                received_us = int(time.time() * 1000000)
+                header = parse_header(data)
+                if header is None:
+                    continue
+                if header[0] == PACKET_SYNC:
+                    # Время сервера для синхронного воспроизведения: отвечаем сразу, до остальной обработки
+                    self.sock.sendto(build_sync_reply(data, received_us, int(time.time() * 1000000)), addr)
+                    self.signal_ring(addr)
+                    continue
+                # Отчёты и повторы уровней simulcast - по id потока; адаптация только по основному
+                health, retransmitter = self.health, self.retransmitter
+                tier = self.simulcast.tier_for(header[1]) if self.simulcast else None
+                if tier is not None:
+                    health, retransmitter = tier.health, tier.retransmitter
+                if header[0] == PACKET_REPORT:
+                    health.update(addr, parse_report(data))
+                elif header[0] == PACKET_NACK:
+                    # Повтор unicast только запросившему клиенту, с ограничением частоты
+                    client_id, seqs = parse_nack(data)
+                    for packet in retransmitter.handle(client_id, seqs, len(health.active())):
+                        self.transmit(mark_retransmit(packet), addr)
+                        trace = self.trace
+                        if trace:
+                            packet_type, stream_id, _, seq, timestamp_us = parse_header(packet)
+                            trace.record(EVENT_SEND, seq, timestamp_us, len(packet), packet_type, stream_id,
+                                         REASON_RETRANSMIT)
+                    self.signal_ring(addr)
+                elif header[0] == PACKET_JOIN:
+                    # Новый клиент: последние пакеты пачкой, его буфер заполняется без ожидания живого потока
+                    client_id, count = parse_join(data)
+                    packets = retransmitter.join(client_id, count)
+                    for packet in packets:
+                        self.transmit(mark_retransmit(packet, FLAG_RETRANSMIT | FLAG_JOIN), addr)
+                        trace = self.trace
+                        if trace:
+                            packet_type, stream_id, _, seq, timestamp_us = parse_header(packet)
+                            trace.record(EVENT_SEND, seq, timestamp_us, len(packet), packet_type, stream_id,
+                                         REASON_RETRANSMIT)
+                    self.signal_ring(addr)
+                    print(f"[DEBUG] Быстрый вход {addr[0]}:{addr[1]} (поток {header[1]}): {len(packets)} пакетов")
+            except socket.timeout:
+                continue
+            except OSError:
+                # Windows возвращает ICMP "порт недоступен" как ошибку recvfrom - не прерываем прием
+                if not self.running:
+                    break
+            except Exception as e:
+                if self.running:
+                    print(f"[ERROR] Feedback error: {e}")
+    
+    def update_client_health(self):
+        """Сводка по клиентам и адаптация формата"""
+        summary = self.health.summary()
+        clients, loss, jitter, underrun_rate, underrun_share, buffer_ms = summary
+        
+        if self.adaptive_var.get():
+            variant = self.controller.evaluate(summary)
+            if variant is not None:
+                print(f"[INFO] Авто-битрейт: {variant} ({self.controller.last_reason})")
+                self.pending_variant = variant
+        elif self.controller.level != self.controller.ceiling:
+            # Адаптацию выключили - возвращаемся к выбранному оператором формату
+            self.controller.level = self.controller.ceiling
+            self.pending_variant = self.controller.variant
+        
+        advised_chunk = self.advised_chunk(self.health.advised_packet_us())
+        if self.auto_profile_var.get() and advised_chunk and advised_chunk != self.chunk_size:
+            now = time.time()
+            # На родной частоте устройства частота профиля не используется - совпадать должен только chunk
+            native = self.native_rate_var.get()
+            profile = next((name for name, config in LATENCY_PROFILES.items()
+                            if config['chunk'] == advised_chunk and (native or config['rate'] == self.sample_rate)),
+                           None)
+            if profile is not None and now - self.profile_switch_time >= ADAPT_INTERVAL:
+                self.profile_switch_time = now
+                self.root.after(0, self.apply_advised_profile, profile)
+        
+        if clients == 0:
+            self.clients_var.set("Клиенты: нет отчётов")
+            return
+        
+        loss_status = "🟢" if loss < LOSS_TARGET else "🔴"
+        jitter_status = "🟢" if jitter < JITTER_TARGET else "🔴"
+        clients_text = (f"Клиенты: {clients} | худшие 10%: потери {loss_status} {loss:.1f}%, "
+                        f"джиттер {jitter_status} {jitter:.1f}мс, опустошений {underrun_rate:.0f}/мин, "
+                        f"буфер {buffer_ms:.0f}мс | формат: {self.controller.variant}")
+        if advised_chunk:
+            clients_text += f" | советуют chunk {advised_chunk}"
+        retransmitter = self.retransmitter
+        if retransmitter.requested > 0:
+            clients_text += (f" | повторов: {retransmitter.retransmitted}/{retransmitter.requested}"
+                             f" (огр. {retransmitter.rate_limited}, устар. {retransmitter.expired})")
+        if retransmitter.joins > 0:
+            clients_text += f" | входов: {retransmitter.joins} ({retransmitter.join_packets} пакетов)"
+        self.clients_var.set(clients_text)
+    
+    def advised_chunk(self, packet_us):
+        """Чанк профиля в кадрах захвата, ближайший к рекомендованной клиентами длительности пакета (0 - нет).
+        Клиенты считают в кадрах потока, а у варианта формата с пониженной частотой они короче"""
+        if not packet_us:
+            return 0
+        frames = packet_us * self.sample_rate / 1000000
+        return min({config['chunk'] for config in LATENCY_PROFILES.values()},
+                   key=lambda chunk: abs(math.log2(chunk / frames)))
+    
+    def apply_advised_profile(self, profile):
+        """Переключить профиль по рекомендации клиентов (в GUI потоке, без остановки стрима)"""
+        if self.running and profile != self.latency_profile_var.get():
+            print(f"[INFO] Профиль по клиентам: {profile}")
+            self.latency_profile_var.set(profile)
+            self.on_latency_profile_change()
+    
     def update_stats(self):
         """Обновление статистики с индикатором уровня"""
         while self.running:
+            self.update_client_health()
             elapsed = time.time() - self.start_time
             if elapsed > 0:
                 speed = self.packet_count / elapsed
@@ -406,7 +1061,26 @@ class GameAudioStreamServer:
                     stats_text += f", пропущено: {self.dropped_packets})"
                 else:
                     stats_text += ")"
+                captured = self.packet_count + self.suppressed_packets
+                if self.suppressed_packets > 0 and captured > 0:
+                    stats_text += f" | Тишина: {self.suppressed_packets / captured * 100:.0f}%"
+                if self.fragment_count > 0:
+                    stats_text += f" | Фрагментов: {self.fragment_count}"
+                injector = self.injector
+                if injector:
+                    stats_text += f" | Маркеров: {injector.injected}"
+                if self.profiler.count > 0:
+                    # Цена отправки: сколько байт копируется на пакет
+                    stats_text += f" | Копий: {self.bytes_copied / max(self.packet_count, 1):.0f} Б/пакет"
                 self.stats_var.set(stats_text)
+                # Запас callback захвата по времени и xrun - безопасен ли профиль на этой машине
+                self.dsp_var.set(" | ".join(text for text in (self.profiler.report(), self.dsp.report()) if text))
+                if self.simulcast:
+                    send_us = self.send_time / self.send_calls * 1000000 if self.send_calls else 0
+                    tiers_text = [f"#0 {self.group_var.get()}:{self.port_var.get()}: "
+                                  f"CPU {self.send_cpu_time / elapsed * 100:.1f}%, отправка {send_us:.0f} мкс"]
+                    tiers_text.extend(self.simulcast.report(elapsed))
+                    self.tiers_stats_var.set("\n".join(tiers_text))
                 
                 # Обновляем индикатор уровня звука с цветовой индикацией
                 level_percent = int(self.last_audio_level * 100)
@@ -423,22 +1097,49 @@ class GameAudioStreamServer:
                 
             time.sleep(0.1)  # Более частое обновление для плавности
     
-    def stop_stream(self):
-        """Остановка стриминга"""
+    def release_stream(self):
+        """Остановить потоки и освободить захват, уровни simulcast, кольцо, сокет и трассу
+        (при остановке и после неудачного запуска)"""
         self.running = False
         if self.stream:
             self.stream.stop()
             self.stream.close()
+            self.stream = None
+        if self.simulcast:
+            self.simulcast.stop()
+            self.simulcast = None
+        # Кольцо пишет поток отправки, сокет и кольцо использует поток отчётов - закрываем после их выхода
+        for thread in (getattr(self, 'send_thread', None), getattr(self, 'feedback_thread', None)):
+            if thread:
+                thread.join(timeout=0.5)
+        if self.ring:
+            self.ring.close()
+            self.ring = None
         if hasattr(self, 'sock'):
             self.sock.close()
+        if self.trace:
+            trace, self.trace = self.trace, None
+            trace.close()
+    
+    def stop_stream(self):
+        """Остановка стриминга"""
+        self.release_stream()
         
         self.status_var.set("⏸ Готов")
         self.status_label.config(fg='#89b4fa')  # Синий цвет для остановленного статуса
         self.start_btn.config(state=tk.NORMAL)
         self.stop_btn.config(state=tk.DISABLED)
-        self.latency_combo.config(state=tk.NORMAL)  # Разблокируем после остановки
+        self.variant_combo.config(state=tk.NORMAL)
+        self.tiers_entry.config(state=tk.NORMAL)
+        self.trace_check.config(state=tk.NORMAL)
+        self.native_rate_check.config(state=tk.NORMAL)
+        self.qos_combo.config(state=tk.NORMAL)
+        self.interface_entry.config(state=tk.NORMAL)
+        self.transport_combo.config(state=tk.NORMAL)
 
 if __name__ == "__main__":
+    STARTUP.mark("импорт модулей")
     root = tk.Tk()
     app = GameAudioStreamServer(root)
+    root.after_idle(STARTUP.mark, "окно готово")
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,354 @@
+import argparse
+import ctypes
+import platform
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from StreamAudio_Protocol import PACKET_AUDIO, pack_header, parse_header
+
+# Транспорт через общую память для сервера и клиентов на одной машине: кольцо пакетов в
+# multiprocessing.shared_memory вместо multicast через loopback. Пакет копируется в слот и из слота
+# без системных вызовов; отчёты, NACK, SYNC и JOIN по-прежнему идут unicast на сокет сервера.
+# Приёмник спит в futex на слове событий заголовка: сервер меняет его после каждой записи и после
+# unicast клиенту этой машины и будит ожидающих. Один системный вызов на пакет у каждой стороны -
+# против двух у приёмника multicast. futex есть только в Linux (через ctypes), на других ОС
+# транспорт не предлагается: опрос кольца медленнее loopback multicast
+TRANSPORT_MULTICAST = 'Multicast'
+TRANSPORT_SHM = 'Общая память'
+TRANSPORT_BOTH = 'Multicast + память'
+
+RING_MAGIC = b'SAR2'
+RING_HEADER = struct.Struct('<4sIIH')  # magic, слотов, размер слота, порт сервера для отчётов
+RING_COUNTER = struct.Struct('<Q')  # Записано пакетов всего
+COUNTER_OFFSET = 16
+EVENTS_OFFSET = 24  # uint32 futex: меняется при каждой записи и сигнале сервера
+SIGNALS_OFFSET = 28  # uint32: сколько раз сервер отправил unicast клиентам этой машины
+DATA_OFFSET = 64
+SLOT_HEADER = struct.Struct('<QI')  # Номер записи в слоте, длина пакета
+SLOT_ALIGN = 8  # Номер записи (Q) в каждом слоте выровнен на 8 байт
+WRITING = 1 << 63  # Метка номера слота на время записи (читатель пропускает слот)
+SHM_SLOTS = 64  # ~370 мс при chunk 256: переживает остановку приёмника планировщиком
+SHM_SLOT_SIZE = 8192  # Пакет профиля "Высокая" (1024 кадра стерео) с заголовком
+SHM_WAIT_TIMEOUT = 0.1  # Сервер молчит (DTX, пауза) - приёмник всё равно просыпается так часто
+
+# futex(2): номер системного вызова по архитектуре, операции без FUTEX_PRIVATE_FLAG (слово в общей памяти)
+SYS_FUTEX = {'x86_64': 202, 'amd64': 202, 'aarch64': 98, 'arm64': 98, 'i386': 240, 'i686': 240,
+             'armv7l': 240, 'armv6l': 240}
+FUTEX_WAIT = 0
+FUTEX_WAKE = 1
+FUTEX_WAKE_ALL = 0x7fffffff
+
+
+class Timespec(ctypes.Structure):
+    """struct timespec: относительный таймаут FUTEX_WAIT"""
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _load_futex():
+    """futex(адрес, операция, значение, timespec или None) через syscall libc
+    (None - не Linux или неизвестная архитектура)"""
+    number = SYS_FUTEX.get(platform.machine().lower())
+    if not sys.platform.startswith('linux') or number is None:
+        return None
+    try:
+        syscall = ctypes.CDLL(None, use_errno=True).syscall
+    except (OSError, AttributeError):
+        return None
+    # Типы аргументов заданы заранее: вызов на каждый пакет не создаёт объектов ctypes
+    syscall.argtypes = [ctypes.c_long, ctypes.c_void_p, ctypes.c_int, ctypes.c_uint32, ctypes.c_void_p,
+                        ctypes.c_void_p, ctypes.c_uint32]
+    syscall.restype = ctypes.c_long
+    return lambda address, op, value, timeout: syscall(number, address, op, value, timeout, None, 0)
+
+
+_futex = _load_futex()
+SHM_AVAILABLE = _futex is not None
+if SHM_AVAILABLE:
+    SERVER_TRANSPORTS = (TRANSPORT_MULTICAST, TRANSPORT_SHM, TRANSPORT_BOTH)
+    CLIENT_TRANSPORTS = (TRANSPORT_MULTICAST, TRANSPORT_SHM)
+else:
+    SERVER_TRANSPORTS = CLIENT_TRANSPORTS = (TRANSPORT_MULTICAST,)
+
+# Сравнение с loopback multicast (--compare)
+COMPARE_GROUP = '239.255.77.201'
+COMPARE_PORT = 5079
+COMPARE_PACKETS = 2000
+COMPARE_CHUNK = 256
+COMPARE_RATE = 44100
+COMPARE_SETTLE = 0.5
+CHANNELS = 2
+
+
+def ring_name(port):
+    """Имя кольца по порту потока: клиент находит сервер по тому же полю "Порт" """
+    return f"StreamAudio_{port}"
+
+
+_created = set()  # Сегменты, созданные этим процессом (сервер и клиент в одном процессе)
+
+
+def open_shared_memory(name):
+    """Подключиться к существующему сегменту, не отдавая его resource_tracker этого процесса
+    (иначе Python до 3.13 удалит сегмент сервера при выходе клиента)"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Свой сегмент остаётся на учёте у создателя - его unlink снимет регистрацию
+        if sys.platform != 'win32' and shm._name not in _created:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class PacketRing:
+    """Кольцо пакетов: один писатель (сервер), любое число читателей со своей позицией.
+    Слот помечается WRITING, пока в него пишут; читатель сверяет номер до и после копирования"""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        magic, self.slots, self.slot_size, self.control_port = RING_HEADER.unpack_from(shm.buf, 0)
+        if magic != RING_MAGIC:
+            shm.close()
+            raise ValueError(f"{shm.name}: не кольцо StreamAudio")
+        self.stride = self.slot_stride(self.slot_size)
+        # Слова заголовка для futex; до shm.close() их нужно отпустить (они держат буфер сегмента)
+        self.events = ctypes.c_uint32.from_buffer(shm.buf, EVENTS_OFFSET)
+        self.signals = ctypes.c_uint32.from_buffer(shm.buf, SIGNALS_OFFSET)
+        self.events_address = ctypes.addressof(self.events)
+        self.seen_events = self.events.value
+        self.seen_signals = self.signals.value
+        self.timespec = Timespec()
+        self.timespec_address = ctypes.addressof(self.timespec)
+        self.wait_timeout = None
+        self.read_pos = None
+        self.lost = 0
+        self.oversized = 0
+
+    @staticmethod
+    def slot_stride(slot_size):
+        return (SLOT_HEADER.size + slot_size + SLOT_ALIGN - 1) // SLOT_ALIGN * SLOT_ALIGN
+
+    @classmethod
+    def create(cls, name, control_port, slots=SHM_SLOTS, slot_size=SHM_SLOT_SIZE):
+        """Новое кольцо сервера (сегмент от упавшего сервера с тем же именем заменяется)"""
+        size = DATA_OFFSET + slots * cls.slot_stride(slot_size)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        RING_HEADER.pack_into(shm.buf, 0, RING_MAGIC, slots, slot_size, control_port)
+        RING_COUNTER.pack_into(shm.buf, COUNTER_OFFSET, 0)
+        _created.add(shm._name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Кольцо запущенного сервера (FileNotFoundError - сервер не публикует в память)"""
+        return cls(open_shared_memory(name), owner=False)
+
+    def close(self):
+        self.events = self.signals = None
+        self.shm.close()
+        if self.owner:
+            _created.discard(self.shm._name)
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def wake(self):
+        """Сменить слово событий и разбудить всех ждущих читателей. Запись и сигнал идут из разных потоков
+        сервера: гонка двух += 1 теряет только одно приращение, слово всё равно отличается от увиденного"""
+        self.events.value += 1
+        _futex(self.events_address, FUTEX_WAKE, FUTEX_WAKE_ALL, None)
+
+    def write(self, packet):
+        """Записать пакет (bytes, bytearray или memoryview) и разбудить читателей. False - пакет больше слота"""
+        length = len(packet)
+        if length > self.slot_size:
+            self.oversized += 1
+            return False
+        buf = self.shm.buf
+        count = RING_COUNTER.unpack_from(buf, COUNTER_OFFSET)[0]
+        offset = DATA_OFFSET + (count % self.slots) * self.stride
+        SLOT_HEADER.pack_into(buf, offset, count | WRITING, length)
+        start = offset + SLOT_HEADER.size
+        buf[start:start + length] = packet
+        SLOT_HEADER.pack_into(buf, offset, count, length)
+        RING_COUNTER.pack_into(buf, COUNTER_OFFSET, count + 1)
+        self.wake()
+        return True
+
+    def signal(self):
+        """Сервер отправил unicast клиенту этой машины: тот ждёт в futex, а не на сокете"""
+        self.signals.value += 1
+        self.wake()
+
+    def signalled(self):
+        """Были ли сигналы сервера с прошлой проверки (тогда на сокете клиента есть датаграммы)"""
+        signals = self.signals.value
+        if signals == self.seen_signals:
+            return False
+        self.seen_signals = signals
+        return True
+
+    def wait(self, timeout=SHM_WAIT_TIMEOUT):
+        """Ждать записи или сигнала не дольше timeout, с. Если они были после начала прошлого read(),
+        ядро сразу вернёт управление: слово событий уже не равно увиденному"""
+        if timeout != self.wait_timeout:
+            self.wait_timeout = timeout
+            self.timespec.tv_sec = int(timeout)
+            self.timespec.tv_nsec = int((timeout - int(timeout)) * 1000000000)
+        _futex(self.events_address, FUTEX_WAIT, self.seen_events, self.timespec_address)
+
+    def read(self):
+        """Новые пакеты с прошлого вызова (bytes). Отставание больше кольца и перезаписанные слоты - потери"""
+        # Слово событий - до счётчика: запись после этого места разбудит следующий wait()
+        self.seen_events = self.events.value
+        buf = self.shm.buf
+        count = RING_COUNTER.unpack_from(buf, COUNTER_OFFSET)[0]
+        pos = self.read_pos
+        if pos is None or count < pos:
+            # Первое чтение или перезапуск сервера - начинаем с новых пакетов
+            self.read_pos = count
+            return []
+        if count - pos > self.slots:
+            self.lost += count - self.slots - pos
+            pos = count - self.slots
+        packets = []
+        while pos < count:
+            offset = DATA_OFFSET + (pos % self.slots) * self.stride
+            number, length = SLOT_HEADER.unpack_from(buf, offset)
+            if number == pos:
+                start = offset + SLOT_HEADER.size
+                packet = bytes(buf[start:start + length])
+                if SLOT_HEADER.unpack_from(buf, offset)[0] == pos:
+                    packets.append(packet)
+                else:
+                    self.lost += 1  # Писатель догнал слот во время копирования
+            else:
+                self.lost += 1
+            pos += 1
+        self.read_pos = pos
+        return packets
+
+
+def compare_writer(mode, count, chunk, rate):
+    """Отправитель сравнения (отдельный процесс, как сервер): пакеты в темпе чанка с временем отправки.
+    В конце печатает CPU отправителя на передачу пакета, мкс"""
+    payload = (np.random.default_rng().standard_normal((chunk, CHANNELS)) * 3000).astype(np.int16).tobytes()
+    interval = chunk / rate
+    ring = sock = None
+    if mode == 'shm':
+        ring = PacketRing.create(ring_name(COMPARE_PORT), 0)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    time.sleep(COMPARE_SETTLE)  # Приёмник успевает подключиться
+    next_time = time.time()
+    cpu = 0.0
+    for seq in range(count):
+        packet = pack_header(PACKET_AUDIO, seq, int(time.time() * 1000000)) + payload
+        started = time.process_time()
+        if ring is not None:
+            ring.write(packet)
+        else:
+            sock.sendto(packet, (COMPARE_GROUP, COMPARE_PORT))
+        cpu += time.process_time() - started
+        next_time += interval
+        delay = next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    time.sleep(COMPARE_SETTLE)
+    if ring is not None:
+        ring.close()
+    else:
+        sock.close()
+    print(cpu / count * 1000000)
+
+
+def compare_run(mode, count, chunk, rate):
+    """Задержка от отправки до приёма и CPU приёмника на пакет для одного транспорта"""
+    from StreamAudio_Receiver import open_multicast_socket
+
+    ring = sock = None
+    if mode == TRANSPORT_MULTICAST:
+        sock = open_multicast_socket(COMPARE_PORT, [COMPARE_GROUP])
+    # Отправитель - независимый процесс, как настоящий сервер (свои часы планировщика и resource_tracker)
+    writer = subprocess.Popen([sys.executable, __file__, '--writer', 'shm' if mode == TRANSPORT_SHM else 'multicast',
+                               '--packets', str(count), '--chunk', str(chunk)], stdout=subprocess.PIPE, text=True)
+    latencies = []
+    deadline = time.time() + count * chunk / rate + 3 * COMPARE_SETTLE
+    try:
+        while ring is None and sock is None and time.time() < deadline:
+            try:
+                ring = PacketRing.attach(ring_name(COMPARE_PORT))
+                ring.read()
+            except FileNotFoundError:
+                time.sleep(0.05)
+        started = time.process_time()
+        while len(latencies) < count and time.time() < deadline:
+            if ring is not None:
+                ring.wait()
+                packets = ring.read()
+                received = time.time()
+                if not packets:
+                    continue
+            else:
+                readable, _, _ = select.select([sock], [], [], 0.1)
+                if not readable:
+                    continue
+                packets = [sock.recv(65536)]
+                received = time.time()
+            for packet in packets:
+                header = parse_header(packet)
+                if header is not None:
+                    latencies.append(received - header[4] / 1000000)
+        cpu = time.process_time() - started
+    finally:
+        output, _ = writer.communicate(timeout=COMPARE_SETTLE * 4)
+        if ring is not None:
+            ring.close()
+        if sock is not None:
+            sock.close()
+    values = np.array(latencies) * 1000000
+    if not len(values):
+        return f"{mode:>20} {'нет пакетов':>10}"
+    return (f"{mode:>20} {len(values):>8} {np.median(values):>9.0f} {np.percentile(values, 99):>9.0f} "
+            f"{values.max():>9.0f} {cpu / len(values) * 1000000:>12.1f} {float(output):>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Кольцо пакетов в общей памяти: сравнение с loopback multicast")
+    parser.add_argument('--compare', action='store_true', help="Сравнить задержку и CPU приёма")
+    parser.add_argument('--packets', type=int, default=COMPARE_PACKETS, help="Пакетов на транспорт")
+    parser.add_argument('--chunk', type=int, default=COMPARE_CHUNK, help="Кадров в пакете")
+    parser.add_argument('--writer', choices=('shm', 'multicast'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.writer:
+        compare_writer(args.writer, args.packets, args.chunk, COMPARE_RATE)
+        return
+    if not args.compare:
+        parser.print_help()
+        return
+    print(f"Сравнение: {args.packets} пакетов, chunk={args.chunk}, {COMPARE_RATE}Hz, отправитель - отдельный процесс")
+    print(f"{'транспорт':>20} {'пакетов':>8} {'p50 мкс':>9} {'p99 мкс':>9} {'макс мкс':>9} {'CPU мкс/пак':>12} {'отправка мкс':>14}")
+    for mode in CLIENT_TRANSPORTS:
+        print(compare_run(mode, args.packets, args.chunk, COMPARE_RATE))
+
+
+if __name__ == "__main__":
+    main()
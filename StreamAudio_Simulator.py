@@ -0,0 +1,460 @@
+import os
+import sys
+import math
+import time
+import heapq
+import argparse
+import itertools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from StreamAudio_Protocol import (PACKET_AUDIO, PACKET_SID, PACKET_FORMAT, PACKET_NACK, PACKET_SYNC, PACKET_JOIN,
+                                  HEADER_SIZE, FLAG_RETRANSMIT, FLAG_JOIN, SID_PAYLOAD, FORMAT_PAYLOAD, pack_header,
+                                  parse_header, parse_nack, parse_join, build_sync_reply, mark_retransmit)
+from StreamAudio_Codec import ENCODING_PCM16, payload_size
+from StreamAudio_Receiver import StreamSource, Mixer, DEFAULT_RATE, CHANNELS
+from StreamAudio_Trace import (load_trace, EVENT_RECEIVE, EVENT_PLAY, EVENT_DROP, REASON_NONE, REASON_RETRANSMIT,
+                               REASON_UNDERRUN, REASON_LATE, REASON_DUPLICATE, REASON_BUFFER_FULL, REASON_GAP)
+
+# Прогон приёма и воспроизведения клиента (StreamSource, буфер, маскировка, синхронное воспроизведение)
+# по трассе прихода пакетов на виртуальных часах - во много раз быстрее реального времени
+SIM_DURATION = 600.0  # Секунд генерируемого трафика
+SIM_CHUNK = 256
+SIM_EPOCH = 1000.0  # Начало виртуальных часов (время захвата 0 клиент считает "без времени")
+SIM_SEGMENT = 10.0  # Трафик генерируется кусками - день трафика не держится в памяти
+
+# Модель сети по умолчанию: проводная локальная сеть с редкими всплесками очереди
+SIM_BASE_DELAY = 0.001  # Минимальное время в пути, с
+SIM_JITTER = 0.0005  # Среднее добавочное время в пути (экспоненциальное), с
+SIM_SPIKE_RATE = 0.05  # Всплесков задержки в секунду (очередь коммутатора, сканирование Wi-Fi)
+SIM_SPIKE = 0.02  # Средняя высота всплеска, с: пакеты за ним приходят пачкой
+SIM_LOSS = 0.002  # Доля потерянных пакетов
+SIM_LOSS_BURST = 1.5  # Средняя длина серии потерь (модель Гилберта)
+SIM_RTT = 0.002  # Туда-обратно для ответов сервера (SYNC, повторы NACK, пачка входа)
+
+SIM_CLIENT_ID = 1
+LATENCY_BIN = 0.0001  # Гистограмма задержек с шагом 0.1 мс
+LATENCY_BINS = 50000  # до 5 с
+SIM_PERCENTILES = (50, 99, 100)
+
+
+class LossModel:
+    """Потери сериями (модель Гилберта): длины серий без потерь и с потерями геометрические"""
+
+    def __init__(self, rng, loss, burst):
+        self.rng = rng
+        self.enter = loss / (burst * (1 - loss)) if loss > 0 else 0.0  # P(без потерь -> потери) на пакет
+        self.leave = 1 / burst
+        self.lost = False
+        self.remaining = self._run()
+
+    def _run(self):
+        if self.lost:
+            return int(self.rng.geometric(self.leave))
+        return int(self.rng.geometric(self.enter)) if self.enter > 0 else 1 << 62
+
+    def mask(self, count):
+        """Какие из следующих count пакетов потеряны"""
+        mask = np.zeros(count, dtype=bool)
+        pos = 0
+        while pos < count:
+            run = min(self.remaining, count - pos)
+            if self.lost:
+                mask[pos:pos + run] = True
+            pos += run
+            self.remaining -= run
+            if not self.remaining:
+                self.lost = not self.lost
+                self.remaining = self._run()
+        return mask
+
+
+class NetworkModel:
+    """Генерируемый трафик: сервер шлёт чанк за чанком, сеть добавляет задержку, всплески и потери.
+    Часы сервера и клиента совпадают, время захвата = время отправки"""
+
+    def __init__(self, duration=SIM_DURATION, rate=DEFAULT_RATE, chunk=SIM_CHUNK, base_delay=SIM_BASE_DELAY,
+                 jitter=SIM_JITTER, spike_rate=SIM_SPIKE_RATE, spike=SIM_SPIKE, loss=SIM_LOSS,
+                 loss_burst=SIM_LOSS_BURST, seed=1):
+        self.duration = duration
+        self.rate = rate
+        self.chunk = chunk
+        self.interval = chunk / rate
+        self.count = int(duration / self.interval)
+        self.base_delay = base_delay
+        self.jitter = jitter
+        self.spike_rate = spike_rate
+        self.spike = spike
+        self.loss = loss
+        self.loss_burst = loss_burst
+        self.seed = seed
+
+    def describe(self):
+        return (f"в пути {self.base_delay * 1000:.1f} мс + {self.jitter * 1000:.1f} мс, "
+                f"всплески {self.spike_rate:g}/с по {self.spike * 1000:.0f} мс, "
+                f"потери {self.loss * 100:g}% сериями {self.loss_burst:g}")
+
+    def capture_time(self, seq):
+        return SIM_EPOCH + seq * self.interval
+
+    def newest_seq(self, server_time):
+        """Последний отправленный к этому моменту номер"""
+        return min(int((server_time - SIM_EPOCH) / self.interval), self.count - 1)
+
+    def arrivals(self):
+        """(время прихода, seq, время захвата мкс, флаги, тип пакета) по возрастанию времени прихода"""
+        rng = np.random.default_rng(self.seed)
+        losses = LossModel(rng, self.loss, self.loss_burst)
+        per_segment = max(1, int(SIM_SEGMENT / self.interval))
+        spikes = []  # (начало, высота) всплесков, которые ещё не рассосались к концу куска
+        carry_times = np.empty(0)
+        carry_seqs = np.empty(0, dtype=np.int64)
+        for first in range(0, self.count, per_segment):
+            seqs = np.arange(first, min(first + per_segment, self.count), dtype=np.int64)
+            sent = SIM_EPOCH + seqs * self.interval
+            delay = self.base_delay + rng.exponential(self.jitter, len(seqs)) if self.jitter else \
+                np.full(len(seqs), self.base_delay)
+            # Всплеск: очередь на h секунд, пакеты за ним ждут, пока она рассосётся (приходят пачкой)
+            segment_start, segment_end = sent[0], sent[-1] + self.interval
+            new = rng.poisson(self.spike_rate * (segment_end - segment_start)) if self.spike_rate else 0
+            spikes.extend(zip(rng.uniform(segment_start, segment_end, new), rng.exponential(self.spike, new)))
+            for start, height in spikes:
+                lo, hi = np.searchsorted(sent, (start, start + height))
+                delay[lo:hi] += height - (sent[lo:hi] - start)
+            spikes = [(start, height) for start, height in spikes if start + height > segment_end]
+            keep = ~losses.mask(len(seqs))
+            times = np.concatenate((carry_times, sent[keep] + delay[keep]))
+            all_seqs = np.concatenate((carry_seqs, seqs[keep]))
+            order = np.argsort(times, kind='stable')
+            times, all_seqs = times[order], all_seqs[order]
+            # Пакеты следующего куска придут не раньше его начала + минимальная задержка
+            limit = segment_end + self.base_delay if first + per_segment < self.count else math.inf
+            ready = np.searchsorted(times, limit)
+            for arrival, seq in zip(times[:ready].tolist(), all_seqs[:ready].tolist()):
+                yield arrival, seq, int(self.capture_time(seq) * 1000000), 0, PACKET_AUDIO
+            carry_times, carry_seqs = times[ready:], all_seqs[ready:]
+
+
+class RecordedTraffic:
+    """Приход пакетов из трассы клиента (StreamAudio_Trace): повторы и пачки входа уже в ней.
+    Часы сервера сводятся к часам клиента по лучшему пакету - задержки считаются от минимального времени в пути"""
+
+    def __init__(self, path, stream=0, rate=DEFAULT_RATE):
+        records = load_trace(path)
+        received = records[(records['event'] == EVENT_RECEIVE) & (records['stream'] == stream)]
+        if not len(received):
+            raise ValueError(f"{path}: нет принятых пакетов потока #{stream}")
+        self.received = received
+        self.rate = rate
+        audio = received[(received['packet_type'] == PACKET_AUDIO) & (received['size'] > HEADER_SIZE)]
+        if not len(audio):
+            raise ValueError(f"{path}: нет аудио пакетов потока #{stream}")
+        self.chunk = int(np.median(audio['size']) - HEADER_SIZE) // payload_size(CHANNELS, ENCODING_PCM16, 1)
+        self.interval = self.chunk / rate
+        timed = received[received['timestamp_us'] > 0]
+        self.offset = float(np.max(timed['timestamp_us'] / 1000000 - timed['time'])) if len(timed) else 0.0
+        self.duration = float(received['time'][-1] - received['time'][0])
+
+    def describe(self):
+        return f"трасса {len(self.received)} пакетов"
+
+    def arrivals(self):
+        flags = np.where(self.received['reason'] == REASON_RETRANSMIT, FLAG_RETRANSMIT, 0).tolist()
+        return zip(self.received['time'].tolist(), self.received['seq'].tolist(),
+                   self.received['timestamp_us'].tolist(), flags, self.received['packet_type'].tolist())
+
+
+class SimulationTrace:
+    """Вместо TraceWriter: StreamSource пишет сюда события, из них - опустошения, выбросы и задержки"""
+
+    def __init__(self, offset):
+        self.offset = offset  # время сервера = время клиента + offset
+        self.histogram = [0] * LATENCY_BINS
+        self.played = 0
+        self.underrun_frames = 0
+        self.drops = {}
+
+    def record(self, event, seq=0, timestamp_us=0, size=0, packet_type=0, stream=0, reason=REASON_NONE,
+               depth=0, value=0, event_time=None):
+        if event == EVENT_PLAY:
+            if reason == REASON_UNDERRUN:
+                self.underrun_frames += size
+            elif timestamp_us:
+                # От захвата до звука по часам клиента
+                latency = event_time - (timestamp_us / 1000000 - self.offset)
+                self.histogram[min(max(int(latency / LATENCY_BIN), 0), LATENCY_BINS - 1)] += 1
+                self.played += 1
+        elif event == EVENT_DROP:
+            self.drops[reason] = self.drops.get(reason, 0) + value
+
+    def percentiles(self, percentiles=SIM_PERCENTILES):
+        """Задержки в мс по гистограмме"""
+        if not self.played:
+            return [0.0] * len(percentiles)
+        cumulative = np.cumsum(self.histogram)
+        ranks = [min(math.ceil(p / 100 * self.played), self.played) for p in percentiles]
+        return [(int(np.searchsorted(cumulative, max(rank, 1))) + 0.5) * LATENCY_BIN * 1000 for rank in ranks]
+
+
+class VirtualServer:
+    """Сокет источника: ответы сервера на запросы клиента приходят через очередь событий симуляции.
+    SYNC - всегда, повторы NACK и пачка входа - только для генерируемого трафика (в трассе они уже записаны)"""
+
+    def __init__(self, simulation, offset, rtt, network=None):
+        self.simulation = simulation
+        self.offset = offset
+        self.rtt = rtt
+        self.network = network
+        self.requests = {}
+
+    def sendto(self, data, addr):
+        header = parse_header(data)
+        if header is None:
+            return
+        packet_type = header[0]
+        self.requests[packet_type] = self.requests.get(packet_type, 0) + 1
+        now = self.simulation.now
+        reply_time = now + self.rtt
+        server_us = int((now + self.rtt / 2 + self.offset) * 1000000)
+        if packet_type == PACKET_SYNC:
+            self.simulation.schedule(reply_time, build_sync_reply(data, server_us, server_us))
+        elif packet_type == PACKET_NACK and self.network:
+            _, seqs = parse_nack(data)
+            for seq in seqs:
+                self.simulation.schedule(reply_time, mark_retransmit(self.simulation.audio_packet(seq)))
+        elif packet_type == PACKET_JOIN and self.network:
+            _, count = parse_join(data)
+            newest = self.network.newest_seq(server_us / 1000000)
+            for seq in range(max(newest - count + 1, 0), newest + 1):
+                self.simulation.schedule(reply_time, mark_retransmit(self.simulation.audio_packet(seq),
+                                                                     FLAG_RETRANSMIT | FLAG_JOIN))
+
+
+class PipelineSimulation:
+    """Один прогон: источник клиента с настройками config, callback устройства по виртуальным часам"""
+
+    def __init__(self, traffic, config, rtt=SIM_RTT, drift_ppm=0.0, output_latency=None):
+        self.traffic = traffic
+        self.config = config
+        self.rate = traffic.rate
+        self.chunk = traffic.chunk
+        generated = isinstance(traffic, NetworkModel)
+        self.offset = 0.0 if generated else traffic.offset
+        self.now = 0.0
+        self._events = []
+        self._order = itertools.count()
+        self._payload = bytes(payload_size(CHANNELS, ENCODING_PCM16, self.chunk))
+        self.server = VirtualServer(self, self.offset, rtt, traffic if generated else None)
+
+        delay = config.get('delay')
+        source = StreamSource(('sim', 0, 0), self.server, ('sim', 0), SIM_CLIENT_ID, self.rate, self.chunk,
+                              nack_enabled=config.get('nack', False),
+                              playout_delay=None if delay is None else delay / 1000)
+        source.set_depth(config.get('depth', 1))
+        # В трассе пачка входа уже есть; сервер симуляции объявляет формат заранее
+        source.fast_join = generated and config.get('fast_join', True)
+        source.format_known = True
+        source.trace = SimulationTrace(self.offset)
+        self.source = source
+        self.block = config.get('block') or self.chunk
+        # Кварц устройства клиента уходит от часов сервера на drift_ppm
+        self.block_interval = self.block / (self.rate * (1 + drift_ppm / 1000000))
+        self.output_latency = self.block / self.rate if output_latency is None else output_latency
+
+    def schedule(self, when, data):
+        heapq.heappush(self._events, (when, next(self._order), data))
+
+    def audio_packet(self, seq, timestamp_us=None, flags=0, packet_type=PACKET_AUDIO):
+        if timestamp_us is None:
+            timestamp_us = int(self.traffic.capture_time(seq) * 1000000)
+        if packet_type == PACKET_SID:
+            return pack_header(packet_type, seq, timestamp_us, 0, flags) + SID_PAYLOAD.pack(0, self.chunk)
+        if packet_type == PACKET_FORMAT:
+            return pack_header(packet_type, seq, timestamp_us, 0, flags) + FORMAT_PAYLOAD.pack(
+                self.rate, CHANNELS, ENCODING_PCM16, self.chunk)
+        return pack_header(packet_type, seq, timestamp_us, 0, flags) + self._payload
+
+    def run(self):
+        """Прогнать всю трассу; результат - словарь для таблицы"""
+        source = self.source
+        sources = [source]
+        mixer = Mixer()
+        out = np.zeros((self.block, CHANNELS), dtype=np.int16)
+        events = self._events
+        arrivals = iter(self.traffic.arrivals())
+        arrival = next(arrivals, None)
+        if arrival is None:
+            raise ValueError("нет пакетов")
+        # Устройство уже открыто, фаза относительно пакетов - полблока
+        start = arrival[0] + self.block_interval / 2
+        end = arrival[0] + self.traffic.duration  # После конца трафика опустошения не считаем
+        callbacks = 0
+        tick = start
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            while tick <= end:
+                arrival_time = arrival[0] if arrival is not None else math.inf
+                event_time = events[0][0] if events else math.inf
+                if tick <= arrival_time and tick <= event_time:
+                    self.now = tick
+                    mixer.mix(sources, out, tick, tick + self.output_latency)
+                    callbacks += 1
+                    tick = start + callbacks * self.block_interval
+                elif arrival_time <= event_time:
+                    self.now = arrival_time
+                    _, seq, timestamp_us, flags, packet_type = arrival
+                    source.receive(self.audio_packet(seq, timestamp_us, flags, packet_type), arrival_time)
+                    arrival = next(arrivals, None)
+                else:
+                    when, _, data = heapq.heappop(events)
+                    self.now = when
+                    source.receive(data, when)
+        elapsed = time.perf_counter() - started
+        return self.result(callbacks * self.block_interval, elapsed)
+
+    def result(self, simulated, elapsed):
+        source = self.source
+        trace = source.trace
+        jitter_buffer = source.jitter_buffer
+        minutes = simulated / 60
+        glitches = source.underruns + jitter_buffer.concealed
+        p50, p99, latency_max = trace.percentiles()
+        return {
+            'config': format_config(self.config),
+            'seconds': simulated,
+            'played': trace.played,
+            'underruns': source.underruns,
+            'underrun_ms': trace.underrun_frames / self.rate * 1000,
+            'concealed': jitter_buffer.concealed,
+            'glitches_per_min': glitches / minutes if minutes else 0.0,
+            'lost': trace.drops.get(REASON_GAP, 0),
+            'late': trace.drops.get(REASON_LATE, 0),
+            'duplicate': trace.drops.get(REASON_DUPLICATE, 0),
+            'overflow': trace.drops.get(REASON_BUFFER_FULL, 0),
+            'nack_requested': source.nack_requested,
+            'nack_recovered': source.nack_recovered,
+            'sync_held': source.sync_held,
+            'sync_skipped': source.sync_skipped,
+            'latency_p50_ms': p50,
+            'latency_p99_ms': p99,
+            'latency_max_ms': latency_max,
+            'speedup': simulated / elapsed if elapsed else 0.0,
+        }
+
+
+def format_config(config):
+    """Короткая подпись конфигурации для таблицы"""
+    if config.get('delay') is None:
+        text = f"буфер {config.get('depth', 1)}"
+    else:
+        text = f"синхр {config['delay']:g}мс"
+    text += " NACK" if config.get('nack') else ""
+    if config.get('block'):
+        text += f" блок {config['block']}"
+    return text
+
+
+def build_configs(depths, nacks, delays, blocks):
+    """Сетка конфигураций; в синхронном режиме глубину задаёт задержка - повторы не прогоняем"""
+    configs = []
+    for delay, nack, block, depth in itertools.product(delays, nacks, blocks, depths):
+        config = {'delay': delay, 'nack': nack, 'block': block, 'depth': depth if delay is None else None}
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+def simulate(traffic, config, rtt, drift_ppm, output_latency):
+    """Одна конфигурация (в отдельном процессе при --jobs > 1)"""
+    return PipelineSimulation(traffic, config, rtt, drift_ppm, output_latency).run()
+
+
+def run_simulations(traffic, configs, rtt=SIM_RTT, drift_ppm=0.0, output_latency=None, jobs=1):
+    """Все конфигурации на одном и том же трафике"""
+    if jobs <= 1 or len(configs) == 1:
+        return [simulate(traffic, config, rtt, drift_ppm, output_latency) for config in configs]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(simulate, traffic, config, rtt, drift_ppm, output_latency) for config in configs]
+        return [future.result() for future in futures]
+
+
+def print_results(results):
+    print(f"{'конфигурация':<24} {'сбоев/мин':>9} {'опуст.':>7} {'маскир.':>7} {'потери':>7} {'поздно':>6} "
+          f"{'перепол.':>8} {'NACK':>11} {'задержка p50/p99/макс мс':>25} {'скорость':>9}")
+    for r in results:
+        nack = f"{r['nack_recovered']}/{r['nack_requested']}" if r['nack_requested'] else "-"
+        latency = f"{r['latency_p50_ms']:.1f}/{r['latency_p99_ms']:.1f}/{r['latency_max_ms']:.1f}"
+        print(f"{r['config']:<24} {r['glitches_per_min']:9.2f} {r['underruns']:7d} {r['concealed']:7d} "
+              f"{r['lost']:7d} {r['late']:6d} {r['overflow']:8d} {nack:>11} {latency:>25} {r['speedup']:8.0f}x")
+
+
+def save_csv(results, csv_path):
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write(",".join(results[0].keys()) + "\n")
+        for r in results:
+            f.write(",".join(f"{v:.3f}" if isinstance(v, float) else str(v) for v in r.values()) + "\n")
+
+
+def parse_list(text, convert=int):
+    """'1,2,3' -> [1, 2, 3]; 'нет'/'none' - None (асинхронный режим, блок как чанк)"""
+    return [None if item.strip().lower() in ('none', 'нет', '-') else convert(item) for item in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция приёма и воспроизведения клиента быстрее реального "
+                                                 "времени: сетка настроек буфера по одной трассе прихода пакетов")
+    parser.add_argument('--trace', help="Трасса клиента (StreamAudio_client.trace) вместо генерируемого трафика")
+    parser.add_argument('--stream', type=int, default=0, help="Поток трассы")
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE)
+    parser.add_argument('--chunk', type=int, default=SIM_CHUNK, help="Чанк генерируемого потока")
+    parser.add_argument('--duration', type=float, default=SIM_DURATION, help="Секунд генерируемого трафика")
+    parser.add_argument('--base-delay', type=float, default=SIM_BASE_DELAY * 1000, help="Минимум в пути, мс")
+    parser.add_argument('--jitter', type=float, default=SIM_JITTER * 1000, help="Средняя добавка в пути, мс")
+    parser.add_argument('--spike-rate', type=float, default=SIM_SPIKE_RATE, help="Всплесков задержки в секунду")
+    parser.add_argument('--spike', type=float, default=SIM_SPIKE * 1000, help="Средняя высота всплеска, мс")
+    parser.add_argument('--loss', type=float, default=SIM_LOSS * 100, help="Потери, %%")
+    parser.add_argument('--burst', type=float, default=SIM_LOSS_BURST, help="Средняя длина серии потерь")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rtt', type=float, default=SIM_RTT * 1000, help="RTT до сервера для NACK/SYNC/JOIN, мс")
+    parser.add_argument('--drift', type=float, default=0.0, help="Уход кварца устройства клиента, ppm")
+    parser.add_argument('--output-latency', type=float, help="Задержка устройства, мс (по умолчанию - блок)")
+    parser.add_argument('--depth', default='1,2,3', help="Глубины буфера (асинхронный режим)")
+    parser.add_argument('--nack', default='0,1', help="Повторы выкл/вкл")
+    parser.add_argument('--delay', default='none', help="Задержки синхронного воспроизведения, мс (none - выкл)")
+    parser.add_argument('--block', default='none', help="Блоки устройства, кадров (none - как чанк)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="Процессов")
+    parser.add_argument('--csv', help="Сохранить результаты в CSV")
+    args = parser.parse_args()
+
+    if not 0 <= args.loss < 100 or args.burst < 1:
+        print("[ERROR] Потери - от 0 до 100%, длина серии - не меньше 1")
+        sys.exit(1)
+    try:
+        if args.trace:
+            traffic = RecordedTraffic(args.trace, args.stream, args.rate)
+        else:
+            traffic = NetworkModel(args.duration, args.rate, args.chunk, args.base_delay / 1000, args.jitter / 1000,
+                                   args.spike_rate, args.spike / 1000, args.loss / 100, args.burst, args.seed)
+        configs = build_configs(parse_list(args.depth), [bool(n) for n in parse_list(args.nack)],
+                                parse_list(args.delay, float), parse_list(args.block))
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+    output_latency = None if args.output_latency is None else args.output_latency / 1000
+    print(f"Прогон: {traffic.duration:.0f} с трафика, chunk {traffic.chunk}, {traffic.rate} Гц, "
+          f"{traffic.describe()}, {len(configs)} конфигураций")
+    if args.trace:
+        print("Задержки - от минимального времени в пути в трассе (часы сервера и клиента не сверены)")
+    started = time.perf_counter()
+    results = run_simulations(traffic, configs, args.rtt / 1000, args.drift, output_latency, args.jobs)
+    print_results(results)
+    print(f"Всего {time.perf_counter() - started:.1f} с")
+    if args.csv:
+        save_csv(results, args.csv)
+        print(f"Результаты сохранены в {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
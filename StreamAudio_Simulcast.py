@@ -0,0 +1,203 @@
+import os
+import queue
+import socket
+import threading
+import time
+import numpy as np
+
+from StreamAudio_Protocol import PACKET_AUDIO, pack_header, parse_header, build_sid, build_format
+from StreamAudio_Codec import STREAM_VARIANTS, ENCODING_NAMES, StreamEncoder
+from StreamAudio_Feedback import ClientHealthTable, Retransmitter
+from StreamAudio_Trace import EVENT_SEND, EVENT_DROP, REASON_QUEUE_FULL
+
+# Simulcast: один захват публикуется несколькими уровнями качества, у каждого своя группа, чанк и кодек.
+# Основной поток сервера - уровень 0, дополнительные уровни получают id потока 1, 2, ...
+CHANNELS = 2
+TIER_QUEUE = 4  # Чанков в очереди потока пула; при отставании выбрасываются старые
+FORMAT_INTERVAL = 1.0
+SIMULCAST_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def parse_tiers(text, default_port):
+    """Уровни из строки "группа[:порт] чанк вариант; ...". Возвращает [(группа, порт, чанк, вариант)]"""
+    tiers = []
+    for item in text.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(None, 2)
+        if len(parts) != 3:
+            raise ValueError(f"уровень '{item}': ожидается 'группа[:порт] чанк вариант'")
+        address, chunk, variant = parts
+        group, _, port = address.partition(':')
+        socket.inet_aton(group)  # Проверка адреса (OSError при ошибке)
+        if variant not in STREAM_VARIANTS:
+            raise ValueError(f"уровень '{item}': неизвестный вариант, доступны: {', '.join(STREAM_VARIANTS)}")
+        tiers.append((group, int(port) if port else default_port, int(chunk), variant))
+    return tiers
+
+
+class Tier:
+    """Дополнительный уровень: накопление захваченных чанков до своего размера, кодирование, отправка"""
+
+    def __init__(self, stream_id, group, port, chunk, variant, capture_rate):
+        self.stream_id = stream_id
+        self.addr = (group, port)
+        self.variant = variant
+        self.encoder = StreamEncoder(variant, capture_rate, CHANNELS, chunk)
+        # Чанк уровня собирается из чанков захвата (размеры не обязаны делиться)
+        self.block = np.zeros((chunk, CHANNELS), dtype=np.int16)
+        self.fill = 0
+        self.block_timestamp = 0
+        self.seq = 0
+        self.retransmitter = Retransmitter()
+        self.health = ClientHealthTable()
+        self.last_format_time = 0.0
+        self.trace = None
+
+        self.packet_count = 0
+        self.bytes_sent = 0
+        self.dropped = 0  # Чанки захвата, выброшенные из переполненной очереди
+        self.cpu_time = 0.0  # Время CPU на накопление и кодирование
+        self.send_time = 0.0  # Время в вызовах отправки
+        self.send_count = 0
+
+    def label(self):
+        encoder = self.encoder
+        return (f"#{self.stream_id} {self.addr[0]}:{self.addr[1]} {encoder.rate}Hz/{encoder.channels}ch "
+                f"{ENCODING_NAMES[encoder.encoding]}/{encoder.chunk}")
+
+    def process(self, kind, data, timestamp_us, transmit):
+        """Чанк захвата (kind=PACKET_AUDIO) или описатель тишины. Вызывается только своим потоком пула"""
+        started = time.thread_time()
+        now = time.time()
+        packets = []  # (номер, пакет)
+        if now - self.last_format_time >= FORMAT_INTERVAL:
+            self.last_format_time = now
+            encoder = self.encoder
+            packets.append((self.seq, build_format(self.seq, int(now * 1000000), encoder.rate, encoder.channels,
+                                                   encoder.encoding, encoder.chunk, self.stream_id)))
+            self.seq += 1
+
+        if kind == PACKET_AUDIO:
+            samples = data
+            offset = 0
+            while offset < len(samples):
+                if self.fill == 0:
+                    self.block_timestamp = timestamp_us
+                count = min(len(self.block) - self.fill, len(samples) - offset)
+                self.block[self.fill:self.fill + count] = samples[offset:offset + count]
+                self.fill += count
+                offset += count
+                if self.fill == len(self.block):
+                    self.fill = 0
+                    for encoded in self.encoder.encode(self.block):
+                        packets.append((self.seq, pack_header(PACKET_AUDIO, self.seq, self.block_timestamp,
+                                                              self.stream_id) + encoded))
+                        self.seq += 1
+        else:
+            # Тишина: неполный чанк не дополняем звуком после паузы
+            self.fill = 0
+            noise_level = data
+            packets.append((self.seq, build_sid(self.seq, timestamp_us, noise_level, self.encoder.chunk,
+                                                self.stream_id)))
+            self.seq += 1
+        self.cpu_time += time.thread_time() - started
+
+        trace = self.trace
+        for seq, packet in packets:
+            self.retransmitter.history.store(seq, packet)
+            sent_at = time.perf_counter()
+            transmit(packet, self.addr)
+            send_time = time.perf_counter() - sent_at
+            self.send_time += send_time
+            self.send_count += 1
+            self.bytes_sent += len(packet)
+            if trace:
+                packet_type, _, _, _, packet_timestamp = parse_header(packet)
+                trace.record(EVENT_SEND, seq, packet_timestamp, len(packet), packet_type, self.stream_id,
+                             value=send_time * 1000000)
+        self.packet_count += len(packets)
+
+    def report(self, elapsed):
+        """Строка статистики уровня: темп, битрейт, доля CPU и время отправки"""
+        send_us = self.send_time / self.send_count * 1000000 if self.send_count else 0
+        text = (f"{self.label()}: {self.packet_count / elapsed:.0f} пак/с, "
+                f"{self.bytes_sent * 8 / elapsed / 1000:.0f} кбит/с, CPU {self.cpu_time / elapsed * 100:.1f}%, "
+                f"отправка {send_us:.0f} мкс")
+        clients = len(self.health.active())
+        if clients:
+            text += f", клиентов {clients}"
+        if self.dropped:
+            text += f", пропущено {self.dropped}"
+        return text
+
+
+class Simulcast:
+    """Дополнительные уровни одного захвата: кодирование в пуле потоков, уровень закреплён за потоком"""
+
+    def __init__(self, tiers, capture_rate, transmit, workers=SIMULCAST_WORKERS, trace=None):
+        self.tiers = [Tier(index + 1, group, port, chunk, variant, capture_rate)
+                      for index, (group, port, chunk, variant) in enumerate(tiers)]
+        self.trace = trace
+        for tier in self.tiers:
+            tier.trace = trace
+        self.transmit = transmit
+        self.workers = max(1, min(workers, len(self.tiers)))
+        self.queues = [queue.Queue(maxsize=TIER_QUEUE * len(self.tiers)) for _ in range(self.workers)]
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.worker_loop, args=(index,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
+
+    def tier_for(self, stream_id):
+        if 0 < stream_id <= len(self.tiers):
+            return self.tiers[stream_id - 1]
+        return None
+
+    def submit(self, kind, data, timestamp_us):
+        """Чанк захвата после обработки (или уровень шума для SID) всем уровням. Не блокирует поток отправки"""
+        for index, tier in enumerate(self.tiers):
+            work = self.queues[index % self.workers]
+            try:
+                work.put_nowait((tier, kind, data, timestamp_us))
+            except queue.Full:
+                # Поток пула не успевает: выбрасываем старейший чанк, как очередь основного потока
+                try:
+                    dropped = work.get_nowait()
+                    dropped[0].dropped += 1
+                    work.put_nowait((tier, kind, data, timestamp_us))
+                except (queue.Empty, queue.Full):
+                    dropped = (tier, kind, data, timestamp_us)
+                    tier.dropped += 1
+                if self.trace:
+                    self.trace.record(EVENT_DROP, timestamp_us=dropped[3], packet_type=dropped[1],
+                                      stream=dropped[0].stream_id, reason=REASON_QUEUE_FULL,
+                                      depth=work.qsize(), value=1)
+
+    def worker_loop(self, index):
+        work = self.queues[index]
+        while self.running:
+            try:
+                tier, kind, data, timestamp_us = work.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            try:
+                tier.process(kind, data, timestamp_us, self.transmit)
+            except Exception as e:
+                if self.running:
+                    print(f"[ERROR] Simulcast {tier.label()}: {e}")
+
+    def report(self, elapsed):
+        return [tier.report(elapsed) for tier in self.tiers]
@@ -0,0 +1,123 @@
+import math
+import socket
+import struct
+import sys
+
+from StreamAudio_Protocol import HEADER_SIZE, DEFAULT_MTU
+from StreamAudio_Codec import ENCODING_PCM16, payload_size
+
+# Настройка сокетов потока: маркировка QoS, буферы под темп пакетов, busy poll и интерфейс multicast.
+# Каждая опция читается обратно - ядро может урезать буфер или молча не дать приоритет
+DSCP_CLASSES = {
+    'Нет': None,
+    'EF (46)': 46,  # Expedited Forwarding - звук реального времени
+    'CS5 (40)': 40,
+    'AF41 (34)': 34,  # Интерактивные мультимедиа
+    'CS4 (32)': 32,
+}
+DEFAULT_DSCP = 'EF (46)'
+SOCKET_PRIORITY = 6  # SO_PRIORITY (Linux): максимум без CAP_NET_ADMIN, полоса "interactive" в pfifo_fast
+BUSY_POLL_US = 50  # SO_BUSY_POLL (Linux): recv опрашивает драйвер вместо ожидания прерывания
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46 if sys.platform.startswith('linux') else None)
+MULTICAST_TTL = 2
+CHANNELS = 2
+
+# Буферы ядра под темп пакетов профиля: большой буфер отправки только копит задержку,
+# буфер приёма должен пережить остановку потока приёма планировщиком
+SEND_BUFFER_TIME = 0.05
+RECEIVE_BUFFER_TIME = 0.1
+DATAGRAM_OVERHEAD = 768  # Служебные структуры ядра на датаграмму (skb), учитываются в буфере
+MIN_SOCKET_BUFFER = 16384
+
+
+def socket_buffer_size(chunk, rate, seconds, packets=0, mtu=DEFAULT_MTU):
+    """Буфер ядра на seconds звука плюс packets пакетов PCM стерео с чанком chunk (с учётом фрагментации)"""
+    packet = HEADER_SIZE + payload_size(CHANNELS, ENCODING_PCM16, chunk)
+    datagrams = math.ceil(packet / mtu)
+    count = math.ceil(rate / chunk * seconds) + packets
+    return max(MIN_SOCKET_BUFFER, count * datagrams * (min(packet, mtu) + DATAGRAM_OVERHEAD))
+
+
+class SocketTuning:
+    """Опции сокетов сервера и клиента и значения, которые ядро реально применило"""
+
+    def __init__(self, dscp=DSCP_CLASSES[DEFAULT_DSCP], priority=SOCKET_PRIORITY, busy_poll=BUSY_POLL_US,
+                 interface='', ttl=MULTICAST_TTL, loopback=True):
+        if interface:
+            socket.inet_aton(interface)  # Проверка адреса (OSError при ошибке)
+        self.dscp = dscp
+        self.priority = priority
+        self.busy_poll = busy_poll
+        self.interface = interface
+        self.ttl = ttl
+        self.loopback = loopback
+        self.applied = {}  # опция -> (запрошено, применено); применено None - ядро отказало
+
+    def set_option(self, sock, name, level, option, value, readback=True):
+        """Установить опцию и записать, что получилось. False - опция недоступна"""
+        if option is None:
+            self.applied[name] = (value, None)
+            return False
+        try:
+            sock.setsockopt(level, option, value)
+            effective = sock.getsockopt(level, option) if readback else value
+        except OSError as e:
+            print(f"[WARNING] {name}={value} не применено: {e}")
+            self.applied[name] = (value, None)
+            return False
+        self.applied[name] = (value, effective)
+        return True
+
+    def apply_common(self, sock):
+        """Маркировка исходящих пакетов (и отчётов/NACK клиента)"""
+        if self.dscp is not None:
+            self.set_option(sock, 'IP_TOS', socket.IPPROTO_IP, getattr(socket, 'IP_TOS', None), self.dscp << 2)
+        if self.priority is not None:
+            self.set_option(sock, 'SO_PRIORITY', socket.SOL_SOCKET, getattr(socket, 'SO_PRIORITY', None),
+                            self.priority)
+
+    def apply_sender(self, sock, send_buffer):
+        """Сокет отправки потока"""
+        self.set_option(sock, 'IP_MULTICAST_TTL', socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        # Включаем loopback для multicast (чтобы работало на одном компьютере)
+        self.set_option(sock, 'IP_MULTICAST_LOOP', socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(self.loopback))
+        if self.interface:
+            self.set_option(sock, 'IP_MULTICAST_IF', socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                            socket.inet_aton(self.interface), readback=False)
+        self.apply_common(sock)
+        self.set_buffer(sock, 'SO_SNDBUF', send_buffer)
+
+    def apply_receiver(self, sock, receive_buffer):
+        """Сокет приёма потока (через него же уходят отчёты и NACK)"""
+        self.set_option(sock, 'IP_MULTICAST_LOOP', socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(self.loopback))
+        self.apply_common(sock)
+        if self.busy_poll:
+            self.set_option(sock, 'SO_BUSY_POLL', socket.SOL_SOCKET, SO_BUSY_POLL, self.busy_poll)
+        self.set_buffer(sock, 'SO_RCVBUF', receive_buffer)
+
+    def set_buffer(self, sock, name, size):
+        """SO_SNDBUF/SO_RCVBUF (можно менять на лету при смене профиля)"""
+        self.set_option(sock, name, socket.SOL_SOCKET, getattr(socket, name), size)
+
+    def membership(self, group):
+        """mreq для IP_ADD_MEMBERSHIP: подписка через выбранный интерфейс (или любой)"""
+        if self.interface:
+            return socket.inet_aton(group) + socket.inet_aton(self.interface)
+        return struct.pack('4sL', socket.inet_aton(group), socket.INADDR_ANY)
+
+    def report(self):
+        """Строка для лога и GUI: запрошено -> применено по каждой опции"""
+        items = []
+        for name, (requested, effective) in self.applied.items():
+            if name == 'IP_TOS':
+                text = f"DSCP {requested >> 2}" + ("" if effective is None else f" (TOS {effective:#04x})")
+            elif name == 'IP_MULTICAST_IF':
+                text = f"интерфейс {self.interface}"
+            else:
+                text = f"{name} {requested}"
+                if effective is not None and effective != requested:
+                    text += f" -> {effective}"  # Linux удваивает буферы, rmem_max/wmem_max урезают
+            if effective is None:
+                text += " ✗"
+            items.append(text)
+        return ", ".join(items)
@@ -0,0 +1,272 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+import itertools
+import numpy as np
+
+# Побайтовая трасса пакетов: заголовок | кольцо записей фиксированного размера (memory-mapped)
+TRACE_MAGIC = b'SATRACE1'
+TRACE_HEADER = struct.Struct('<8sIIQ')  # magic, размер записи, ёмкость, записано
+TRACE_HEADER_SIZE = 64
+# время события, время отправителя (мкс), seq, размер, событие, тип пакета, id потока, причина, глубина, значение
+TRACE_RECORD = struct.Struct('<dQIHBBBBHI')
+TRACE_DTYPE = np.dtype([('time', '<f8'), ('timestamp_us', '<u8'), ('seq', '<u4'), ('size', '<u2'),
+                        ('event', 'u1'), ('packet_type', 'u1'), ('stream', 'u1'), ('reason', 'u1'),
+                        ('depth', '<u2'), ('value', '<u4')])
+
+DEFAULT_SERVER_TRACE = 'StreamAudio_server.trace'
+DEFAULT_CLIENT_TRACE = 'StreamAudio_client.trace'
+DEFAULT_TRACE_RECORDS = 1 << 20  # 32 МБ: около 20 минут на поток 172 пак/с с обеих сторон
+
+# События
+EVENT_SEND = 0  # value - время в sendto, мкс
+EVENT_RECEIVE = 1  # время прихода; timestamp_us - время захвата на сервере
+EVENT_PLAY = 2  # time - когда пакет прозвучит (часы клиента)
+EVENT_DROP = 3  # reason - причина, value - сколько пакетов
+EVENT_CALLBACK = 4  # size - кадров, value - длительность, timestamp_us - бюджет блока (мкс)
+EVENT_NAMES = {EVENT_SEND: 'send', EVENT_RECEIVE: 'receive', EVENT_PLAY: 'play', EVENT_DROP: 'drop',
+               EVENT_CALLBACK: 'callback'}
+
+# Причины (для DROP - почему пакет не сыгран/не отправлен)
+REASON_NONE = 0
+REASON_QUEUE_FULL = 1  # Очередь отправки переполнена, выброшен старейший чанк
+REASON_LATE = 2  # Номер уже проигран
+REASON_DUPLICATE = 3
+REASON_BUFFER_FULL = 4  # Буфер сверх максимальной глубины
+REASON_GAP = 5  # Разрыв номеров при приёме
+REASON_CONCEALED = 6  # Дыра не дождалась повтора и пропущена при воспроизведении
+REASON_SIZE = 7  # Размер данных не совпал с форматом
+REASON_RETRANSMIT = 8  # Отправлен/принят повтор
+REASON_UNDERRUN = 9  # Воспроизводить нечего
+REASON_XRUN = 10  # PortAudio сообщил о переполнении/опустошении
+REASON_NAMES = {REASON_NONE: '', REASON_QUEUE_FULL: 'queue_full', REASON_LATE: 'late',
+                REASON_DUPLICATE: 'duplicate', REASON_BUFFER_FULL: 'buffer_full', REASON_GAP: 'gap',
+                REASON_CONCEALED: 'concealed', REASON_SIZE: 'size', REASON_RETRANSMIT: 'retransmit',
+                REASON_UNDERRUN: 'underrun', REASON_XRUN: 'xrun'}
+
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class TraceWriter:
+    """Запись событий в кольцевой memory-mapped файл. Из любых потоков, без блокировок и системных вызовов"""
+
+    def __init__(self, path, capacity=DEFAULT_TRACE_RECORDS):
+        self.path = path
+        self.capacity = capacity
+        file_size = TRACE_HEADER_SIZE + capacity * TRACE_RECORD.size
+        # Файл создаётся заранее целиком - в горячем пути только запись в память
+        with open(path, 'wb') as f:
+            f.truncate(file_size)
+        self._file = open(path, 'r+b')
+        self._mm = mmap.mmap(self._file.fileno(), file_size)
+        TRACE_HEADER.pack_into(self._mm, 0, TRACE_MAGIC, TRACE_RECORD.size, capacity, 0)
+        # next() у itertools.count атомарен под GIL - номер записи без блокировки
+        self._counter = itertools.count()
+        self._closed = False
+
+    def record(self, event, seq=0, timestamp_us=0, size=0, packet_type=0, stream=0, reason=REASON_NONE,
+               depth=0, value=0, event_time=None):
+        """Добавить событие (значения обрезаются до ширины полей, чтобы не бросать исключений в горячем пути)"""
+        if self._closed:
+            return
+        index = next(self._counter)
+        try:
+            TRACE_RECORD.pack_into(self._mm, TRACE_HEADER_SIZE + (index % self.capacity) * TRACE_RECORD.size,
+                                   time.time() if event_time is None else event_time, timestamp_us,
+                                   seq & 0xFFFFFFFF, min(size, 0xFFFF), event, packet_type, stream, reason,
+                                   min(depth, 0xFFFF), min(max(int(value), 0), 0xFFFFFFFF))
+            # Счётчик пишем последним, чтобы анализатор не читал незаписанную запись
+            struct.pack_into('<Q', self._mm, TRACE_HEADER.size - 8, index + 1)
+        except (ValueError, TypeError):
+            pass  # Файл закрыт другим потоком
+
+    def close(self):
+        """Закрыть трассу (содержимое остаётся на диске для анализа)"""
+        self._closed = True
+        try:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+        except (ValueError, OSError):
+            pass
+
+
+def load_trace(path):
+    """Записи трассы в хронологическом порядке как структурированный массив NumPy"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, record_size, capacity, count = TRACE_HEADER.unpack_from(data, 0)
+    if magic != TRACE_MAGIC:
+        raise ValueError(f"{path}: не является трассой StreamAudio")
+    if record_size != TRACE_DTYPE.itemsize:
+        raise ValueError(f"{path}: неподдерживаемый размер записи {record_size}")
+    records = np.frombuffer(data, dtype=TRACE_DTYPE, count=capacity, offset=TRACE_HEADER_SIZE)
+    if count > capacity:
+        # Кольцо перезаписано: старейшая запись - сразу за последней
+        start = count % capacity
+        records = np.concatenate((records[start:], records[:start]))
+    else:
+        records = records[:count]
+    # Потоки пишут параллельно - порядок номеров может немного расходиться со временем
+    return records[np.argsort(records['time'], kind='stable')]
+
+
+def loss_bursts(records, stream=None):
+    """Серии потерянных номеров по принятым пакетам (повторы учитываются).
+    [(id потока, первый seq, длина, время прихода следующего пакета)]"""
+    received = records[records['event'] == EVENT_RECEIVE]
+    bursts = []
+    # У каждого потока своя нумерация
+    for stream_id in ([stream] if stream is not None else np.unique(received['stream'])):
+        stream_received = received[received['stream'] == stream_id]
+        if len(stream_received) < 2:
+            continue
+        seqs, first = np.unique(stream_received['seq'].astype(np.int64), return_index=True)
+        times = stream_received['time'][first]
+        gaps = np.diff(seqs) - 1
+        lost = np.nonzero(gaps > 0)[0]
+        bursts.extend((int(stream_id), int(seqs[i] + 1), int(gaps[i]), float(times[i + 1])) for i in lost)
+    return bursts
+
+
+def jitter_timeline(records, window=1.0, stream=None):
+    """Джиттер по окнам: [(начало окна, пакетов, средний |Δ времени в пути| мс, размах времени в пути мс)]"""
+    received = records[(records['event'] == EVENT_RECEIVE) & (records['reason'] != REASON_RETRANSMIT)
+                       & (records['timestamp_us'] > 0)]
+    if stream is not None:
+        received = received[received['stream'] == stream]
+    if len(received) < 2:
+        return []
+    # Часы сервера и клиента не совпадают - интересны только изменения времени в пути
+    transit = received['time'] - received['timestamp_us'] / 1000000
+    delta = np.abs(np.diff(transit, prepend=transit[0]))
+    windows = ((received['time'] - received['time'][0]) // window).astype(np.int64)
+    timeline = []
+    for index in np.unique(windows):
+        mask = windows == index
+        window_transit = transit[mask]
+        timeline.append((index * window, int(mask.sum()), float(delta[mask].mean() * 1000),
+                         float((window_transit.max() - window_transit.min()) * 1000)))
+    return timeline
+
+
+def latency_percentiles(records, percentiles=LATENCY_PERCENTILES):
+    """Перцентили задержек в мс: {название: [значения]} по тем событиям, что есть в трассе"""
+    result = {}
+    sent = records[(records['event'] == EVENT_SEND) & (records['reason'] != REASON_RETRANSMIT)
+                   & (records['timestamp_us'] > 0)]
+    if len(sent):
+        # Сервер: от захвата до отправки - очередь, обработка и кодирование (одни часы)
+        result['захват → отправка'] = sent['time'] - sent['timestamp_us'] / 1000000
+        result['sendto'] = sent['value'] / 1000000
+    received = records[(records['event'] == EVENT_RECEIVE) & (records['timestamp_us'] > 0)]
+    if len(received):
+        # Клиент: время в пути относительно лучшего пакета (часы сервера и клиента не сверены)
+        transit = received['time'] - received['timestamp_us'] / 1000000
+        result['в пути (от минимума)'] = transit - transit.min()
+    played = records[(records['event'] == EVENT_PLAY) & (records['timestamp_us'] > 0)]
+    if len(played):
+        # От захвата до звука - точно, если часы синхронизированы (NTP/одна машина)
+        result['захват → звук'] = played['time'] - played['timestamp_us'] / 1000000
+    callbacks = records[records['event'] == EVENT_CALLBACK]
+    if len(callbacks):
+        result['callback'] = callbacks['value'] / 1000000
+    return {name: np.percentile(values, percentiles) * 1000 for name, values in result.items()}
+
+
+def summarize(records):
+    """Счётчики событий и причин: {(событие, причина): (записей, пакетов)}"""
+    summary = {}
+    for event in np.unique(records['event']):
+        selected = records[records['event'] == event]
+        for reason in np.unique(selected['reason']):
+            matched = selected[selected['reason'] == reason]
+            packets = int(matched['value'].sum()) if event == EVENT_DROP else len(matched)
+            summary[(int(event), int(reason))] = (len(matched), packets)
+    return summary
+
+
+def callback_overruns(records):
+    """Callback дольше бюджета блока: (всего, превышений, xrun)"""
+    callbacks = records[records['event'] == EVENT_CALLBACK]
+    over = np.count_nonzero((callbacks['timestamp_us'] > 0) & (callbacks['value'] > callbacks['timestamp_us']))
+    return len(callbacks), int(over), int(np.count_nonzero(callbacks['reason'] == REASON_XRUN))
+
+
+def export_csv(records, csv_path):
+    """Все записи трассы в CSV"""
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write("time,event,packet_type,stream,seq,timestamp_us,size,reason,depth,value\n")
+        for r in records:
+            f.write(f"{r['time']:.6f},{EVENT_NAMES.get(int(r['event']), r['event'])},{r['packet_type']},"
+                    f"{r['stream']},{r['seq']},{r['timestamp_us']},{r['size']},"
+                    f"{REASON_NAMES.get(int(r['reason']), r['reason'])},{r['depth']},{r['value']}\n")
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Анализ трассы пакетов сервера/клиента StreamAudio")
+    parser.add_argument('trace', help="Файл трассы")
+    parser.add_argument('--stream', type=int, help="Только поток с этим id")
+    parser.add_argument('--window', type=float, default=1.0, help="Окно графика джиттера, с")
+    parser.add_argument('--bursts', type=int, default=10, help="Сколько самых длинных серий потерь показать")
+    parser.add_argument('--csv', help="Дополнительно сохранить все записи в CSV")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.trace):
+        print(f"[ERROR] Файл трассы не найден: {args.trace}")
+        sys.exit(1)
+
+    records = load_trace(args.trace)
+    if args.stream is not None:
+        records = records[records['stream'] == args.stream]
+    if not len(records):
+        print("Трасса пуста")
+        return
+    duration = records['time'][-1] - records['time'][0]
+    print(f"{len(records)} записей за {duration:.1f} с")
+
+    print("\nСобытия:")
+    for (event, reason), (count, packets) in sorted(summarize(records).items()):
+        name = EVENT_NAMES.get(event, str(event))
+        if reason != REASON_NONE:
+            name += f"/{REASON_NAMES.get(reason, reason)}"
+        extra = f" ({packets} пакетов)" if packets != count else ""
+        print(f"  {name:<22} {count}{extra}")
+
+    bursts = loss_bursts(records, args.stream)
+    if bursts:
+        lengths = np.array([length for _, _, length, _ in bursts])
+        print(f"\nПотери: {lengths.sum()} пакетов в {len(bursts)} сериях, "
+              f"средняя {lengths.mean():.1f}, максимум {lengths.max()}")
+        start = records['time'][0]
+        for stream_id, seq, length, when in sorted(bursts, key=lambda b: -b[2])[:args.bursts]:
+            print(f"  +{when - start:8.3f} с  #{stream_id} seq {seq}..{seq + length - 1} ({length})")
+
+    timeline = jitter_timeline(records, args.window, args.stream)
+    if timeline:
+        print("\nДжиттер (окно, пакетов, средний |Δ| мс, размах мс):")
+        for window_start, packets, mean_delta, spread in timeline:
+            print(f"  +{window_start:7.1f} с  {packets:5d}  {mean_delta:6.2f}  {spread:6.2f}")
+
+    percentiles = latency_percentiles(records)
+    if percentiles:
+        header = "  ".join(f"{'p' + format(p, 'g'):>7}" for p in LATENCY_PERCENTILES)
+        print(f"\n{'Задержки, мс:':<27}{header}")
+        for name, values in percentiles.items():
+            print(f"  {name:<24} " + "  ".join(f"{v:7.2f}" for v in values))
+
+    total, over, xruns = callback_overruns(records)
+    if total:
+        print(f"\nCallback: {total}, дольше бюджета блока {over}, xrun {xruns}")
+
+    if args.csv:
+        count = export_csv(records, args.csv)
+        print(f"\nЗаписи ({count}) сохранены в {args.csv}")
+
+
+if __name__ == "__main__":
+    main()